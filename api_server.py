@@ -0,0 +1,314 @@
+"""
+物調表產生服務 (本機 HTTP)：讓 CRM 等系統直接產生物調表，與 Streamlit 介面分開執行。
+
+    python api_server.py --port 8502 --workers 4 --queue 16 [--pool process]
+
+    POST /generate          JSON {"fields": {標籤: 值}, "cells": {座標: 值}, "map_image": base64}
+                            → xlsx (整份產生後分段寫出，不是邊產生邊傳送；檔名在 Content-Disposition，警告在 X-Survey-Warnings)
+    POST /parse-transcript  本文為謄本 PDF → JSON {"units": [每戶資料], "warnings": [...], "more": 是否可能還有其他戶}
+                            預設只解析第一戶；加 ?units=all 解析全部建物標示部
+    GET  /health            → JSON 工作池狀態
+
+工作交給固定大小的執行緒/程序池；執行中加排隊中的請求超過上限時立即回 429 (Retry-After)。
+設定 SURVEY_API_TOKEN 時，請求需帶相同的 X-API-Key 標頭。
+"""
+import argparse
+import base64
+import binascii
+import io
+import json
+import os
+import sys
+import threading
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+import metrics
+from survey_core import export_workbook
+from template_schema import SELECT_PLACEHOLDER, get_template_schema
+from transcript import PDFReadError, parse_transcript_cached
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.xlsx")
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+WRITE_CHUNK = 64 * 1024  # 回應分段寫出的大小
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+MAX_BODY_BYTES = _env_int("SURVEY_API_MAX_BODY", 30 * 1024 * 1024)
+
+
+def fields_to_inputs(schema, fields=None, cells=None):
+    """{標籤: 值} 與 {座標: 值} 轉成與表單相同的 {座標: 輸入值}；標籤比對規則與謄本匯入相同"""
+    user_inputs = {item["coordinate"]: "" for item in schema.scanned_items}
+    for key, value in (fields or {}).items():
+        coord = schema.resolve_label(str(key).strip())
+        if coord and coord not in schema.image_coords and value is not None:
+            value = str(value)
+            user_inputs[coord] = "" if value == SELECT_PLACEHOLDER else value
+    for coord, value in (cells or {}).items():
+        if coord in user_inputs and coord not in schema.image_coords and value is not None:
+            user_inputs[coord] = str(value)
+    return user_inputs
+
+
+# --- 工作函式 (程序池需可 pickle，放在模組層級) ---
+
+def generate_job(template_path, fields, cells, image_bytes):
+    with metrics.request("api_export"):
+        schema = get_template_schema(template_path)
+        user_inputs = fields_to_inputs(schema, fields, cells)
+        return export_workbook(schema, user_inputs, io.BytesIO(image_bytes) if image_bytes else None)
+
+
+def parse_job(pdf_bytes, all_units):
+    with metrics.request("api_transcript"), metrics.span("parse_transcript"):
+        return parse_transcript_cached(pdf_bytes, all_units=all_units)
+
+
+class Saturated(Exception):
+    """工作池已滿"""
+
+
+class WorkerPool:
+    """固定大小的工作池：執行中 + 排隊中超過 workers + queue_size 時 submit 直接拋出 Saturated"""
+
+    def __init__(self, workers, queue_size, kind="thread", template_path=DEFAULT_TEMPLATE):
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self.kind = kind
+        self.in_flight = 0
+        self._slots = threading.BoundedSemaphore(self.capacity)
+        self._lock = threading.Lock()
+        if kind == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers, initializer=get_template_schema,
+                                                 initargs=(template_path,))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="survey-api")
+
+    def _release(self, _future=None):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    def submit(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise Saturated()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def stats(self):
+        with self._lock:
+            return {"pool": self.kind, "workers": self.workers, "capacity": self.capacity, "in_flight": self.in_flight}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class SurveyAPIHandler(BaseHTTPRequestHandler):
+    server_version = "SurveyAPI/1"
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        metrics.logger.info(json.dumps({"event": "api", "client": self.client_address[0], "message": fmt % args},
+                                       ensure_ascii=False))
+
+    def _send_json(self, status, payload, headers=()):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            # 長度不明無法讀完本文，不能沿用此連線
+            self._send_json(400, {"error": "Content-Length 錯誤"}, [("Connection", "close")])
+            self.close_connection = True
+            return None
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {"error": f"本文超過 {MAX_BODY_BYTES} bytes"}, [("Connection", "close")])
+            self.close_connection = True
+            return None
+        return self.rfile.read(length)
+
+    def _authorized(self):
+        token = self.server.token
+        if token and self.headers.get("X-API-Key") != token:
+            # 本文未讀取，不能沿用此連線
+            self._send_json(401, {"error": "X-API-Key 錯誤"}, [("Connection", "close")])
+            self.close_connection = True
+            return False
+        return True
+
+    def _run(self, fn, *args):
+        """交給工作池並等待結果；已滿回 429、逾時回 504，這兩種情況回傳 None"""
+        try:
+            future = self.server.pool.submit(fn, *args)
+        except Saturated:
+            self._send_json(429, {"error": "服務忙碌，請稍後再試"}, [("Retry-After", "1")])
+            return None
+        try:
+            return future.result(timeout=self.server.job_timeout)
+        except FutureTimeoutError:
+            self._send_json(504, {"error": "處理逾時"})
+            return None
+
+    def do_GET(self):
+        if self.path.split("?")[0] == "/health":
+            self._send_json(200, {"status": "ok", **self.server.pool.stats()})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path not in ("/generate", "/parse-transcript"):
+            self._send_json(404, {"error": "not found"}, [("Connection", "close")])
+            self.close_connection = True
+            return
+        if not self._authorized():
+            return
+        body = self._read_body()
+        if body is None:
+            return
+        try:
+            if path == "/generate":
+                self._generate(body)
+            else:
+                self._parse_transcript(body)
+        except Exception as e:
+            self._send_json(500, {"error": str(e)})
+
+    def _parse_transcript(self, body):
+        if not body:
+            self._send_json(400, {"error": "請以本文上傳謄本 PDF"})
+            return
+        all_units = parse_qs(urlsplit(self.path).query).get("units") == ["all"]
+        try:
+            result = self._run(parse_job, body, all_units)
+        except PDFReadError as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        if result is not None:
+            units, warnings, more = result
+            self._send_json(200, {"units": units, "warnings": warnings, "more": more})
+
+    def _generate(self, body):
+        try:
+            request = json.loads(body or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("本文須為 JSON 物件")
+            for name in ("fields", "cells"):
+                if not isinstance(request.get(name) or {}, dict):
+                    raise ValueError(f"{name} 須為物件")
+            map_image = request.get("map_image")
+            if map_image and not isinstance(map_image, str):
+                raise ValueError("map_image 須為 base64 字串")
+            image_bytes = base64.b64decode(map_image, validate=True) if map_image else None
+        except (ValueError, binascii.Error) as e:
+            self._send_json(400, {"error": f"請求格式錯誤: {e}"})
+            return
+        result = self._run(generate_job, self.server.template_path, request.get("fields"), request.get("cells"),
+                           image_bytes)
+        if result is None:
+            return
+        filename, data, warnings = result
+
+        self.send_response(200)
+        self.send_header("Content-Type", XLSX_MIME)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{quote(filename)}")
+        self.send_header("X-Survey-Warnings", json.dumps(warnings))
+        self.end_headers()
+        view = memoryview(data)
+        for start in range(0, len(view), WRITE_CHUNK):
+            self.wfile.write(view[start:start + WRITE_CHUNK])
+
+
+def make_server(host="127.0.0.1", port=8502, workers=None, queue_size=None, pool="thread",
+                template_path=DEFAULT_TEMPLATE, job_timeout=120, token=None):
+    workers = workers or _env_int("SURVEY_API_WORKERS", min(4, os.cpu_count() or 1))
+    queue_size = _env_int("SURVEY_API_QUEUE", 16) if queue_size is None else queue_size
+    get_template_schema(template_path)
+
+    server = ThreadingHTTPServer((host, port), SurveyAPIHandler)
+    server.daemon_threads = True
+    server.pool = WorkerPool(workers, queue_size, pool, template_path)
+    server.template_path = template_path
+    server.job_timeout = job_timeout
+    server.token = token if token is not None else os.environ.get("SURVEY_API_TOKEN")
+    return server
+
+
+# --- 用戶端 (Streamlit 介面使用) ---
+
+def request_workbook(base_url, cells, image_bytes=None, timeout=60, token=None):
+    """
+    呼叫 /generate，回傳 (檔名, bytes, 警告清單)。
+    無法連線、忙碌 (429) 或錯誤時拋出 OSError；回應標頭格式不對時拋出 ValueError。
+    """
+    payload = {"cells": cells}
+    if image_bytes:
+        payload["map_image"] = base64.b64encode(image_bytes).decode("ascii")
+    headers = {"Content-Type": "application/json"}
+    token = token or os.environ.get("SURVEY_API_TOKEN")
+    if token:
+        headers["X-API-Key"] = token
+    req = urllib.request.Request(base_url.rstrip("/") + "/generate", data=json.dumps(payload).encode("utf-8"),
+                                 headers=headers, method="POST")
+    with urllib.request.urlopen(req, timeout=timeout) as resp:
+        data = resp.read()
+        disposition = resp.headers.get("Content-Disposition", "")
+        warnings = json.loads(resp.headers.get("X-Survey-Warnings") or "[]")
+    if not isinstance(warnings, list):
+        raise ValueError("X-Survey-Warnings 須為 JSON 陣列")
+    filename = unquote(disposition.split("filename*=UTF-8''", 1)[-1]) if "filename*=" in disposition else "物調表.xlsx"
+    return filename, data, warnings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物調表產生服務")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--workers", type=int, default=None, help="工作數 (預設 SURVEY_API_WORKERS 或 min(4, CPU))")
+    parser.add_argument("--queue", type=int, default=None, help="排隊上限 (預設 SURVEY_API_QUEUE 或 16)")
+    parser.add_argument("--pool", choices=["thread", "process"], default="thread")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="物調表模板路徑")
+    parser.add_argument("--timeout", type=float, default=120, help="單一請求處理上限 (秒)")
+    args = parser.parse_args(argv)
+
+    server = make_server(args.host, args.port, args.workers, args.queue, args.pool, args.template, args.timeout)
+    stats = server.pool.stats()
+    print(f"物調表服務 http://{args.host}:{args.port}  ({stats['pool']} × {stats['workers']}，容量 {stats['capacity']})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,21 @@
 import streamlit as st
-from openpyxl import load_workbook
-from openpyxl.drawing.image import Image as ExcelImage
-from openpyxl.utils import get_column_letter
 import io
 import os
-import re
-import pdfplumber
-import streamlit.components.v1 as components
-from PIL import Image, ImageOps # 新增影像處理套件
+import sqlite3
+import tempfile
+from urllib.parse import quote
+import image_prep
+import metrics
+from api_server import request_workbook
+from gazetteer import normalize_address
+from serve import start_background_preload
+from session_store import artifact_store
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from submission_store import (index_keys, input_fields, load_image, load_submission, save_submission,
+                              search_submissions, submission_inputs)
+from survey_core import export_workbook, map_image_cache, map_image_slot, write_bulk_workbook, write_bulk_zip
+from template_schema import get_template_schema
+from transcript import parse_transcript_cached, transcript_cache
 
 # --- 1. 頁面設定 (修改APP名稱與圖示請改這裡) ---
 st.set_page_config(
@@ -19,6 +27,16 @@ st.set_page_config(
 
 # --- 核心邏輯 ---
 TEMPLATE_FILE = "template.xlsx"
+# 管理頁：網址加上 ?admin=<token> 才會顯示；未設定時停用
+ADMIN_TOKEN = os.environ.get("SURVEY_ADMIN_TOKEN")
+# 設定時匯出交給 api_server.py 服務，服務無法使用時改在本程序產生
+API_URL = os.environ.get("SURVEY_API_URL")
+# 歷史案件搜尋最多列出的筆數 (批次匯出可全選)
+HISTORY_LIMIT = 200
+# 介面批次匯出的筆數上限：下載按鈕要把整個 zip / 活頁簿放在記憶體，用量隨筆數增加；
+# 固定記憶體用量的只有命令列 batch_export.py，超過上限請改用它
+BULK_UI_LIMIT = int(os.environ.get("SURVEY_BULK_UI_LIMIT") or 30)
+BULK_FORMATS = {"ZIP (每案一個 Excel 檔)": "zip", "單一 Excel (每案一個工作表)": "workbook"}
 MAIN_ORDER = [
     "物件類型", "案名", "地址", "社區名稱", 
     "地上層", "地下層", "位於樓層", "格局", 
@@ -234,486 +252,422 @@ def inject_custom_styles():
         </style>
     """, unsafe_allow_html=True)
 
-# --- 輔助函式 ---
-def full_to_half(s):
-    if not s: return ""
-    return s.translate(str.maketrans('０１２３４５６７８９', '0123456789'))
-
-def chinese_to_arabic(cn_str):
-    if not cn_str: return ""
-    cn_map = {'一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10, '0':0, '1':1, '2':2, '3':3, '4':4, '5':5, '6':6, '7':7, '8':8, '9':9}
-    clean_str = cn_str.replace('層', '').replace('樓', '').strip()
-    if clean_str.isdigit(): return str(int(clean_str))
-    try:
-        val = 0
-        if len(clean_str) == 1: val = cn_map.get(clean_str, 0)
-        elif len(clean_str) == 2:
-            if clean_str[0] == '十': val = 10 + cn_map.get(clean_str[1], 0)
-            elif clean_str[1] == '十': val = cn_map.get(clean_str[0], 0) * 10
-        elif len(clean_str) == 3:
-             val = cn_map.get(clean_str[0], 0) * 10 + cn_map.get(clean_str[2], 0)
-        return str(val) if val > 0 else cn_str
-    except: return cn_str
-
-def format_date_roc(date_str):
-    if not date_str: return ""
-    match = re.match(r'(\d+)[/.-](\d+)[/.-](\d+)', date_str)
-    if match:
-        y, m, d = match.groups()
-        return f"民國{y}年{m}月{d}日"
-    return date_str
-
-def format_layout(layout_str):
-    if not layout_str: return ""
-    parts = re.split(r'[/, .]', layout_str)
-    parts = [p for p in parts if p.strip()]
-    result = ""
-    if len(parts) >= 1: result += f"{parts[0]}房"
-    if len(parts) >= 2: result += f"{parts[1]}廳"
-    if len(parts) >= 3: result += f"{parts[2]}衛浴"
-    if len(parts) >= 4: result += f"{parts[3]}陽台"
-    return result if result else layout_str
-
-def safe_float_convert(value):
-    """安全轉換字串為浮點數，失敗回傳 0.0"""
-    try:
-        if not value: return 0.0
-        clean_val = re.sub(r'[^\d.]', '', str(value))
-        return float(clean_val)
-    except:
-        return 0.0
-
-def crop_image_to_ratio(image, target_ratio_w=27, target_ratio_h=16):
-    """將圖片置中剪裁為指定長寬比"""
-    original_w, original_h = image.size
-    target_aspect = target_ratio_w / target_ratio_h
-    current_aspect = original_w / original_h
-
-    if current_aspect > target_aspect:
-        new_w = int(original_h * target_aspect)
-        offset = (original_w - new_w) // 2
-        box = (offset, 0, offset + new_w, original_h)
+def render_admin_page():
+    st.markdown("<h1>效能監控</h1>", unsafe_allow_html=True)
+    if not metrics.ENABLED:
+        st.info("未啟用計時 (SURVEY_METRICS=0)")
+    rows = [{"階段": key, "筆數": v["count"], "p50 ms": v["p50"], "p95 ms": v["p95"], "p99 ms": v["p99"]}
+            for key, v in metrics.percentiles().items()]
+    if rows:
+        st.table(rows)
     else:
-        new_h = int(original_w / target_aspect)
-        offset = (original_h - new_h) // 2
-        box = (0, offset, original_w, offset + new_h)
-    
-    return image.crop(box)
-
-def calculate_cell_pixels(ws, coord):
-    """計算 Excel 儲存格 (含合併) 的像素大小"""
-    target_range = None
-    for merged_range in ws.merged_cells.ranges:
-        if coord in merged_range:
-            target_range = merged_range
-            break
-    
-    if target_range:
-        min_col, min_row, max_col, max_row = target_range.min_col, target_range.min_row, target_range.max_col, target_range.max_row
+        st.caption("尚無紀錄")
+    st.caption(f"最近 {metrics.WINDOW} 筆；記憶體追蹤 {'開啟' if metrics.TRACE_MEMORY else '關閉'}")
+    st.json(transcript_cache.stats())
+    st.markdown("<h3>冒泡位置圖快取</h3>", unsafe_allow_html=True)
+    st.json(map_image_cache.stats())
+    st.markdown("<h3>Session 暫存區</h3>", unsafe_allow_html=True)
+    st.json(artifact_store.stats())
+
+# --- Session 暫存區 (上傳檔與解析結果，見 session_store.py) ---
+def session_id():
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else "local"
+
+def release_upload(uploaded_file, round_key):
+    """上傳檔已存入暫存區：從 Streamlit 上傳緩衝移除，並換掉上傳元件的 key 讓它清空"""
+    ctx = get_script_run_ctx()
+    if ctx is not None and hasattr(ctx.uploaded_file_mgr, "remove_file"):  # 只有記憶體版上傳管理有此方法
+        ctx.uploaded_file_mgr.remove_file(ctx.session_id, uploaded_file.file_id)
+    st.session_state[round_key] = st.session_state.get(round_key, 0) + 1
+
+def rerun_fragment():
+    """只重跑目前的 fragment；隨整頁執行時 Streamlit 不接受 fragment 範圍，改整頁重跑"""
+    ctx = get_script_run_ctx()
+    st.rerun(scope="fragment" if ctx is not None and ctx.fragment_ids_this_run else "app")
+
+def submission_title(row):
+    return f"{row['contract_no'] or '無編號'}　{row['case_name'] or '無案名'}　{row['address']}"
+
+def load_submission_into_form(schema, record):
+    """將已儲存案件填回表單 (下拉選單值不在選項中時回到預設)"""
+    inputs = submission_inputs(schema, record["fields"])
+    for item in schema.scanned_items:
+        coord = item["coordinate"]
+        if coord in schema.image_coord_set:
+            continue
+        value = inputs.get(coord, "")
+        if item["type"] == "select" and value not in item["options"]:
+            value = item["options"][0]
+        st.session_state[coord] = value
+    st.session_state.submission_id = record["id"]
+    st.session_state.loaded_contract_no = record["contract_no"]
+    st.session_state.stored_image_hash = record["image_hash"]
+    discard_map_image()
+    st.session_state.imported_transcript = record["transcript"]
+
+# 上傳檔的名稱記在 st.session_state (很小)：暫存區因閒置或容量上限清掉內容時，仍知道曾經上傳過，可提醒重新上傳
+def discard_map_image():
+    """清除上傳的冒泡位置圖與其背景處理結果"""
+    sid = session_id()
+    for name in ("map_image", "map_image_digest", "render_memo"):
+        artifact_store.discard(sid, name)
+    image_prep.discard(sid)
+    st.session_state.pop("map_image_name", None)
+
+def map_image_lost():
+    """
+    已上傳的冒泡位置圖是否已被暫存區清除 (發現時清掉殘留狀態)。
+    標記保留到重新上傳或下一次匯出，上傳區與匯出都會提醒。
+    """
+    if st.session_state.get("map_image_name") is not None and not artifact_store.contains(session_id(), "map_image"):
+        discard_map_image()
+        st.session_state.map_image_lost = True
+    return st.session_state.get("map_image_lost", False)
+
+def forget_loaded_submission():
+    """表單已不是載入 (或剛匯出存下) 的那筆案件：之後匯出不再更新該筆，也不沿用它的圖片"""
+    for key in ("submission_id", "loaded_contract_no", "stored_image_hash"):
+        st.session_state.pop(key, None)
+
+def stored_cases(schema, submission_ids):
+    """逐筆讀出已儲存案件 (user_inputs, 圖片)，批次匯出時一次只載入一筆"""
+    for submission_id in submission_ids:
+        record = load_submission(submission_id)
+        if record is None:
+            continue
+        image_bytes = load_image(record["image_hash"])
+        yield submission_inputs(schema, record["fields"]), io.BytesIO(image_bytes) if image_bytes else None
+
+def field_placeholder(label):
+    if "房屋單價" in label or "公設比" in label:
+        return "輸入數字0系統匯出自動計算"
+    elif "不含車位坪數" in label:
+        return "輸入數字0系統匯出自動計算"
+    return ""
+
+def render_field(label, item, user_inputs, textarea_height=100):
+    coord = item["coordinate"]
+    if item["type"] == "select":
+        val = st.selectbox(label, item["options"], key=coord)
+        user_inputs[coord] = val if val != "請選擇..." else ""
+    elif item["type"] == "textarea":
+        val = st.text_area(label, key=coord, height=textarea_height)
+        user_inputs[coord] = val
     else:
-        c = ws[coord]
-        min_col, min_row, max_col, max_row = c.column, c.row, c.column, c.row
-
-    total_width = 0
-    for col_idx in range(min_col, max_col + 1):
-        col_letter = get_column_letter(col_idx)
-        cw = ws.column_dimensions[col_letter].width
-        if cw is None: cw = 9 
-        total_width += cw * 7.7 
-        
-    total_height = 0
-    for row_idx in range(min_row, max_row + 1):
-        rh = ws.row_dimensions[row_idx].height
-        if rh is None: rh = 15
-        total_height += rh * 1.34 
-        
-    return total_width, total_height
-
-def parse_transcript_pdf(pdf_file):
-    data = {}
-    full_text = ""
-    try:
-        with pdfplumber.open(pdf_file) as pdf:
-            for page in pdf.pages:
-                full_text += page.extract_text() + "\n"
-        
-        lines = full_text.split('\n')
-        address_prefix = ""
-        address_road = ""
-        for i, line in enumerate(lines):
-            line = line.strip()
-            if "建物標示部" in line:
-                for offset in range(1, 5):
-                    if i + offset < len(lines):
-                        txt = lines[i+offset]
-                        match = re.search(r'(.+?[市縣].+?[區鄉鎮市])', txt)
-                        if match:
-                            address_prefix = match.group(1)
-                            break
-            if "建物門牌" in line:
-                parts = line.split("建物門牌")
-                if len(parts) > 1 and parts[1].strip():
-                    address_road = parts[1].strip()
-                elif i+1 < len(lines):
-                    address_road = lines[i+1].strip()
-
-        if address_prefix or address_road:
-            full_addr = f"{address_prefix}{address_road}"
-            data["地址"] = full_to_half(full_addr).replace(" ", "")
-
-        date_match = re.search(r'建築完成日期\s*([民國\d]+年\d+月\d+日)', full_text)
-        if date_match: data["建築完成日"] = date_match.group(1)
-
-        layer_m2_matches = re.findall(r'層次面積\s*([\d\.]+)\s*平方公尺', full_text)
-        if layer_m2_matches:
-            total_main_m2 = sum(float(x) for x in layer_m2_matches)
-            data["主建物坪數"] = str(round(total_main_m2 * 0.3025, 3))
-
+        val = st.text_input(label, key=coord, placeholder=field_placeholder(label))
+        user_inputs[coord] = val
+
+# --- 歷史案件 (獨立 fragment：搜尋、載入、直接重新匯出已儲存的案件) ---
+@st.fragment
+def render_history(schema):
+    with st.expander("歷史案件"):
+        query = st.text_input("搜尋委託契約書編號 / 案名 / 地址 (開頭)", key="history_query")
         try:
-            start = full_text.find("附屬建物用途")
-            end = full_text.find("共有部分")
-            if start != -1:
-                sub_text = full_text[start:end] if end != -1 else full_text[start:]
-                annex_matches = re.findall(r'面積\s*([\d\.]+)\s*平方公尺', sub_text)
-                if annex_matches:
-                    total_annex_m2 = sum(float(x) for x in annex_matches)
-                    data["附屬建坪數"] = str(round(total_annex_m2 * 0.3025, 3))
-        except: pass
-
-        floors_match = re.search(r'層數\s*(\d+)層', full_text)
-        if floors_match: data["地上層"] = str(int(floors_match.group(1)))
-
-        layer_match = re.search(r'層次\s*([^\d\s]+)層', full_text)
-        if layer_match and "面積" not in layer_match.group(0):
-            data["位於樓層"] = chinese_to_arabic(layer_match.group(1))
-        
-    except Exception as e:
-        st.error(f"PDF 解析錯誤: {e}")
-    return data
-
-def main():
-    inject_custom_styles()
-
-    if not os.path.exists(TEMPLATE_FILE):
-        st.error(f"系統錯誤：找不到 {TEMPLATE_FILE}")
-        return
-    try:
-        wb = load_workbook(TEMPLATE_FILE)
-        target_sheet = None
-        for sheetname in wb.sheetnames:
-            if "物調表" in sheetname:
-                target_sheet = wb[sheetname]
-                break
-        if target_sheet is None: target_sheet = wb.active 
-    except Exception as e:
-        st.error(f"系統錯誤：讀取模板失敗 {e}")
-        return
-
-    label_to_coord = {}
-    scanned_items = []
-    for row in target_sheet.iter_rows():
-        for cell in row:
-            if cell.value and isinstance(cell.value, str) and '"""' in cell.value:
-                raw_txt = cell.value
-                label_name = ""
-                content_part = ""
-                
-                match_star = re.search(r'\*(.*?)\*(.*)', raw_txt)
-                if match_star:
-                    label_name = match_star.group(1).strip()
-                    content_part = match_star.group(2).replace('"""', '')
+            rows = search_submissions(query, limit=HISTORY_LIMIT)
+        except sqlite3.Error as e:
+            st.error(f"案件紀錄讀取錯誤: {e}")
+            return
+        if not rows:
+            st.caption("尚無紀錄")
+            return
+        idx = st.selectbox("案件", range(len(rows)), format_func=lambda i: submission_title(rows[i]),
+                           key="history_pick")
+        record = load_submission(rows[idx]["id"])
+        if record is None:
+            return
+
+        col_load, col_export = st.columns(2)
+        if col_load.button("載入表單", key="history_load"):
+            load_submission_into_form(schema, record)
+            st.session_state.history_loaded = True
+            st.rerun()
+        if col_export.button("直接重新匯出", key="history_export"):
+            with metrics.request("reexport"):
+                image_bytes = load_image(record["image_hash"])
+                safe_filename, data, export_warnings = export_workbook(
+                    schema, submission_inputs(schema, record["fields"]),
+                    io.BytesIO(image_bytes) if image_bytes else None)
+            for w in export_warnings:
+                st.warning(w)
+            st.download_button(
+                label=f"下載 {safe_filename}",
+                data=data,
+                file_name=safe_filename,
+                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                on_click="ignore",
+                key="history_download",
+            )
+
+        st.markdown("<hr style='border-color: rgba(255,255,255,0.05); margin: 15px 0;'>", unsafe_allow_html=True)
+        select_all = st.checkbox(f"全部搜尋結果 ({len(rows)} 筆)", key="bulk_all")
+        picked = range(len(rows)) if select_all else st.multiselect(
+            "批次匯出案件", range(len(rows)), format_func=lambda i: submission_title(rows[i]), key="bulk_pick")
+        bulk_format = st.radio("格式", list(BULK_FORMATS), horizontal=True, key="bulk_format")
+        if len(picked) > BULK_UI_LIMIT:
+            st.warning(f"介面一次最多批次匯出 {BULK_UI_LIMIT} 筆 (已選 {len(picked)} 筆)，"
+                       "更多案件請縮小搜尋範圍，或改用命令列 batch_export.py")
+        elif picked and st.button("批次匯出", key="bulk_export"):
+            # 逐案產生並寫入暫存檔，產生過程不會同時保留所有案件的 Excel；
+            # 但下載按鈕需讀入整個結果檔，記憶體用量仍隨筆數增加 (故有 BULK_UI_LIMIT)
+            with tempfile.TemporaryFile() as output, metrics.request("bulk_export") as trace, trace.span("bulk_write"):
+                cases = stored_cases(schema, [rows[i]["id"] for i in picked])
+                if BULK_FORMATS[bulk_format] == "zip":
+                    report = write_bulk_zip(schema, cases, output)
+                    filename, mime = "物調表.zip", "application/zip"
                 else:
-                    label_name = raw_txt.replace('"""', '').strip()
-                    content_part = label_name
-
-                options = []
-                input_type = "text"
-                
-                if "□" in content_part:
-                    input_type = "select"
-                    segments = content_part.split('□')
-                    options = [s.strip() for s in segments if s.strip()]
-                    options.insert(0, "請選擇...")
-                
-                if "特色" in label_name or "說明" in label_name:
-                    input_type = "textarea"
-                elif "冒泡" in label_name:
-                    input_type = "image_upload"
-
-                item_data = {
-                    "label": label_name,
-                    "coordinate": cell.coordinate,
-                    "type": input_type,
-                    "options": options
-                }
-                label_to_coord[label_name] = cell.coordinate
-                scanned_items.append(item_data)
-
-    st.markdown("<h1>永義物調整合</h1>", unsafe_allow_html=True)
-    st.markdown("<div class='subtitle'>YUNGYI PROPERTY INTEGRATION</div>", unsafe_allow_html=True)
-
+                    report = write_bulk_workbook(schema, cases, output)
+                    filename, mime = "物調表.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                output.seek(0)
+                data = output.read()
+            for name, warnings in report:
+                for w in warnings:
+                    st.warning(f"{name}: {w}")
+            st.download_button(
+                label=f"下載 {filename} ({len(report)} 筆)",
+                data=data,
+                file_name=filename,
+                mime=mime,
+                on_click="ignore",
+                key="bulk_download",
+            )
+
+# --- 智慧匯入 (獨立 fragment：上傳謄本、切換戶別只重跑此區塊) ---
+@st.fragment
+def render_import_center(schema):
     st.markdown("<div style='color:#c5a065; font-size:15px; font-weight:bold; margin-bottom:10px; margin-top:20px;'>智慧匯入中心</div>", unsafe_allow_html=True)
     
-    uploaded_pdf = st.file_uploader("點此上傳建物謄本 (PDF)", type=['pdf'])
+    uploaded_pdf = st.file_uploader("點此上傳建物謄本 (PDF)", type=['pdf'],
+                                    key=f"pdf_upload_{st.session_state.get('pdf_upload_round', 0)}")
     
     if uploaded_pdf:
-        if 'last_uploaded_pdf' not in st.session_state or st.session_state.last_uploaded_pdf != uploaded_pdf.name:
-            with st.spinner("分析中..."):
-                parsed = parse_transcript_pdf(uploaded_pdf)
-                st.session_state.pdf_parsed_data = parsed
-                st.session_state.last_uploaded_pdf = uploaded_pdf.name
+        pdf_bytes = uploaded_pdf.getvalue()
+        with st.spinner("分析中..."):
+            parsed = {"name": uploaded_pdf.name, "units": [], "warnings": [], "more": False}
+            try:
+                # 只解析到第一戶為止；後面還有頁面時才保留 PDF，供「解析其他戶」使用
+                with metrics.request("transcript") as trace, trace.span("parse_transcript"):
+                    parsed["units"], parsed["warnings"], parsed["more"] = parse_transcript_cached(pdf_bytes)
+            except Exception as e:
+                parsed["error"] = f"PDF 解析錯誤: {e}"
+        # 解析結果存入暫存區後即釋放上傳緩衝，上傳元件清空
+        artifact_store.put(session_id(), "pdf_parsed", parsed)
+        st.session_state.pdf_parsed_name = parsed["name"]
+        if parsed["more"]:
+            artifact_store.put(session_id(), "pdf_bytes", pdf_bytes)
+        else:
+            artifact_store.discard(session_id(), "pdf_bytes")
+        release_upload(uploaded_pdf, "pdf_upload_round")
+        rerun_fragment()  # 結果只在本 fragment 顯示；匯入按鈕才需整頁重跑
+
+    parsed = artifact_store.get(session_id(), "pdf_parsed")
+    if parsed is None and st.session_state.pop("pdf_parsed_name", None):
+        artifact_store.discard(session_id(), "pdf_bytes")
+        st.warning("謄本解析結果已從暫存區清除 (閒置過久或暫存空間不足)，請重新上傳謄本")
+    if parsed and parsed.get("more"):
+        if st.button("此謄本可能還有其他戶，解析全部建物", help="多戶謄本 (整棟或多筆建號) 才需要"):
+            pdf_bytes = artifact_store.get(session_id(), "pdf_bytes")
+            if pdf_bytes is None:
+                parsed["more"] = False
+                parsed["warnings"] = parsed["warnings"] + ["謄本暫存已清除，請重新上傳"]
+            else:
+                with st.spinner("解析全部建物標示部..."):
+                    with metrics.request("transcript") as trace, trace.span("parse_transcript_units"):
+                        parsed["units"], parsed["warnings"], parsed["more"] = parse_transcript_cached(
+                            pdf_bytes, all_units=True)
+                artifact_store.discard(session_id(), "pdf_bytes")
+            artifact_store.put(session_id(), "pdf_parsed", parsed)
+    if parsed:
+        st.caption(f"已解析：{parsed['name']}")
+        for w in parsed["warnings"]:
+            st.warning(w)
+        if "error" in parsed:
+            st.error(parsed["error"])
+        units = parsed["units"]
+        data = {}
+        if len(units) > 1:
+            unit_idx = st.selectbox(
+                f"此謄本包含 {len(units)} 戶建物，請選擇要匯入的一戶",
+                range(len(units)),
+                format_func=lambda i: f"{i + 1}. {units[i].get('地址', '(無地址)')}",
+            )
+            data = units[unit_idx]
+        elif units:
+            data = units[0]
         
-        if 'pdf_parsed_data' in st.session_state:
-            data = st.session_state.pdf_parsed_data
-            
-            grid_html = f"""
-            <div class="dashboard-grid">
-                <div class="dash-item"><div class="dash-label">地址</div><div class="dash-value">{data.get('地址', '-')}</div></div>
-                <div class="dash-item"><div class="dash-label">建築完成日</div><div class="dash-value">{data.get('建築完成日', '-')}</div></div>
-                <div class="dash-item"><div class="dash-label">主建物坪數</div><div class="dash-value">{data.get('主建物坪數', '-')}</div></div>
-                <div class="dash-item"><div class="dash-label">附屬建坪數</div><div class="dash-value">{data.get('附屬建坪數', '-')}</div></div>
-                <div class="dash-item"><div class="dash-label">地上層</div><div class="dash-value">{data.get('地上層', '-')}</div></div>
-                <div class="dash-item"><div class="dash-label">位於樓層</div><div class="dash-value">{data.get('位於樓層', '-')}</div></div>
-            </div>
-            """
-            st.markdown(grid_html, unsafe_allow_html=True)
-            
-            if st.button("匯入建物基本資料", type="primary"):
-                count = 0
-                for pdf_key, pdf_val in st.session_state.pdf_parsed_data.items():
-                    target_coord = None
-                    if pdf_key in label_to_coord: target_coord = label_to_coord[pdf_key]
-                    if not target_coord:
-                        for lbl, coord in label_to_coord.items():
-                            if pdf_key in lbl or lbl in pdf_key:
-                                target_coord = coord
-                                break
-                    if target_coord:
-                        st.session_state[target_coord] = pdf_val
-                        count += 1
-                if count > 0:
-                    st.success("資料已匯入")
+        grid_html = f"""
+        <div class="dashboard-grid">
+            <div class="dash-item"><div class="dash-label">地址</div><div class="dash-value">{data.get('地址', '-')}</div></div>
+            <div class="dash-item"><div class="dash-label">建築完成日</div><div class="dash-value">{data.get('建築完成日', '-')}</div></div>
+            <div class="dash-item"><div class="dash-label">主建物坪數</div><div class="dash-value">{data.get('主建物坪數', '-')}</div></div>
+            <div class="dash-item"><div class="dash-label">附屬建坪數</div><div class="dash-value">{data.get('附屬建坪數', '-')}</div></div>
+            <div class="dash-item"><div class="dash-label">地上層</div><div class="dash-value">{data.get('地上層', '-')}</div></div>
+            <div class="dash-item"><div class="dash-label">位於樓層</div><div class="dash-value">{data.get('位於樓層', '-')}</div></div>
+        </div>
+        """
+        st.markdown(grid_html, unsafe_allow_html=True)
+        
+        if st.session_state.pop('pdf_import_done', False):
+            st.success("資料已匯入")
+
+        if st.button("匯入建物基本資料", type="primary"):
+            count = 0
+            for pdf_key, pdf_val in data.items():
+                target_coord = schema.resolve_label(pdf_key)
+                if target_coord:
+                    st.session_state[target_coord] = pdf_val
+                    count += 1
+            if count > 0:
+                forget_loaded_submission()  # 匯入新謄本即為另一件案件，不沿用之前上傳的圖片
+                discard_map_image()
+                st.session_state.imported_transcript = data
+                # 表單在另一個 fragment，需整頁重跑才會顯示匯入的值
+                st.session_state.pdf_import_done = True
+                st.rerun()
+
+# --- 冒泡位置圖 (獨立 fragment：上傳後立即在背景處理，匯出時直接嵌入結果；表單內的上傳要送出才看得到) ---
+@st.fragment(run_every=1)
+def render_map_image_progress():
+    """只在背景處理中呈現；每秒檢查，完成後整頁重跑 (同時停止計時)"""
+    if image_prep.pending(session_id()):
+        st.markdown("<div style='font-size:12px; color:#c5a065;'>* 圖片處理中...</div>", unsafe_allow_html=True)
+    else:
+        st.rerun()
 
+@st.fragment
+def render_map_image(schema):
+    slot = map_image_slot(schema)
+    if slot is None:
+        return
+    coord, target_size = slot
+    sid = session_id()
+    st.markdown(f"<div style='margin-top:15px; margin-bottom:5px; font-size:14px; color:#c5a065;'>{schema.coord_to_header[coord]}</div>", unsafe_allow_html=True)
+    uploaded_map_image = st.file_uploader(schema.coord_to_header[coord], type=['jpg', 'png', 'jpeg'], label_visibility="collapsed",
+                                          key=f"{coord}_{st.session_state.get('map_upload_round', 0)}")
+    st.markdown("<div style='font-size:12px; color:#666; margin-top:-5px;'>* 圖片將自動「置中剪裁 (27:16)」並拉伸填滿 Excel 儲存格</div>", unsafe_allow_html=True)
+
+    if uploaded_map_image:
+        # 原圖移入暫存區並開始背景處理，釋放上傳緩衝
+        image_bytes = uploaded_map_image.getvalue()
+        artifact_store.put(sid, "map_image", image_bytes)
+        artifact_store.discard(sid, "render_memo")  # 舊圖片的部件不再用得到
+        st.session_state.map_image_name = uploaded_map_image.name
+        st.session_state.pop("map_image_lost", None)
+        digest = image_prep.image_digest(image_bytes)
+        artifact_store.put(sid, "map_image_digest", digest)
+        image_prep.submit(sid, image_bytes, digest, target_size)
+        release_upload(uploaded_map_image, "map_upload_round")
+        rerun_fragment()
+
+    if map_image_lost():
+        st.warning("上傳的圖片已從暫存區清除 (閒置過久或暫存空間不足)，請重新上傳，匯出時才會嵌入")
+    image_name = st.session_state.get("map_image_name")
+    if image_name:
+        if image_prep.pending(sid):
+            render_map_image_progress()
+        elif artifact_store.get(sid, "map_image_prepared_meta"):
+            st.markdown(f"<div style='font-size:12px; color:#666;'>* {image_name} 已處理完成，匯出時直接嵌入</div>", unsafe_allow_html=True)
+        else:
+            st.markdown(f"<div style='font-size:12px; color:#666;'>* {image_name} 將於匯出時處理</div>", unsafe_allow_html=True)
+        # 上傳後上傳元件已清空，要移除圖片只能用這個按鈕
+        if st.button(f"移除 {image_name}", key="map_image_remove"):
+            discard_map_image()
+            rerun_fragment()
+    elif st.session_state.get("stored_image_hash"):
+        st.markdown("<div style='font-size:12px; color:#666;'>* 未上傳時沿用已儲存案件的圖片</div>", unsafe_allow_html=True)
+
+# --- 表單與匯出 (獨立 fragment：送出表單只重跑此區塊) ---
+@st.fragment
+def render_survey_form(schema):
+    main_fields, other_fields, rest_fields = schema.form_layout(MAIN_ORDER, OTHER_ORDER)
     user_inputs = {} 
-    uploaded_map_image = None
-    scanned_dict = {item["label"]: item for item in scanned_items}
 
     with st.form("survey_form"):
         st.markdown("<div style='color:#c5a065; font-size:15px; font-weight:bold; margin-bottom:15px;'>不動產基本資料</div>", unsafe_allow_html=True)
 
-        for label in MAIN_ORDER:
-            found_key = label if label in scanned_dict else None
-            if not found_key:
-                for k in scanned_dict.keys():
-                    if label in k or k in label:
-                        found_key = k
-                        break
+        for label, found_key, item in main_fields:
+            coord = item["coordinate"]
             
-            if found_key:
-                item = scanned_dict[found_key]
-                coord = item["coordinate"]
-                
-                if label == "地址":
-                    val = st.text_input(label, key=coord)
-                    user_inputs[coord] = val
-                    if val:
-                        map_url = f"https://www.google.com/maps/search/?api=1&query={val}"
-                        st.markdown(f"<div style='text-align:right; margin-top:-5px; margin-bottom:10px;'><a href='{map_url}' target='_blank' style='font-size:12px; color:#888; text-decoration:none;'>📍 開啟地圖</a></div>", unsafe_allow_html=True)
-                
-                elif item["type"] == "select":
-                    val = st.selectbox(found_key, item["options"], key=coord)
-                    user_inputs[coord] = val if val != "請選擇..." else ""
-                
-                elif item["type"] == "textarea":
-                    val = st.text_area(found_key, key=coord, height=120)
-                    user_inputs[coord] = val
-
-                elif item["type"] == "image_upload":
-                    st.markdown(f"<div style='margin-top:15px; margin-bottom:5px; font-size:14px; color:#c5a065;'>{found_key}</div>", unsafe_allow_html=True)
-                    uploaded_map_image = st.file_uploader("", type=['jpg', 'png', 'jpeg'], key=coord, label_visibility="collapsed")
-                    st.markdown("<div style='font-size:12px; color:#666; margin-top:-5px;'>* 圖片將自動「置中剪裁 (27:16)」並拉伸填滿 Excel 儲存格</div>", unsafe_allow_html=True)
-                    user_inputs[coord] = ""
-                else:
-                    placeholder_txt = ""
-                    if "房屋單價" in found_key or "公設比" in found_key:
-                        placeholder_txt = "輸入數字0系統匯出自動計算"
-                    elif "不含車位坪數" in found_key:
-                        placeholder_txt = "輸入數字0系統匯出自動計算"
-                    
-                    val = st.text_input(found_key, key=coord, placeholder=placeholder_txt)
-                    user_inputs[coord] = val
-                
-                if found_key in scanned_dict: del scanned_dict[found_key]
-
-        if any(k in scanned_dict for k in OTHER_ORDER):
-            st.markdown("<hr style='border-color: rgba(255,255,255,0.05); margin: 30px 0;'>", unsafe_allow_html=True)
-            for label in OTHER_ORDER:
-                if label in scanned_dict:
-                    item = scanned_dict[label]
-                    coord = item["coordinate"]
-                    
-                    if item["type"] == "select":
-                        val = st.selectbox(label, item["options"], key=coord)
-                        user_inputs[coord] = val if val != "請選擇..." else ""
-                    elif item["type"] == "textarea":
-                        val = st.text_area(label, key=coord, height=100)
-                        user_inputs[coord] = val
-                    else:
-                        placeholder_txt = ""
-                        if "房屋單價" in label or "公設比" in label:
-                            placeholder_txt = "輸入數字0系統匯出自動計算"
-                        elif "不含車位坪數" in label:
-                            placeholder_txt = "輸入數字0系統匯出自動計算"
-                        
-                        val = st.text_input(label, key=coord, placeholder=placeholder_txt)
-                        user_inputs[coord] = val
-                    
-                    del scanned_dict[label]
-
-        if scanned_dict:
-            st.markdown("<hr style='border-color: rgba(255,255,255,0.05); margin: 30px 0;'>", unsafe_allow_html=True)
-            for label, item in scanned_dict.items():
-                coord = item["coordinate"]
-                if item["type"] == "select":
-                    val = st.selectbox(label, item["options"], key=coord)
-                    user_inputs[coord] = val if val != "請選擇..." else ""
-                elif item["type"] == "textarea":
-                    val = st.text_area(label, key=coord, height=100)
-                    user_inputs[coord] = val
-                else:
-                    placeholder_txt = ""
-                    if "房屋單價" in label or "公設比" in label:
-                        placeholder_txt = "輸入數字0系統匯出自動計算"
-                    elif "不含車位坪數" in label:
-                        placeholder_txt = "輸入數字0系統匯出自動計算"
-
-                    val = st.text_input(label, key=coord, placeholder=placeholder_txt)
-                    user_inputs[coord] = val
+            if label == "地址":
+                val = st.text_input(label, key=coord)
+                user_inputs[coord] = val
+                if val:
+                    map_url = f"https://www.google.com/maps/search/?api=1&query={quote(normalize_address(val))}"
+                    st.markdown(f"<div style='text-align:right; margin-top:-5px; margin-bottom:10px;'><a href='{map_url}' target='_blank' style='font-size:12px; color:#888; text-decoration:none;'>📍 開啟地圖</a></div>", unsafe_allow_html=True)
+
+            elif item["type"] == "image_upload":
+                user_inputs[coord] = ""  # 上傳元件在表單外 (render_map_image)
+            else:
+                render_field(found_key, item, user_inputs, textarea_height=120)
+
+        for fields in (other_fields, rest_fields):
+            if fields:
+                st.markdown("<hr style='border-color: rgba(255,255,255,0.05); margin: 30px 0;'>", unsafe_allow_html=True)
+                for label, item in fields:
+                    render_field(label, item, user_inputs)
 
         st.markdown("<br>", unsafe_allow_html=True)
         submitted = st.form_submit_button("匯出至Excel")
 
-    if submitted:
-        wb_output = load_workbook(TEMPLATE_FILE)
-        ws_output = wb_output[target_sheet.title]
-
-        coord_to_header = {item["coordinate"]: item["label"] for item in scanned_items}
-        
-        image_coords = [item["coordinate"] for item in scanned_items if item["type"] == "image_upload"]
-
-        coord_price = next((k for k, v in coord_to_header.items() if "售價" in v), None)
-        coord_total_area = next((k for k, v in coord_to_header.items() if "登記總建坪" in v), None)
-        coord_area_no_parking = next((k for k, v in coord_to_header.items() if "不含車位" in v), None)
-        coord_parking_area = next((k for k, v in coord_to_header.items() if "車位坪數" in v), None)
-        coord_public_area = next((k for k, v in coord_to_header.items() if "公設坪數" in v), None)
-        coord_unit_price = next((k for k, v in coord_to_header.items() if "房屋單價" in v), None)
-        coord_public_ratio = next((k for k, v in coord_to_header.items() if "公設比" in v), None)
-        coord_main_area = next((k for k, v in coord_to_header.items() if "主建物" in v), None)
-        coord_annex_area = next((k for k, v in coord_to_header.items() if "附屬" in v), None)
-
-        # 1. 計算不含車位坪數 (主+附+公)
-        if coord_area_no_parking and user_inputs.get(coord_area_no_parking) == "0":
-            try:
-                a_main = safe_float_convert(user_inputs.get(coord_main_area))
-                a_annex = safe_float_convert(user_inputs.get(coord_annex_area))
-                a_pub = safe_float_convert(user_inputs.get(coord_public_area))
-                user_inputs[coord_area_no_parking] = str(round(a_main + a_annex + a_pub, 3))
-            except: pass
-
-        # 2. 計算登記總建坪: 已移除自動計算 (保留使用者手動輸入)
-        
-        # 3. 計算房屋單價
-        if coord_unit_price and user_inputs.get(coord_unit_price) == "0":
-            try:
-                p = safe_float_convert(user_inputs.get(coord_price))
-                a = safe_float_convert(user_inputs.get(coord_area_no_parking))
-                if a > 0:
-                    res = round(p / a, 2)
-                    user_inputs[coord_unit_price] = str(res)
-            except: pass
-
-        # 4. 計算公設比
-        if coord_public_ratio and user_inputs.get(coord_public_ratio) == "0":
-            try:
-                pub = safe_float_convert(user_inputs.get(coord_public_area))
-                a = safe_float_convert(user_inputs.get(coord_area_no_parking))
-                if a > 0:
-                    res = round((pub / a) * 100, 1)
-                    user_inputs[coord_public_ratio] = f"{res}%"
-            except: pass
-
-        for coord, value in user_inputs.items():
-            if coord in image_coords:
-                continue
-
-            cell = ws_output[coord]
-            final_val = value if value else ""
-            header = coord_to_header.get(coord, "")
-            
-            if "完成日" in header or "日期" in header:
-                final_val = format_date_roc(final_val)
-            elif "格局" in header:
-                final_val = format_layout(final_val)
-            
-            # 自動加萬
-            keywords_for_wan = ["售價", "單價", "價格", "貸款"]
-            if any(k in header for k in keywords_for_wan) and final_val:
-                v_str = str(final_val).strip()
-                if v_str.replace('.', '', 1).isdigit() and "萬" not in v_str:
-                    final_val = f"{v_str}萬"
-            
-            # 管理費自動加元
-            if "管理費" in header and final_val:
-                v_str = str(final_val).strip()
-                if v_str and "元" not in v_str:
-                    final_val = f"{v_str}元"
+    if st.session_state.pop("history_loaded", False):
+        st.success("已載入歷史案件，修改後按「匯出至Excel」會更新該筆紀錄")
 
-            cell.value = final_val
+    if submitted and map_image_lost():
+        # 上傳的圖片已被暫存區清除：這次不匯出缺圖的檔案；不重新上傳、再按一次則匯出不含圖片
+        del st.session_state.map_image_lost
+        st.warning("上傳的圖片已從暫存區清除，這次未匯出。請重新上傳圖片，或再按一次「匯出至Excel」匯出不含圖片的檔案")
+        submitted = False
 
-        if uploaded_map_image:
+    if submitted:
+        with metrics.request("export") as trace:
+            raw_inputs = dict(user_inputs)  # 自動計算前的輸入，載回時仍可重新計算
+            contract_no = index_keys(input_fields(schema, raw_inputs))[0]
+            loaded_id = st.session_state.get("submission_id")
+            if loaded_id is not None and contract_no != st.session_state.get("loaded_contract_no"):
+                forget_loaded_submission()  # 委託契約書編號已改：另一件案件，不沿用載入案件的圖片
+                loaded_id = None
+            new_image = image_bytes = artifact_store.get(session_id(), "map_image")
+            if image_bytes is None:
+                image_hash = st.session_state.get("stored_image_hash")
+                image_bytes = load_image(image_hash)
+            else:
+                image_hash = artifact_store.get(session_id(), "map_image_digest")
+            encoded_image = None
+            slot = map_image_slot(schema)
+            if image_bytes and image_hash and slot:
+                with trace.span("map_image_wait"):  # 背景處理尚未完成時等待
+                    encoded_image = image_prep.prepared(session_id(), image_hash, slot[1])
+            result = None
+            if API_URL:
+                try:
+                    with trace.span("api_generate"):
+                        result = request_workbook(API_URL, user_inputs, image_bytes)
+                except (OSError, ValueError):  # 服務無法使用或回應格式不對，改在本程序產生
+                    result = None
+            if result is None:
+                derived_memo = st.session_state.setdefault("derived_memo", {})
+                # 再次匯出只改寫變動的儲存格；memo 含工作表片段與圖片部件，放暫存區 (計入全域上限、閒置清除)
+                render_memo = artifact_store.get(session_id(), "render_memo") or {}
+                result = export_workbook(schema, user_inputs, io.BytesIO(image_bytes) if image_bytes else None,
+                                         derived_memo, encoded_image=encoded_image, render_memo=render_memo,
+                                         image_digest=image_hash if image_bytes else None)
+                artifact_store.put(session_id(), "render_memo", render_memo)
             try:
-                target_map_coord = None
-                for item in scanned_items:
-                    if "冒泡" in item["label"]:
-                        target_map_coord = item["coordinate"]
-                        break
-                
-                if target_map_coord:
-                    ws_output[target_map_coord].value = ""
-
-                    pil_img = Image.open(uploaded_map_image)
-                    pil_img = ImageOps.exif_transpose(pil_img)
-                    cropped_img = crop_image_to_ratio(pil_img, 27, 16)
-                    
-                    img_byte_arr = io.BytesIO()
-                    cropped_img.save(img_byte_arr, format='PNG')
-                    img_byte_arr.seek(0)
-                    
-                    img = ExcelImage(img_byte_arr)
-                    calc_w, calc_h = calculate_cell_pixels(ws_output, target_map_coord)
-                    img.width = calc_w
-                    img.height = calc_h
-                    
-                    ws_output.add_image(img, target_map_coord)
-            except Exception as e:
-                st.warning(f"圖片處理異常: {e}")
-
-        id_coord = None
-        name_coord = None
-        for item in scanned_items:
-            if "委託" in item["label"] and "編號" in item["label"]:
-                id_coord = item["coordinate"]
-            if "案名" in item["label"]:
-                name_coord = item["coordinate"]
-        
-        file_id = user_inputs.get(id_coord, "無編號") if id_coord else "無編號"
-        file_name = user_inputs.get(name_coord, "無案名") if name_coord else "無案名"
-        safe_filename = f"{file_id}{file_name}.xlsx"
-        safe_filename = "".join([c for c in safe_filename if c.isalpha() or c.isdigit() or c in " ._-()[\u4e00-\u9fa5]"])
-
-        output_buffer = io.BytesIO()
-        wb_output.save(output_buffer)
-        output_buffer.seek(0)
+                with trace.span("store_save"):
+                    saved_id = save_submission(
+                        schema, raw_inputs, st.session_state.get("imported_transcript"),
+                        new_image, loaded_id, image_hash=image_hash if new_image else None)
+                if saved_id != loaded_id:
+                    # 存成另一筆：不再沿用原案件的圖片；記住這筆，同一份表單再次匯出時更新它 (沒有委託契約書編號也不會重複新增)
+                    forget_loaded_submission()
+                    st.session_state.submission_id = saved_id
+                    st.session_state.loaded_contract_no = contract_no
+            except sqlite3.Error as e:
+                st.warning(f"案件紀錄儲存失敗: {e}")
+        safe_filename, data, export_warnings = result
+        for w in export_warnings:
+            st.warning(w)
+        output_buffer = io.BytesIO(data)
 
         st.success(f"整合完成 目前已可供下載Excel：{safe_filename}")
         
@@ -721,8 +675,35 @@ def main():
             label="下載Excel檔案",
             data=output_buffer,
             file_name=safe_filename,
-            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore"  # 下載不需重跑
         )
 
+def main():
+    inject_custom_styles()
+    start_background_preload()
+
+    if ADMIN_TOKEN and st.query_params.get("admin") == ADMIN_TOKEN:
+        render_admin_page()
+        return
+
+    if not os.path.exists(TEMPLATE_FILE):
+        st.error(f"系統錯誤：找不到 {TEMPLATE_FILE}")
+        return
+    try:
+        with metrics.request("template"):
+            schema = get_template_schema(TEMPLATE_FILE)
+    except Exception as e:
+        st.error(f"系統錯誤：讀取模板失敗 {e}")
+        return
+
+    st.markdown("<h1>永義物調整合</h1>", unsafe_allow_html=True)
+    st.markdown("<div class='subtitle'>YUNGYI PROPERTY INTEGRATION</div>", unsafe_allow_html=True)
+
+    render_history(schema)
+    render_import_center(schema)
+    render_map_image(schema)
+    render_survey_form(schema)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,198 @@
+"""
+批次匯出物調表：從 CSV / JSONL 讀取多筆案件，每筆輸出一個 xlsx。
+
+    python batch_export.py cases.csv -o output -j 4
+    python batch_export.py cases.csv --zip cases.zip              # 全部 xlsx 打包成一個 zip
+    python batch_export.py cases.csv --workbook cases.xlsx        # 一個活頁簿，每案一個物調表工作表
+
+欄位名稱使用模板上的標籤 (案名、售價、主建物坪數...)，比對規則與謄本匯入相同；
+冒泡位置圖欄位填圖片路徑 (相對於輸入檔所在資料夾)。
+「謄本」欄位可填建物謄本 PDF 路徑：謄本中每一戶各輸出一份，未填的欄位以謄本資料補上。
+不含車位坪數、房屋單價、公設比填 0 時與介面一樣自動計算。
+zip / 活頁簿邊產生邊寫入，記憶體用量不隨案件數增加。
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from derived_fields import derived_plan
+from survey_core import build_output_filename, export_workbook, prepare_case, unique_filename
+from template_schema import SELECT_PLACEHOLDER, get_template_schema
+from transcript import parse_transcript_units
+from xlsx_export import ZipStreamWriter
+
+DEFAULT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "template.xlsx")
+TRANSCRIPT_COLUMN = "謄本"
+
+
+def read_cases(path):
+    """讀取案件清單，.jsonl/.ndjson 一行一筆，其餘視為 CSV (第一列為欄位名稱)"""
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8-sig") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(csv.DictReader(f))
+
+
+def case_to_inputs(schema, case, base_dir):
+    """將一筆案件轉成與表單相同的 {座標: 輸入值}，另回傳冒泡位置圖與謄本路徑"""
+    user_inputs = {item["coordinate"]: "" for item in schema.scanned_items}
+    image_path = None
+    transcript_path = None
+    for key, value in case.items():
+        if not key or value is None:
+            continue
+        key = str(key).strip()
+        if key == TRANSCRIPT_COLUMN:
+            if value:
+                transcript_path = os.path.join(base_dir, str(value))
+            continue
+        coord = schema.resolve_label(key)
+        if not coord:
+            continue
+        if coord in schema.image_coords:
+            if value:
+                image_path = os.path.join(base_dir, str(value))
+            continue
+        value = str(value)
+        user_inputs[coord] = "" if value == SELECT_PLACEHOLDER else value
+    return user_inputs, image_path, transcript_path
+
+
+def unit_inputs(schema, user_inputs, units):
+    """謄本的每一戶各產生一份輸入，案件未填的欄位以該戶資料補上"""
+    for unit in units:
+        inputs = dict(user_inputs)
+        for key, value in unit.items():
+            coord = schema.resolve_label(key)
+            if coord and not inputs.get(coord):
+                inputs[coord] = value
+        yield inputs
+
+
+def _init_worker(template_path):
+    # 每個子程序只編譯一次模板
+    get_template_schema(template_path)
+
+
+def build_case(task):
+    """子程序：產生單一案件，回傳 (檔名, 內容, 警告清單, 錯誤訊息)；as_sheet 時內容為 (cell_values, map_images)"""
+    template_path, user_inputs, image_path, filename, as_sheet = task
+    try:
+        schema = get_template_schema(template_path)
+        if as_sheet:
+            cell_values, map_images, warnings = prepare_case(schema, user_inputs, image_path, derive=False)
+            return filename, (cell_values, map_images), warnings, None
+        _, data, warnings = export_workbook(schema, user_inputs, image_path, derive=False)
+        return filename, data, warnings, None
+    except Exception as e:
+        return filename, None, [], str(e)
+
+
+def ordered_results(tasks, workers, template_path):
+    """依原順序回傳 build_case 結果；同時最多 workers × 2 件在處理，尚未寫出的結果不會累積"""
+    if workers <= 1 or len(tasks) <= 1:
+        yield from map(build_case, tasks)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template_path,)) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.submit(build_case, task))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def run_batch(cases_path, output_dir, template_path=DEFAULT_TEMPLATE, workers=None, zip_path=None,
+              workbook_path=None):
+    """輸出到 output_dir (每案一個 xlsx)，或指定 zip_path / workbook_path 時寫成單一檔案；回傳 (總數, 失敗數)"""
+    schema = get_template_schema(template_path)
+    base_dir = os.path.dirname(os.path.abspath(cases_path))
+    if not (zip_path or workbook_path):
+        os.makedirs(output_dir, exist_ok=True)
+
+    jobs = []
+    failed = 0
+    for case_no, case in enumerate(read_cases(cases_path), 1):
+        user_inputs, image_path, transcript_path = case_to_inputs(schema, case, base_dir)
+        inputs_list = [user_inputs]
+        if transcript_path:
+            try:
+                units, warnings = parse_transcript_units(transcript_path)
+            except Exception as e:
+                failed += 1
+                print(f"第 {case_no} 筆謄本解析失敗 {transcript_path}: {e}", file=sys.stderr)
+                continue
+            for w in warnings:
+                print(f"    第 {case_no} 筆: {w}", file=sys.stderr)
+            if units:
+                inputs_list = list(unit_inputs(schema, user_inputs, units))
+        jobs += [(inputs, image_path) for inputs in inputs_list]
+
+    # 自動計算欄位一次以陣列運算算完，子程序不再逐筆計算
+    derived_plan(schema).evaluate_batch([inputs for inputs, _ in jobs])
+
+    parse_failed = failed  # 謄本解析失敗的案件沒有產生工作
+    tasks = []
+    used_names = set()
+    for inputs, image_path in jobs:
+        filename = unique_filename(build_output_filename(schema, inputs), used_names)
+        tasks.append((template_path, inputs, image_path, filename, bool(workbook_path)))
+
+    def completed():
+        nonlocal failed
+        results = ordered_results(tasks, workers or os.cpu_count() or 1, template_path)
+        for i, (filename, payload, warnings, error) in enumerate(results, 1):
+            if error:
+                failed += 1
+                print(f"[{i}/{len(tasks)}] 失敗 {filename}: {error}", file=sys.stderr)
+                continue
+            print(f"[{i}/{len(tasks)}] {filename}")
+            for w in warnings:
+                print(f"    {w}", file=sys.stderr)
+            yield filename, payload
+
+    if workbook_path:
+        with open(workbook_path, "wb") as f:
+            try:
+                schema.package.write_sheets(f, ((os.path.splitext(name)[0], *payload) for name, payload in completed()))
+            except ValueError as e:
+                print(f"未產生活頁簿: {e}", file=sys.stderr)
+    elif zip_path:
+        with open(zip_path, "wb") as f:
+            writer = ZipStreamWriter(f)
+            for filename, data in completed():
+                writer.add(filename, data, compress=False)  # xlsx 本身已壓縮
+            writer.close()
+    else:
+        for filename, data in completed():
+            with open(os.path.join(output_dir, filename), "wb") as f:
+                f.write(data)
+    return len(tasks) + parse_failed, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批次產生物調表 xlsx")
+    parser.add_argument("cases", help="案件清單 (.csv 或 .jsonl)")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("-o", "--output-dir", default="output", help="輸出資料夾 (預設 output)")
+    output.add_argument("--zip", help="全部案件打包成一個 zip 檔")
+    output.add_argument("--workbook", help="全部案件寫成一個 xlsx，每案一個工作表")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="子程序數量 (預設為 CPU 核心數)")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE, help="物調表模板路徑")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    total, failed = run_batch(args.cases, args.output_dir, args.template, args.workers, args.zip, args.workbook)
+    print(f"完成 {total - failed} 筆，失敗 {failed} 筆，耗時 {time.perf_counter() - start:.1f} 秒")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+PDF 擷取後端比較：每個後端解析同一批謄本，回報各欄位與基準後端 (第一個) 一致的比例及每秒頁數。
+
+    python -m benchmarks.bench_pdf_backends 謄本資料夾/ a.pdf b.pdf [--synthetic 40] [--repeat 3] [--json out.json]
+
+未指定 PDF 時只用合成謄本；實際謄本的版面較複雜，切換後端前請以實際謄本確認。
+所有欄位皆 100% 一致的後端中，列出最快的一個作為建議。
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+from benchmarks.synthetic import make_pdf, sample_corpus
+from transcript import PDF_BACKENDS, get_pdf_backend, parse_transcript_units
+
+
+def load_corpus(paths, synthetic):
+    """[(名稱, PDF bytes)]；路徑可為 PDF 檔或資料夾"""
+    corpus = []
+    for path in paths:
+        files = sorted(glob.glob(os.path.join(path, "**", "*.pdf"), recursive=True)) if os.path.isdir(path) else [path]
+        for name in files:
+            with open(name, "rb") as f:
+                corpus.append((os.path.relpath(name), f.read()))
+    for name, pages in sample_corpus(synthetic) if synthetic else []:
+        corpus.append((f"synthetic/{name}", make_pdf([text or " " for text in pages])))
+    return corpus
+
+
+def page_count(data, backend):
+    with get_pdf_backend(backend)(io.BytesIO(data)) as (total, page_texts):
+        page_texts.close()
+        return total
+
+
+def run_backend(backend, corpus, repeat):
+    """回傳 ({名稱: 每戶資料或錯誤訊息}, 秒數)；不設頁數/時間上限，所有頁都解析"""
+    results = {}
+    elapsed = 0.0
+    for name, data in corpus:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            try:
+                units, _ = parse_transcript_units(io.BytesIO(data), max_pages=0, time_budget=0, backend=backend)
+            except Exception as e:
+                units = f"{type(e).__name__}: {e}"
+            elapsed += time.perf_counter() - start
+        results[name] = units
+    return results, elapsed
+
+
+def field_agreement(reference, results):
+    """{欄位: (一致數, 總數)}；每一戶的每個欄位 (任一方有值) 算一次，戶數不同時多出的戶全算不一致"""
+    counts = {}
+    for name, ref_units in reference.items():
+        units = results[name]
+        if isinstance(ref_units, str) or isinstance(units, str):
+            counts.setdefault("(解析失敗)", [0, 0])
+            counts["(解析失敗)"][0] += isinstance(ref_units, str) and isinstance(units, str)
+            counts["(解析失敗)"][1] += 1
+            continue
+        for i in range(max(len(ref_units), len(units))):
+            ref = ref_units[i] if i < len(ref_units) else {}
+            got = units[i] if i < len(units) else {}
+            for field in set(ref) | set(got):
+                entry = counts.setdefault(field, [0, 0])
+                entry[0] += ref.get(field) == got.get(field)
+                entry[1] += 1
+    return {field: tuple(v) for field, v in sorted(counts.items())}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDF 擷取後端比較")
+    parser.add_argument("paths", nargs="*", help="謄本 PDF 或資料夾")
+    parser.add_argument("--synthetic", type=int, default=None, help="加入的合成謄本數 (未指定 PDF 時預設 40)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--backends", default=",".join(PDF_BACKENDS), help="逗號分隔，第一個為比對基準")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    parser.add_argument("--show", type=int, default=5, help="列出不一致的前幾筆")
+    args = parser.parse_args(argv)
+
+    synthetic = args.synthetic if args.synthetic is not None else (0 if args.paths else 40)
+    corpus = load_corpus(args.paths, synthetic)
+    if not corpus:
+        print("沒有可比較的謄本", file=sys.stderr)
+        return 1
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    total_pages = sum(page_count(data, backends[0]) for _, data in corpus)
+    print(f"謄本 {len(corpus)} 份，共 {total_pages} 頁，每份解析 {args.repeat} 次")
+
+    report = {"documents": len(corpus), "pages": total_pages, "backends": {}}
+    reference = None
+    for backend in backends:
+        results, elapsed = run_backend(backend, corpus, args.repeat)
+        if reference is None:
+            reference = results
+        agreement = field_agreement(reference, results)
+        pages_per_s = total_pages * args.repeat / elapsed if elapsed else 0.0
+        exact = all(same == total for same, total in agreement.values())
+        report["backends"][backend] = {
+            "pages_per_s": round(pages_per_s, 1),
+            "exact": exact,
+            "fields": {field: {"same": same, "total": total} for field, (same, total) in agreement.items()},
+        }
+
+        print(f"\n[{backend}] {pages_per_s:8.1f} 頁/秒" + ("" if backend == backends[0] else
+                                                       f"  與 {backends[0]} 全部一致: {'是' if exact else '否'}"))
+        for field, (same, total) in agreement.items():
+            print(f"    {field:<10} {same:>5}/{total:<5} {same / total * 100 if total else 100:6.1f}%")
+        shown = 0
+        for name in reference:
+            if shown >= args.show:
+                break
+            if results[name] != reference[name]:
+                print(f"    不一致 {name}\n      {backends[0]}: {reference[name]}\n      {backend}: {results[name]}")
+                shown += 1
+
+    candidates = [b for b, r in report["backends"].items() if r["exact"]]
+    best = max(candidates, key=lambda b: report["backends"][b]["pages_per_s"])
+    report["recommended"] = best
+    print(f"\n建議後端 (欄位全部一致中最快): {best}  (SURVEY_PDF_BACKEND={best})")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""
+冷啟動量測：每一項都在新的 Python 程序中執行。
+
+    python -m benchmarks.bench_startup [--repeat 3] [--json startup.json]
+
+- import_ms：載入 app 用到的模組 (streamlit 除外)，並列出是否已載入 pdfplumber / PIL / openpyxl
+- first_run_ms：第一次執行 app.py 腳本 (AppTest，相當於第一次繪製的伺服器端時間)
+- warm_first_run_ms：先以 serve.warm_up() 預熱 (另計 warm_up_ms)，再第一次執行 app.py
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_SNIPPET = """
+import json, sys, time
+import streamlit
+start = time.perf_counter()
+import metrics, survey_core, template_schema, transcript
+elapsed = (time.perf_counter() - start) * 1e3
+print(json.dumps({"import_ms": elapsed,
+                  "loaded": {m: m in sys.modules for m in ("pdfplumber", "PIL.Image", "openpyxl")}}))
+"""
+
+_FIRST_RUN_SNIPPET = """
+import json, os, time
+os.environ["SURVEY_PRELOAD"] = "0"
+from streamlit.testing.v1 import AppTest
+result = {}
+if WARM:
+    import serve
+    start = time.perf_counter()
+    serve.warm_up()
+    result["warm_up_ms"] = (time.perf_counter() - start) * 1e3
+start = time.perf_counter()
+at = AppTest.from_file(APP, default_timeout=60).run()
+result["first_run_ms"] = (time.perf_counter() - start) * 1e3
+assert not at.exception, at.exception
+print(json.dumps(result))
+"""
+
+
+def _run(snippet):
+    env = dict(os.environ, SURVEY_METRICS="0")
+    out = subprocess.run([sys.executable, "-c", snippet], cwd=ROOT, env=env, capture_output=True,
+                         text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷啟動量測")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    args = parser.parse_args(argv)
+
+    app = os.path.join(ROOT, "app.py")
+    imports = [_run(_IMPORT_SNIPPET) for _ in range(args.repeat)]
+    cold = [_run(_FIRST_RUN_SNIPPET.replace("WARM", "False").replace("APP", repr(app))) for _ in range(args.repeat)]
+    warm = [_run(_FIRST_RUN_SNIPPET.replace("WARM", "True").replace("APP", repr(app))) for _ in range(args.repeat)]
+
+    results = {
+        "import_ms": statistics.median(r["import_ms"] for r in imports),
+        "loaded_at_import": imports[0]["loaded"],
+        "first_run_ms": statistics.median(r["first_run_ms"] for r in cold),
+        "warm_up_ms": statistics.median(r["warm_up_ms"] for r in warm),
+        "warm_first_run_ms": statistics.median(r["first_run_ms"] for r in warm),
+    }
+    print(f"模組載入          {results['import_ms']:8.1f} ms  已載入: "
+          + ", ".join(f"{m}={'是' if v else '否'}" for m, v in results["loaded_at_import"].items()))
+    print(f"第一次執行 (冷)    {results['first_run_ms']:8.1f} ms")
+    print(f"預熱              {results['warm_up_ms']:8.1f} ms  (伺服器啟動時)")
+    print(f"第一次執行 (預熱後) {results['warm_first_run_ms']:8.1f} ms")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
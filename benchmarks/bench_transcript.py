@@ -0,0 +1,88 @@
+"""
+謄本解析基準測試：在合成謄本上比對新舊解析器的輸出，並回報解析 CPU 時間。
+另檢查預設上傳路徑 (只解析第一戶) 與逐戶解析的第一戶一致，多戶擠在同一頁時也不會合併。
+
+    python -m benchmarks.bench_transcript [--repeat 20]
+"""
+import argparse
+import sys
+import time
+
+from benchmarks.legacy_transcript import legacy_parse_pages
+from benchmarks.synthetic import sample_corpus, transcript_pages
+from transcript import FirstUnitParser, parse_transcript_pages, parse_transcript_unit_pages
+
+
+def cpu_time(fn, corpus, repeat):
+    start = time.process_time()
+    for _ in range(repeat):
+        for _, pages in corpus:
+            fn(pages)
+    return time.process_time() - start
+
+
+def first_unit_pages(pages):
+    """與 PDF 預設路徑相同：逐頁餵給 FirstUnitParser，完整即停；回傳 (第一戶, 是否已看到下一戶)"""
+    parser = FirstUnitParser()
+    for text in pages:
+        parser.feed_page(text)
+        if parser.complete:
+            break
+    parser.close()
+    return parser.result(), parser.more_units
+
+
+def check_first_unit(corpus):
+    """第一戶解析結果的不一致清單 [(名稱, 逐戶解析的第一戶, 第一戶解析結果)]"""
+    # 多戶擠在同一頁：第一戶不可併入後面幾戶的面積與門牌，且要知道還有其他戶
+    single_page = [(f"single-page-{units}u-{seed}", ["\n".join(transcript_pages(seed=seed, units=units))])
+                   for seed in range(5) for units in (2, 3)]
+    mismatches = []
+    for name, pages in list(corpus) + single_page:
+        units = parse_transcript_unit_pages(pages)
+        expected = units[0] if units else {}
+        actual, more = first_unit_pages(pages)
+        if actual != expected or (len(units) > 1 and len(pages) == 1 and not more):
+            mismatches.append((name, expected, actual))
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="謄本解析基準測試")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--count", type=int, default=40, help="合成謄本數量")
+    args = parser.parse_args(argv)
+
+    corpus = sample_corpus(args.count)
+    mismatches = []
+    for name, pages in corpus:
+        expected = legacy_parse_pages(pages)
+        actual = parse_transcript_pages(pages)
+        if expected != actual:
+            mismatches.append((name, expected, actual))
+
+    for name, expected, actual in mismatches:
+        print(f"輸出不一致 {name}\n  舊版: {expected}\n  新版: {actual}")
+    print(f"輸出比對：{len(corpus) - len(mismatches)}/{len(corpus)} 份一致")
+
+    first_unit_mismatches = check_first_unit(corpus)
+    for name, expected, actual in first_unit_mismatches:
+        print(f"第一戶不一致 {name}\n  逐戶解析: {expected}\n  第一戶解析: {actual}")
+    print(f"第一戶比對：{len(first_unit_mismatches)} 份不一致")
+
+    # 單頁謄本最常見，另外分開列出 (固定成本在單頁時最明顯)
+    groups = [("全部", corpus), ("單頁", [d for d in corpus if len(d[1]) == 1]),
+              ("多頁", [d for d in corpus if len(d[1]) > 1])]
+    for title, docs in groups:
+        if not docs:
+            continue
+        runs = len(docs) * args.repeat
+        legacy_s = cpu_time(legacy_parse_pages, docs, args.repeat)
+        current_s = cpu_time(parse_transcript_pages, docs, args.repeat)
+        print(f"[{title} {len(docs)} 份] 舊版解析：{legacy_s * 1e6 / runs:8.1f} µs/份 (CPU)  "
+              f"新版解析：{current_s * 1e6 / runs:8.1f} µs/份 (CPU)  {legacy_s / current_s:.2f}x")
+    return 1 if mismatches or first_unit_mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+import re
+
+from survey_core import full_to_half, chinese_to_arabic
+
+
+def legacy_parse_pages(page_texts):
+    """改版前的 parse_transcript_pdf (多次全文 regex)，用來比對新解析器的輸出"""
+    data = {}
+    full_text = ""
+    for text in page_texts:
+        full_text += text + "\n"
+
+    lines = full_text.split('\n')
+    address_prefix = ""
+    address_road = ""
+    for i, line in enumerate(lines):
+        line = line.strip()
+        if "建物標示部" in line:
+            for offset in range(1, 5):
+                if i + offset < len(lines):
+                    txt = lines[i+offset]
+                    match = re.search(r'(.+?[市縣].+?[區鄉鎮市])', txt)
+                    if match:
+                        address_prefix = match.group(1)
+                        break
+        if "建物門牌" in line:
+            parts = line.split("建物門牌")
+            if len(parts) > 1 and parts[1].strip():
+                address_road = parts[1].strip()
+            elif i+1 < len(lines):
+                address_road = lines[i+1].strip()
+
+    if address_prefix or address_road:
+        full_addr = f"{address_prefix}{address_road}"
+        data["地址"] = full_to_half(full_addr).replace(" ", "")
+
+    date_match = re.search(r'建築完成日期\s*([民國\d]+年\d+月\d+日)', full_text)
+    if date_match: data["建築完成日"] = date_match.group(1)
+
+    layer_m2_matches = re.findall(r'層次面積\s*([\d\.]+)\s*平方公尺', full_text)
+    if layer_m2_matches:
+        total_main_m2 = sum(float(x) for x in layer_m2_matches)
+        data["主建物坪數"] = str(round(total_main_m2 * 0.3025, 3))
+
+    try:
+        start = full_text.find("附屬建物用途")
+        end = full_text.find("共有部分")
+        if start != -1:
+            sub_text = full_text[start:end] if end != -1 else full_text[start:]
+            annex_matches = re.findall(r'面積\s*([\d\.]+)\s*平方公尺', sub_text)
+            if annex_matches:
+                total_annex_m2 = sum(float(x) for x in annex_matches)
+                data["附屬建坪數"] = str(round(total_annex_m2 * 0.3025, 3))
+    except: pass
+
+    floors_match = re.search(r'層數\s*(\d+)層', full_text)
+    if floors_match: data["地上層"] = str(int(floors_match.group(1)))
+
+    layer_match = re.search(r'層次\s*([^\d\s]+)層', full_text)
+    if layer_match and "面積" not in layer_match.group(0):
+        data["位於樓層"] = chinese_to_arabic(layer_match.group(1))
+    return data
@@ -0,0 +1,318 @@
+"""
+多 session 負載測試：以 streamlit.testing.v1.AppTest 在同一程序內同時模擬多位業務操作 app.py (離線)。
+
+    python -m benchmarks.load_test                          # 並行 1、2、4、8，每個並行數每位模擬業務跑 2 個場次
+    python -m benchmarks.load_test --levels 1,4,16 --sessions 3 --json load.json
+    python -m benchmarks.load_test --compare load.json      # 各並行數各步驟 p95 變慢超過門檻時回傳 1
+
+每個場次：開啟頁面 → 上傳合成謄本 → 匯入建物基本資料 → 填寫 MAIN_ORDER 欄位 → 上傳照片 → 匯出。
+各並行數回報吞吐量 (場次/秒)、各步驟 p50/p95/p99 與程序 RSS (目前與峰值)；--spans 另列程式內部各階段計時。
+預設每個場次使用不同的謄本與照片 (不會命中快取)；--same-files 則全部相同。
+案件紀錄寫入暫存資料庫 (可用 SURVEY_DB_PATH 指定)，不影響 submissions.db。
+
+AppTest 原本假設同時只跑一個：所有 session 共用同一個 session id、每次執行結束把 Runtime 設回 None，
+且執行期間以 mock.patch 暫時改寫全域設定。這裡讓每個模擬業務各有自己的 session id、Runtime 被清掉時沿用
+最近一次的 Runtime、設定改為整個程序固定一次，其餘與實際執行相同 (每個 session 的腳本在自己的執行緒執行)。
+"""
+import argparse
+import ast
+import contextlib
+import json
+import logging
+import math
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_FILE = os.path.join(ROOT, "app.py")
+
+from benchmarks.run import SAMPLE_CASE, _peak_rss_mb, _proc_status_mb, _reset_peak_rss  # noqa: E402
+from benchmarks.synthetic import make_pdf, make_photo, transcript_pages  # noqa: E402
+
+STEPS = ("open", "upload_pdf", "import", "upload_photo", "submit")
+
+_local = threading.local()
+
+
+def _percentile(sorted_values, pct):
+    # nearest-rank，與 metrics 相同
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def main_order():
+    """app.py 的 MAIN_ORDER (直接讀原始碼，匯入 app.py 會執行頁面設定)"""
+    with open(APP_FILE, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "MAIN_ORDER" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise ValueError("app.py 中找不到 MAIN_ORDER")
+
+
+def patch_apptest():
+    from streamlit import config
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.scriptrunner import magic
+    from streamlit.testing.v1 import app_test, local_script_runner
+    from streamlit.testing.v1.util import build_mock_config_get_option
+
+    # 每次執行以 mock.patch 暫時替換 config.get_option，多執行緒交錯還原會互相蓋掉；改為整個程序固定設定一次
+    config.get_option = build_mock_config_get_option({"global.appTest": True, "logger.level": "error"})
+    app_test.patch_config_options = lambda overrides: contextlib.nullcontext()
+
+    # Python 3.11 的 ast.parse 多執行緒同時呼叫偶爾失敗 (SystemError: AST constructor recursion depth mismatch)
+    parse_lock = threading.Lock()
+    original_add_magic = magic.add_magic
+
+    def add_magic(code, script_path):
+        with parse_lock:
+            return original_add_magic(code, script_path)
+
+    magic.add_magic = add_magic
+
+    last = {}
+    original_instance = Runtime.instance.__func__
+
+    def instance(cls):
+        if cls._instance is not None:
+            last["runtime"] = cls._instance
+            return cls._instance
+        if "runtime" in last:
+            return last["runtime"]
+        return original_instance(cls)
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(lambda cls: cls._instance is not None or "runtime" in last)
+
+    original_init = local_script_runner.LocalScriptRunner.__init__
+
+    def init(self, *args, **kwargs):
+        original_init(self, *args, **kwargs)
+        self._session_id = getattr(_local, "session_id", self._session_id)
+
+    local_script_runner.LocalScriptRunner.__init__ = init
+
+
+def field_value(label, item_index):
+    for key, value in SAMPLE_CASE.items():
+        if key in label or label in key:
+            return value
+    if "日" in label:
+        return "90/1/1"
+    return f"{label}{item_index}"
+
+
+def fill_main_fields(at, labels):
+    """依 MAIN_ORDER 填寫表單 (與 TemplateSchema.form_layout 相同的標籤比對)；回傳填寫的欄位數"""
+    widgets = list(at.text_input) + list(at.text_area) + list(at.selectbox)
+    filled = 0
+    for i, label in enumerate(labels):
+        widget = next((w for w in widgets if w.label == label), None) or \
+            next((w for w in widgets if label in w.label or w.label in label), None)
+        if widget is None or widget.key is None or not widget.key[:1].isalpha() or widget.key.startswith("history"):
+            continue
+        if hasattr(widget, "options"):
+            if len(widget.options) > 1:
+                widget.set_value(widget.options[1])
+        else:
+            widget.input(field_value(label, i))
+        filled += 1
+    return filled
+
+
+class StepFailed(Exception):
+    pass
+
+
+def _check(at, step):
+    if at.exception:
+        raise StepFailed(f"{step}: {at.exception[0].message}")
+
+
+def run_session(seed, files, labels, timeout, timings):
+    """單一場次；timings 為 {步驟: [ms]}，回傳錯誤訊息或 None"""
+    from streamlit.testing.v1 import AppTest
+
+    pdf, photo = files(seed)
+    _local.session_id = f"load-{uuid.uuid4().hex}"
+
+    def timed(step, fn):
+        start = time.perf_counter()
+        at = fn()
+        timings[step].append((time.perf_counter() - start) * 1e3)
+        _check(at, step)
+        return at
+
+    try:
+        at = timed("open", lambda: AppTest.from_file(APP_FILE, default_timeout=timeout).run())
+        timed("upload_pdf", lambda: at.file_uploader(key="pdf_upload_0")
+              .upload("transcript.pdf", pdf, "application/pdf").run())
+        if not any("已解析" in c.value for c in at.caption):
+            raise StepFailed("upload_pdf: 沒有解析結果")
+        timed("import", lambda: next(b for b in at.button if b.label == "匯入建物基本資料").click().run())
+        photo_uploader = next(u for u in at.file_uploader if not (u.key or "").startswith("pdf_upload"))
+        timed("upload_photo", lambda: photo_uploader.upload("map.jpg", photo, "image/jpeg").run())
+        fill_main_fields(at, labels)
+        timed("submit", lambda: next(b for b in at.button if b.label == "匯出至Excel").click().run())
+        if not any("整合完成" in s.value for s in at.success):
+            raise StepFailed("submit: 沒有產生檔案")
+    except StepFailed as e:
+        return str(e)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def run_level(concurrency, sessions, files, labels, timeout):
+    import metrics
+
+    metrics.reset()
+    timings = {step: [] for step in STEPS}
+    errors = []
+    seeds = iter(range(concurrency * sessions))
+    seeds_lock = threading.Lock()
+
+    def agent(offset):
+        for _ in range(sessions):
+            with seeds_lock:
+                seed = next(seeds) + offset
+            error = run_session(seed, files, labels, timeout, timings)
+            if error:
+                errors.append(error)
+
+    rss_before = _reset_peak_rss()
+    start = time.perf_counter()
+    threads = [threading.Thread(target=agent, args=(concurrency * 1000,), name=f"agent-{i}")
+               for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    total = concurrency * sessions
+    result = {
+        "concurrency": concurrency,
+        "sessions": total,
+        "failed": len(errors),
+        "errors": sorted(set(errors))[:10],
+        "seconds": round(elapsed, 3),
+        "sessions_per_s": round((total - len(errors)) / elapsed, 3) if elapsed else 0.0,
+        "rss_before_mb": round(rss_before, 1),
+        "rss_mb": round(_proc_status_mb("VmRSS"), 1) if sys.platform.startswith("linux") else None,
+        "rss_peak_mb": round(_peak_rss_mb(), 1),
+        "steps": {},
+        "spans": metrics.percentiles(),
+    }
+    for step, values in timings.items():
+        if values:
+            values = sorted(values)
+            result["steps"][step] = {
+                "count": len(values),
+                "p50": round(_percentile(values, 50), 2),
+                "p95": round(_percentile(values, 95), 2),
+                "p99": round(_percentile(values, 99), 2),
+                "mean": round(statistics.fmean(values), 2),
+            }
+    return result
+
+
+def print_level(result, show_spans):
+    print(f"\n並行 {result['concurrency']}：完成 {result['sessions'] - result['failed']}/{result['sessions']} 場次，"
+          f"{result['seconds']:.1f} 秒，吞吐 {result['sessions_per_s']:.2f} 場次/秒，"
+          f"RSS {result['rss_mb']} MB (峰值 {result['rss_peak_mb']} MB)")
+    print(f"    {'步驟':<14}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for step, v in result["steps"].items():
+        print(f"    {step:<16}{v['p50']:10.1f}{v['p95']:10.1f}{v['p99']:10.1f}")
+    if show_spans:
+        for key, v in result["spans"].items():
+            print(f"      {key:<36}{v['p50']:10.1f}{v['p95']:10.1f}{v['p99']:10.1f}  ({v['count']})")
+    for error in result["errors"]:
+        print(f"    失敗: {error}")
+
+
+def compare(levels, baseline, threshold):
+    """回傳 p95 變慢超過門檻的 [(並行數, 步驟, 倍數)]"""
+    old_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    regressions = []
+    for level in levels:
+        old = old_levels.get(level["concurrency"])
+        if not old:
+            continue
+        for step, v in level["steps"].items():
+            old_p95 = old["steps"].get(step, {}).get("p95")
+            if not old_p95:
+                continue
+            ratio = v["p95"] / old_p95
+            print(f"  並行 {level['concurrency']:<3} {step:<14} {old_p95:10.1f} → {v['p95']:10.1f} ms  {ratio:5.2f}x")
+            if ratio > threshold:
+                regressions.append((level["concurrency"], step, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多 session 負載測試 (AppTest)")
+    parser.add_argument("--levels", default="1,2,4,8", help="逗號分隔的並行數")
+    parser.add_argument("--sessions", type=int, default=2, help="每位模擬業務在每個並行數跑的場次")
+    parser.add_argument("--units", type=int, default=3, help="合成謄本的戶數")
+    parser.add_argument("--photo", default="4032x3024", help="合成照片尺寸")
+    parser.add_argument("--same-files", action="store_true", help="所有場次使用相同的謄本與照片 (測快取命中)")
+    parser.add_argument("--timeout", type=float, default=120, help="單一步驟逾時秒數")
+    parser.add_argument("--spans", action="store_true", help="另列程式內部各階段計時 (metrics)")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    parser.add_argument("--compare", help="與先前的 JSON 結果比較")
+    parser.add_argument("--threshold", type=float, default=1.5, help="p95 變慢超過此倍數視為退步")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)  # app.py 以相對路徑讀取 template.xlsx
+    os.environ.setdefault("SURVEY_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="survey_load_"), "load.db"))
+    from streamlit.logger import set_log_level
+    set_log_level("error")  # 每次執行的 streamlit 警告 (設定重新載入時依 logger.level 重設，見 patch_apptest)
+    import metrics
+    metrics.logger.setLevel(logging.WARNING)  # 不逐筆輸出 JSON log
+    patch_apptest()
+
+    width, height = (int(v) for v in args.photo.lower().split("x"))
+    cache = {}
+
+    def files(seed):
+        seed = 0 if args.same_files else seed
+        if seed not in cache:
+            pages = transcript_pages(seed=seed, units=args.units)
+            cache[seed] = (make_pdf([text or " " for text in pages]), make_photo(width, height, seed=seed))
+        return cache[seed]
+
+    labels = main_order()
+    levels = []
+    print(f"每個場次：{' → '.join(STEPS)}；謄本 {args.units} 戶，照片 {width}x{height}")
+    for concurrency in (int(v) for v in args.levels.split(",") if v.strip()):
+        # 先產生本輪要用的檔案，不計入步驟時間
+        for agent in range(concurrency):
+            for i in range(args.sessions):
+                files(concurrency * 1000 + agent * args.sessions + i)
+        result = run_level(concurrency, args.sessions, files, labels, args.timeout)
+        levels.append(result)
+        print_level(result, args.spans)
+
+    report = {"levels": levels, "units": args.units, "photo": args.photo, "same_files": args.same_files}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n與 {args.compare} 比較 (p95，門檻 {args.threshold}x)")
+        regressions = compare(levels, baseline, args.threshold)
+        if regressions:
+            print("退步: " + ", ".join(f"並行 {c} {step} {ratio:.2f}x" for c, step, ratio in regressions))
+            return 1
+    return 1 if any(level["failed"] for level in levels) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
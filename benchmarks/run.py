@@ -0,0 +1,287 @@
+"""
+物調表各階段基準測試 (離線，使用 template.xlsx 與合成謄本/照片)。
+
+    python -m benchmarks.run                       # 全部項目
+    python -m benchmarks.run -k transcript          # 名稱包含 transcript 的項目
+    python -m benchmarks.run --json bench.json      # 另存 JSON，供不同 commit 之間比較
+    python -m benchmarks.run --compare bench.json   # 與先前結果比較，變慢超過門檻時回傳 1
+
+每個項目在獨立子程序中執行：先執行一次量測峰值 RSS 增量 (含 Pillow 等原生配置)，
+再執行一次以 tracemalloc 量測 Python 物件峰值，最後以 timeit 重複計時 wall time。
+"""
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE_FILE = os.path.join(ROOT, "template.xlsx")
+
+# 表單上常見的輸入 (標籤 → 值)，0 觸發自動計算
+SAMPLE_CASE = {
+    "委託契約書編號": "B0001",
+    "案名": "基準測試案",
+    "售價": "1288",
+    "主建物坪數": "30.25",
+    "附屬建坪數": "3.1",
+    "公設坪數": "10.2",
+    "不含車位坪數": "0",
+    "房屋單價": "0",
+    "公設比": "0",
+    "建築完成日": "88/5/20",
+    "格局": "3/2/2",
+    "管理費": "2500",
+}
+
+
+def _schema():
+    from template_schema import get_template_schema
+    return get_template_schema(TEMPLATE_FILE)
+
+
+def _sample_inputs(schema):
+    user_inputs = {item["coordinate"]: "" for item in schema.scanned_items}
+    for label, value in SAMPLE_CASE.items():
+        coord = schema.resolve_label(label)
+        if coord:
+            user_inputs[coord] = value
+    return user_inputs
+
+
+# --- 測試項目：setup 函式回傳要計時的無參數函式 ---
+
+def _template_compile():
+    from template_schema import compile_template
+    with open(TEMPLATE_FILE, "rb") as f:
+        data = f.read()
+    return lambda: compile_template(data)
+
+
+def _template_cached():
+    from template_schema import get_template_schema
+    get_template_schema(TEMPLATE_FILE)
+    return lambda: get_template_schema(TEMPLATE_FILE)
+
+
+def _transcript(pages, first_unit_only=False):
+    def setup():
+        from benchmarks.synthetic import make_pdf, transcript_pages
+        from transcript import parse_transcript_pdf, parse_transcript_units
+        pdf_bytes = make_pdf(transcript_pages(seed=pages, pages=pages))
+        fn = parse_transcript_pdf if first_unit_only else parse_transcript_units
+        # 不限頁數/時間，量測完整解析
+        return lambda: fn(io.BytesIO(pdf_bytes), max_pages=0, time_budget=0)
+    return setup
+
+
+def _derived_fields():
+    from survey_core import apply_derived_fields, format_cell_values
+    schema = _schema()
+    user_inputs = _sample_inputs(schema)
+    return lambda: format_cell_values(schema, apply_derived_fields(schema, dict(user_inputs)))
+
+
+def _image(width, height, fmt="JPEG", cached=False):
+    def setup():
+        from benchmarks.synthetic import make_photo
+        from survey_core import build_map_images, map_image_cache
+        schema = _schema()
+        data = make_photo(width, height, fmt=fmt, orientation=6 if fmt == "JPEG" else None)
+
+        def run():
+            if not cached:
+                map_image_cache.clear()  # 量測實際處理；cached 量測同一張圖再次匯出
+            return build_map_images(schema, io.BytesIO(data), {})
+        return run
+    return setup
+
+
+def _render(with_image):
+    def setup():
+        from benchmarks.synthetic import make_photo
+        from survey_core import apply_derived_fields, build_map_images, format_cell_values
+        schema = _schema()
+        cell_values = format_cell_values(schema, apply_derived_fields(schema, _sample_inputs(schema)))
+        images = build_map_images(schema, io.BytesIO(make_photo(4032, 3024)), cell_values) if with_image else []
+        return lambda: schema.package.render(cell_values, images)
+    return setup
+
+
+def _render_repeat():
+    """同一 session 修改一個欄位後再次匯出 (render_memo，含冒泡位置圖)"""
+    def setup():
+        from benchmarks.synthetic import make_photo
+        from survey_core import apply_derived_fields, build_map_images, format_cell_values
+        schema = _schema()
+        cell_values = format_cell_values(schema, apply_derived_fields(schema, _sample_inputs(schema)))
+        images = build_map_images(schema, io.BytesIO(make_photo(4032, 3024)), cell_values)
+        memo = {}
+        schema.package.render(cell_values, images, memo)
+        coord = next(iter(cell_values))
+        state = {"n": 0}
+
+        def run():
+            state["n"] += 1
+            cell_values[coord] = str(state["n"])
+            return schema.package.render(cell_values, images, memo)
+        return run
+    return setup
+
+
+CASES = {
+    "template_compile": _template_compile,
+    "template_cached": _template_cached,
+    "transcript_1p": _transcript(1),
+    "transcript_10p": _transcript(10),
+    "transcript_50p": _transcript(50),
+    "transcript_first_unit_50p": _transcript(50, first_unit_only=True),
+    "derived_fields": _derived_fields,
+    "image_photo_2mp": _image(1600, 1200),
+    "image_photo_12mp": _image(4032, 3024),
+    "image_screenshot_png": _image(1280, 800, fmt="PNG"),
+    "image_photo_12mp_cached": _image(4032, 3024, cached=True),
+    "render_xlsx": _render(False),
+    "render_xlsx_with_image": _render(True),
+    "render_xlsx_repeat": _render_repeat(),
+}
+
+
+def _proc_status_mb(field):
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1]) / 1024
+    raise OSError(field)
+
+
+def _reset_peak_rss():
+    """Linux 可重設峰值 RSS (VmHWM)，回傳目前 RSS；其他平台回傳目前的 ru_maxrss"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return _proc_status_mb("VmRSS")
+    except OSError:
+        return _max_rss_mb()
+
+
+def _peak_rss_mb():
+    try:
+        return _proc_status_mb("VmHWM")
+    except OSError:
+        return _max_rss_mb()
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows 無 resource 模組，不回報記憶體
+        return 0.0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run_case(name, repeat):
+    """在子程序中執行：回傳單一項目的量測結果"""
+    fn = CASES[name]()
+
+    gc.collect()
+    rss_before = _reset_peak_rss()
+    fn()
+    rss_growth = _peak_rss_mb() - rss_before
+
+    tracemalloc.start()
+    fn()
+    py_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    per_call = [t / number for t in timer.repeat(repeat, number)]
+    return {
+        "calls": number * repeat,
+        "best_ms": min(per_call) * 1e3,
+        "median_ms": statistics.median(per_call) * 1e3,
+        "py_peak_kb": py_peak / 1024,
+        "rss_growth_mb": rss_growth,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """回傳變慢超過門檻的項目 [(名稱, 倍數)]"""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get("results", {}).get(name)
+        if not old or not old.get("median_ms"):
+            continue
+        ratio = result["median_ms"] / old["median_ms"]
+        print(f"  {name:<28} {old['median_ms']:10.3f} → {result['median_ms']:10.3f} ms  {ratio:5.2f}x")
+        if ratio > threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="物調表各階段基準測試")
+    parser.add_argument("-k", "--filter", default="", help="只執行名稱包含此字串的項目")
+    parser.add_argument("--repeat", type=int, default=5, help="計時重複次數 (取中位數)")
+    parser.add_argument("--json", help="將結果寫入 JSON 檔")
+    parser.add_argument("--compare", help="與先前的 JSON 結果比較")
+    parser.add_argument("--threshold", type=float, default=1.25, help="中位數變慢超過此倍數視為退步")
+    args = parser.parse_args(argv)
+
+    names = [name for name in CASES if args.filter in name]
+    results = {}
+    print(f"{'項目':<26} {'中位數 ms':>12} {'最佳 ms':>12} {'Python 峰值 KB':>16} {'RSS 增量 MB':>12}")
+    for name in names:
+        # 每個項目用新的子程序，避免前一項目的快取與記憶體峰值互相影響
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+            result = pool.submit(run_case, name, args.repeat).result()
+        results[name] = result
+        print(f"{name:<28} {result['median_ms']:12.3f} {result['best_ms']:12.3f} "
+              f"{result['py_peak_kb']:16.1f} {result['rss_growth_mb']:12.1f}")
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"與 {baseline.get('meta', {}).get('commit') or args.compare} 比較：")
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print(f"退步 {name}: {ratio:.2f}x", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
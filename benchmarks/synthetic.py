@@ -0,0 +1,202 @@
+import io
+import random
+import zlib
+
+# --- 合成測試資料 (離線產生，不含任何真實謄本) ---
+
+CITIES = [
+    ("臺北市", ["大安區", "信義區", "中山區", "士林區"]),
+    ("新竹市", ["東區", "北區", "香山區"]),
+    ("新北市", ["板橋區", "中和區", "新店區"]),
+    ("彰化縣", ["員林市", "鹿港鎮", "埔心鄉"]),
+    ("高雄市", ["鳳山區", "左營區", "三民區"]),
+]
+ROADS = ["和平東路二段", "中正路", "民生東路三段", "光復路一段", "自由路"]
+FLOOR_CN = ["一", "二", "三", "四", "五", "六", "七", "八", "九", "十", "十一", "十二", "十五", "二十一"]
+_FULL_WIDTH = str.maketrans("0123456789", "０１２３４５６７８９")
+
+LINES_PER_PAGE = 45
+
+
+def _unit_lines(rng, unit_no, variant):
+    city, districts = rng.choice(CITIES)
+    district = rng.choice(districts)
+    section = rng.choice(["學府段二小段", "東門段", "光明段一小段"])
+    floors = rng.randint(4, 28)
+    floor_idx = rng.randrange(len(FLOOR_CN))
+    main_areas = [round(rng.uniform(20, 120), 2) for _ in range(2 if variant == "duplex" else 1)]
+    annex_areas = [round(rng.uniform(2, 15), 2) for _ in range(rng.randint(0, 2))]
+    house_no = f"{rng.randint(1, 300)}號".translate(_FULL_WIDTH) if variant == "fullwidth" else f"{rng.randint(1, 300)}號"
+
+    lines = [
+        "******** 建物標示部 ********",
+        f"{city}{district}{section}",
+        f"登記日期：民國{rng.randint(70, 112):03d}年{rng.randint(1, 12):02d}月{rng.randint(1, 28):02d}日 登記原因：第一次登記",
+    ]
+    if variant == "split":
+        lines += ["建物門牌", f"{rng.choice(ROADS)}{house_no}{FLOOR_CN[floor_idx]}樓"]
+    else:
+        lines.append(f"建物門牌 {rng.choice(ROADS)}{house_no}{FLOOR_CN[floor_idx]}樓")
+    lines += [
+        f"建物坐落地號 {section} {rng.randint(1, 999):04d}-0000",
+        "主要用途 住家用 主要建材 鋼筋混凝土造",
+        f"層數 {floors}層 總面積 {sum(main_areas):.2f}平方公尺",
+    ]
+    for area in main_areas:
+        if variant == "split":
+            lines += [f"層次 {FLOOR_CN[floor_idx]}層 層次面積", f"{area} 平方公尺"]
+        else:
+            lines.append(f"層次 {FLOOR_CN[floor_idx]}層 層次面積 {area} 平方公尺")
+    if variant == "split":
+        lines += ["建築完成日期", f"民國{rng.randint(60, 112)}年{rng.randint(1, 12)}月{rng.randint(1, 28)}日"]
+    else:
+        lines.append(f"建築完成日期 民國{rng.randint(60, 112)}年{rng.randint(1, 12)}月{rng.randint(1, 28)}日")
+    for area in annex_areas:
+        lines.append(f"附屬建物用途 {rng.choice(['陽台', '雨遮', '花台'])} 面積 {area} 平方公尺")
+    lines += [
+        f"共有部分 {section} {rng.randint(1000, 9999):05d}-000建號 {rng.uniform(100, 3000):.2f}平方公尺",
+        f"權利範圍 {rng.randint(1, 999)}/100000",
+        "******** 建物所有權部 ********",
+        f"（{unit_no:04d}）登記次序：{unit_no:04d}",
+        f"登記日期：民國{rng.randint(90, 112):03d}年{rng.randint(1, 12):02d}月{rng.randint(1, 28):02d}日 登記原因：買賣",
+        "所有權人：王○○",
+        f"住址：{city}{district}{rng.choice(ROADS)}{rng.randint(1, 300)}號",
+        "權利範圍：全部 1分之1",
+    ]
+    return lines
+
+
+def _appendix_lines(rng, n):
+    lines = []
+    for i in range(n):
+        lines.append(f"（{i + 1:04d}）登記次序：{i + 1:04d}-000 權利種類：抵押權 收件年期：民國{rng.randint(90, 112)}年")
+        lines.append(f"擔保債權總金額：新臺幣{rng.randint(100, 9000)}萬元正 存續期間：不定期限")
+    return lines
+
+
+def transcript_pages(seed=0, units=1, pages=None, variant="standard"):
+    """
+    產生合成的建物謄本逐頁文字 (格式比照 pdfplumber 擷取結果)。
+    variant: standard / split (標籤與數值分行) / fullwidth (全形門牌) / duplex (多層次面積)
+    pages: 指定時以他項權利附錄補足頁數
+    """
+    rng = random.Random(seed)
+    lines = ["建物登記第二類謄本（建號全部）", f"列印時間：民國113年{rng.randint(1, 12):02d}月{rng.randint(1, 28):02d}日"]
+    for unit_no in range(1, units + 1):
+        lines += _unit_lines(rng, unit_no, variant)
+    if pages:
+        lines += _appendix_lines(rng, max(0, pages * LINES_PER_PAGE - len(lines)) // 2)
+    return ["\n".join(lines[i:i + LINES_PER_PAGE]) for i in range(0, len(lines), LINES_PER_PAGE)]
+
+
+# 邊界情況：跨多個空行的標籤、共有部分早於附屬建物、建物門牌在最後一行、兩段標示部
+EDGE_CASES = [
+    ("blank-lines", ["建物標示部\n\n臺北市大安區學府段\n層數\n\n  12層\n層次\n七層\n層次面積\n\n45.5\n平方公尺\n"
+                     "建築完成日期\n\n民國88年1月2日\n附屬建物用途 陽台\n面積\n3.2\n\n平方公尺\n共有部分"]),
+    ("shared-first", ["共有部分 見附表\n建物標示部\n新竹市東區光明段\n附屬建物用途 陽台 面積 3.2 平方公尺\n"
+                      "層次 三層 層次面積 30 平方公尺"]),
+    ("road-last-line", ["建物標示部\n彰化縣員林市中正段\n層次 二層 層次面積 20 平方公尺\n建物門牌"]),
+    ("annex-same-line", ["建物標示部\n高雄市鳳山區光明段\n附屬建物用途 陽台 面積 2.5 平方公尺 共有部分 面積 99 平方公尺"]),
+    ("two-markers", ["建物標示部\n建物標示部\n新北市板橋區東門段\n建物門牌 中正路1號", "建物標示部\n無地址行\n建物門牌\n"]),
+]
+
+
+def sample_corpus(count=40):
+    """各種版面變化的合成謄本 [(名稱, 逐頁文字)]"""
+    variants = ["standard", "split", "fullwidth", "duplex"]
+    corpus = list(EDGE_CASES)
+    for i in range(count):
+        variant = variants[i % len(variants)]
+        units = 1 if i % 5 else 2
+        pages = (None, 3, 10)[i % 3]
+        corpus.append((f"{variant}-{units}u-{i}", transcript_pages(seed=i, units=units, pages=pages, variant=variant)))
+    return corpus
+
+
+# --- 合成照片 ---
+
+def make_photo(width, height, seed=0, fmt="JPEG", orientation=None):
+    """類似手機照片的合成影像 (低頻雜訊 + 漸層)，回傳檔案 bytes；orientation 為 EXIF 方向值"""
+    from PIL import Image
+
+    noise = Image.effect_noise((max(1, width // 8), max(1, height // 8)), 40 + seed % 30)
+    noise = noise.resize((width, height), Image.BICUBIC)
+    gradient = Image.linear_gradient("L").resize((width, height))
+    img = Image.merge("RGB", (noise, gradient, noise.transpose(Image.FLIP_LEFT_RIGHT)))
+    out = io.BytesIO()
+    if fmt == "JPEG":
+        exif = img.getexif()
+        if orientation:
+            exif[0x0112] = orientation
+        img.save(out, format="JPEG", quality=92, exif=exif)
+    else:
+        img.save(out, format=fmt)
+    return out.getvalue()
+
+
+# --- 最小 PDF 產生器 ---
+# 使用 Identity-H 編碼搭配 ToUnicode，pdfplumber 可擷取出原文字；不內嵌字型 (僅供文字擷取)。
+
+def _to_unicode_cmap(codes):
+    highs = sorted({c >> 8 for c in codes})
+    ranges = "\n".join(f"<{h:02X}00> <{h:02X}FF> <{h:02X}00>" for h in highs)
+    return ("/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def\n"
+            "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+            "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+            f"{len(highs)} beginbfrange\n{ranges}\nendbfrange\nendcmap\n"
+            "CMapName currentdict /CMap defineresource pop\nend\nend\n").encode("ascii")
+
+
+def _stream(payload, compress=False):
+    if compress:
+        payload = zlib.compress(payload)
+        return b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(payload) + payload + b"\nendstream"
+    return b"<< /Length %d >>\nstream\n" % len(payload) + payload + b"\nendstream"
+
+
+def make_pdf(page_texts):
+    """將逐頁文字寫成 PDF bytes"""
+    objs = []
+
+    def add(body):
+        objs.append(body)
+        return len(objs)
+
+    codes = {ord(ch) for text in page_texts for ch in text if ch != "\n"}
+    to_unicode = add(_stream(_to_unicode_cmap(codes)))
+    descriptor = add(b"<< /Type /FontDescriptor /FontName /Synthetic /Flags 4 /FontBBox [0 -200 1000 900] "
+                     b"/ItalicAngle 0 /Ascent 900 /Descent -200 /CapHeight 700 /StemV 80 >>")
+    cid_font = add(b"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /Synthetic "
+                   b"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+                   b"/FontDescriptor %d 0 R /DW 1000 /CIDToGIDMap /Identity >>" % descriptor)
+    font = add(b"<< /Type /Font /Subtype /Type0 /BaseFont /Synthetic /Encoding /Identity-H "
+               b"/DescendantFonts [%d 0 R] /ToUnicode %d 0 R >>" % (cid_font, to_unicode))
+    pages_id = add(b"")
+
+    page_ids = []
+    for text in page_texts:
+        ops = ["BT", "/F1 10 Tf", "14 TL", "30 810 Td"]
+        for line in text.split("\n"):
+            ops.append("<%s> Tj T*" % "".join(f"{ord(ch):04X}" for ch in line))
+        ops.append("ET")
+        content = add(_stream("\n".join(ops).encode("ascii"), compress=True))
+        page_ids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+                            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+                            % (pages_id, font, content)))
+    objs[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+        b" ".join(b"%d 0 R" % i for i in page_ids), len(page_ids))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for i, body in enumerate(objs, 1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % i + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objs) + 1))
+    for off in offsets:
+        out.write(b"%010d 00000 n \n" % off)
+    out.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objs) + 1, catalog, xref))
+    return out.getvalue()
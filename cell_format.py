@@ -0,0 +1,90 @@
+import re
+
+# --- 儲存格格式化 ---
+# 模板編譯時依標籤為每個儲存格組好格式化函式 (民國日期、格局、萬/元單位)，
+# 匯出時每格只查一次表直接套用，不必每次都對標籤做字串比對；互動與批次匯出共用。
+
+WAN_KEYWORDS = ["售價", "單價", "價格", "貸款"]
+
+
+def format_date_roc(date_str):
+    if not date_str: return ""
+    match = re.match(r'(\d+)[/.-](\d+)[/.-](\d+)', date_str)
+    if match:
+        y, m, d = match.groups()
+        return f"民國{y}年{m}月{d}日"
+    return date_str
+
+def format_layout(layout_str):
+    if not layout_str: return ""
+    parts = re.split(r'[/, .]', layout_str)
+    parts = [p for p in parts if p.strip()]
+    result = ""
+    if len(parts) >= 1: result += f"{parts[0]}房"
+    if len(parts) >= 2: result += f"{parts[1]}廳"
+    if len(parts) >= 3: result += f"{parts[2]}衛浴"
+    if len(parts) >= 4: result += f"{parts[3]}陽台"
+    return result if result else layout_str
+
+def add_wan_suffix(value):
+    """純數字自動加萬"""
+    if not value: return value
+    v_str = str(value).strip()
+    if v_str.replace('.', '', 1).isdigit() and "萬" not in v_str:
+        return f"{v_str}萬"
+    return value
+
+def add_yuan_suffix(value):
+    """管理費自動加元"""
+    if not value: return value
+    v_str = str(value).strip()
+    if v_str and "元" not in v_str:
+        return f"{v_str}元"
+    return value
+
+
+def header_pipeline(header):
+    """標籤對應的格式化步驟 (依序套用)"""
+    steps = []
+    if "完成日" in header or "日期" in header:
+        steps.append(format_date_roc)
+    elif "格局" in header:
+        steps.append(format_layout)
+    if any(k in header for k in WAN_KEYWORDS):
+        steps.append(add_wan_suffix)
+    if "管理費" in header:
+        steps.append(add_yuan_suffix)
+    return tuple(steps)
+
+
+def _chain(steps):
+    if len(steps) == 1:
+        return steps[0]
+
+    def run(value):
+        for step in steps:
+            value = step(value)
+        return value
+    return run
+
+
+def compile_cell_formatters(coord_to_header, image_coords=()):
+    """{座標: 格式化函式}；不需格式化的欄位為 None，圖片欄位不在其中"""
+    formatters = {}
+    for coord, header in coord_to_header.items():
+        if coord in image_coords:
+            continue
+        steps = header_pipeline(header)
+        formatters[coord] = _chain(steps) if steps else None
+    return formatters
+
+
+def format_cells(formatters, image_coords, user_inputs):
+    """將輸入值轉為寫入儲存格的文字；模板以外的座標原樣寫入"""
+    cell_values = {}
+    for coord, value in user_inputs.items():
+        if coord in image_coords:
+            continue
+        fmt = formatters.get(coord)
+        cell_values[coord] = fmt(value or "") if fmt else (value or "")
+    return cell_values
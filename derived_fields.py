@@ -0,0 +1,154 @@
+import re
+import threading
+
+# --- 自動計算欄位 ---
+# 每個公式宣告目標欄位、輸入欄位 (模板標籤關鍵字) 與計算/格式；目標欄位輸入 0 時才計算。
+# 座標每個模板只解析一次，公式依相依關係排序 (房屋單價、公設比用到計算後的不含車位坪數)。
+# compute / when 只用四則運算與比較，純量與 NumPy 陣列都適用，批次模式一次算完所有案件。
+
+TRIGGER = "0"
+
+FORMULAS = (
+    {
+        "target": "不含車位",
+        "inputs": ("主建物", "附屬", "公設坪數"),
+        "compute": lambda main, annex, public: main + annex + public,
+        "format": lambda v: str(round(v, 3)),
+    },
+    {
+        "target": "房屋單價",
+        "inputs": ("售價", "不含車位"),
+        "when": lambda price, area: area > 0,
+        "compute": lambda price, area: price / area,
+        "format": lambda v: str(round(v, 2)),
+    },
+    {
+        "target": "公設比",
+        "inputs": ("公設坪數", "不含車位"),
+        "when": lambda public, area: area > 0,
+        "compute": lambda public, area: (public / area) * 100,
+        "format": lambda v: f"{round(v, 1)}%",
+    },
+)
+
+
+def safe_float_convert(value):
+    """安全轉換字串為浮點數，失敗回傳 0.0"""
+    try:
+        if not value: return 0.0
+        clean_val = re.sub(r'[^\d.]', '', str(value))
+        return float(clean_val)
+    except:
+        return 0.0
+
+
+def _find_coord(coord_to_header, keyword):
+    return next((k for k, v in coord_to_header.items() if keyword in v), None)
+
+
+def _order_steps(steps):
+    """依相依關係排序 (輸入座標是另一個公式的目標者排在其後)；有循環時拋出 ValueError"""
+    producers = {target: i for i, (target, _, _) in enumerate(steps)}
+    pending = {i: {producers[c] for c in inputs if c in producers and producers[c] != i}
+               for i, (_, inputs, _) in enumerate(steps)}
+    ordered = []
+    while pending:
+        ready = [i for i, deps in pending.items() if not deps]
+        if not ready:
+            raise ValueError("自動計算欄位的公式有循環相依")
+        for i in ready:
+            ordered.append(steps[i])
+            del pending[i]
+        for deps in pending.values():
+            deps.difference_update(ready)
+    return ordered
+
+
+def _evaluate(formula, raw_values):
+    try:
+        values = [safe_float_convert(v) for v in raw_values]
+        if "when" in formula and not formula["when"](*values):
+            return None
+        return formula["format"](formula["compute"](*values))
+    except Exception:
+        return None
+
+
+class DerivedPlan:
+    """一個模板的自動計算步驟：[(目標座標, 輸入座標, 公式)]，已依相依關係排序"""
+
+    def __init__(self, coord_to_header, formulas=FORMULAS):
+        steps = []
+        for formula in formulas:
+            target = _find_coord(coord_to_header, formula["target"])
+            if target:
+                inputs = tuple(_find_coord(coord_to_header, kw) for kw in formula["inputs"])
+                steps.append((target, inputs, formula))
+        self.steps = _order_steps(steps)
+
+    def apply(self, user_inputs, memo=None):
+        """
+        計算輸入為 0 的欄位 (直接修改 user_inputs)。
+        memo 為呼叫端保存的 dict 時，輸入值與上次相同的公式直接沿用上次結果。
+        """
+        for target, inputs, formula in self.steps:
+            if user_inputs.get(target) != TRIGGER:
+                continue
+            raw_values = tuple(user_inputs.get(c) for c in inputs)
+            key = (target, inputs)
+            if memo is not None and key in memo and memo[key][0] == raw_values:
+                result = memo[key][1]
+            else:
+                result = _evaluate(formula, raw_values)
+                if memo is not None:
+                    memo[key] = (raw_values, result)
+            if result is not None:
+                user_inputs[target] = result
+        return user_inputs
+
+    def evaluate_batch(self, rows):
+        """多筆案件一次計算 (直接修改每個 dict)，結果與逐筆 apply 相同"""
+        import numpy as np
+
+        parsed = {}  # 同一批次中重複的字串 (空白、0、常見坪數) 只轉換一次
+
+        def to_float(value):
+            try:
+                return parsed[value]
+            except KeyError:
+                result = parsed[value] = safe_float_convert(value)
+                return result
+
+        for target, inputs, formula in self.steps:
+            idx = [i for i, row in enumerate(rows) if row.get(target) == TRIGGER]
+            if not idx:
+                continue
+            columns = [np.fromiter((to_float(rows[i].get(c)) for i in idx), float, len(idx))
+                       for c in inputs]
+            with np.errstate(all="ignore"):
+                values = np.broadcast_to(formula["compute"](*columns), (len(idx),))
+                if "when" in formula:
+                    valid = np.broadcast_to(formula["when"](*columns), (len(idx),))
+                else:
+                    valid = np.ones(len(idx), dtype=bool)
+            fmt = formula["format"]
+            for i, value, ok in zip(idx, values.tolist(), valid.tolist()):
+                if ok:
+                    rows[i][target] = fmt(value)
+        return rows
+
+
+_plan_lock = threading.Lock()
+_plans = {}  # 模板 content_hash -> DerivedPlan
+
+
+def derived_plan(schema):
+    """取得模板的自動計算步驟 (每個模板內容只解析一次)"""
+    with _plan_lock:
+        plan = _plans.get(schema.content_hash)
+    if plan is None:
+        plan = DerivedPlan(schema.coord_to_header)
+        with _plan_lock:
+            _plans.clear()  # 只保留目前模板
+            _plans[schema.content_hash] = plan
+    return plan
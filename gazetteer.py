@@ -0,0 +1,179 @@
+import re
+import threading
+
+from survey_core import chinese_to_arabic
+
+# --- 行政區地名表 ---
+# 內建全國 22 縣市、368 鄉鎮市區 (離線，不查外部服務)，編成 Aho-Corasick 自動機，一次線性掃描即可找出「縣市+鄉鎮市區」。
+# 另收錄舊名 (2010/2014 升格前的縣與鄉鎮市、縣轄市改制前的鎮) 及「台」字寫法，比對後一律換成目前的正式名稱。
+# 行政區調整時更新 _AREAS / _LEGACY_COUNTIES / _RENAMED。
+
+_AREAS = {
+    "臺北市": "中正區 大同區 中山區 松山區 大安區 萬華區 信義區 士林區 北投區 內湖區 南港區 文山區",
+    "新北市": "板橋區 三重區 中和區 永和區 新莊區 新店區 樹林區 鶯歌區 三峽區 淡水區 汐止區 瑞芳區 土城區 蘆洲區 五股區"
+              " 泰山區 林口區 深坑區 石碇區 坪林區 三芝區 石門區 八里區 平溪區 雙溪區 貢寮區 金山區 萬里區 烏來區",
+    "基隆市": "中正區 七堵區 暖暖區 仁愛區 中山區 安樂區 信義區",
+    "桃園市": "桃園區 中壢區 大溪區 楊梅區 蘆竹區 大園區 龜山區 八德區 龍潭區 平鎮區 新屋區 觀音區 復興區",
+    "新竹市": "東區 北區 香山區",
+    "新竹縣": "竹北市 竹東鎮 新埔鎮 關西鎮 湖口鄉 新豐鄉 芎林鄉 橫山鄉 北埔鄉 寶山鄉 峨眉鄉 尖石鄉 五峰鄉",
+    "苗栗縣": "苗栗市 頭份市 苑裡鎮 通霄鎮 竹南鎮 後龍鎮 卓蘭鎮 大湖鄉 公館鄉 銅鑼鄉 南庄鄉 頭屋鄉 三義鄉 西湖鄉 造橋鄉"
+              " 三灣鄉 獅潭鄉 泰安鄉",
+    "臺中市": "中區 東區 南區 西區 北區 北屯區 西屯區 南屯區 太平區 大里區 霧峰區 烏日區 豐原區 后里區 石岡區 東勢區"
+              " 和平區 新社區 潭子區 大雅區 神岡區 大肚區 沙鹿區 龍井區 梧棲區 清水區 大甲區 外埔區 大安區",
+    "彰化縣": "彰化市 員林市 鹿港鎮 和美鎮 北斗鎮 溪湖鎮 田中鎮 二林鎮 線西鄉 伸港鄉 福興鄉 秀水鄉 花壇鄉 芬園鄉 大村鄉"
+              " 埔鹽鄉 埔心鄉 永靖鄉 社頭鄉 二水鄉 田尾鄉 埤頭鄉 芳苑鄉 大城鄉 竹塘鄉 溪州鄉",
+    "南投縣": "南投市 埔里鎮 草屯鎮 竹山鎮 集集鎮 名間鄉 鹿谷鄉 中寮鄉 魚池鄉 國姓鄉 水里鄉 信義鄉 仁愛鄉",
+    "雲林縣": "斗六市 斗南鎮 虎尾鎮 西螺鎮 土庫鎮 北港鎮 古坑鄉 大埤鄉 莿桐鄉 林內鄉 二崙鄉 崙背鄉 麥寮鄉 東勢鄉 褒忠鄉"
+              " 臺西鄉 元長鄉 四湖鄉 口湖鄉 水林鄉",
+    "嘉義市": "東區 西區",
+    "嘉義縣": "太保市 朴子市 布袋鎮 大林鎮 民雄鄉 溪口鄉 新港鄉 六腳鄉 東石鄉 義竹鄉 鹿草鄉 水上鄉 中埔鄉 竹崎鄉 梅山鄉"
+              " 番路鄉 大埔鄉 阿里山鄉",
+    "臺南市": "中西區 東區 南區 北區 安平區 安南區 永康區 歸仁區 新化區 左鎮區 玉井區 楠西區 南化區 仁德區 關廟區 龍崎區"
+              " 官田區 麻豆區 佳里區 西港區 七股區 將軍區 學甲區 北門區 新營區 後壁區 白河區 東山區 六甲區 下營區 柳營區"
+              " 鹽水區 善化區 大內區 山上區 新市區 安定區",
+    "高雄市": "新興區 前金區 苓雅區 鹽埕區 鼓山區 旗津區 前鎮區 三民區 楠梓區 小港區 左營區 仁武區 大社區 岡山區 路竹區"
+              " 阿蓮區 田寮區 燕巢區 橋頭區 梓官區 彌陀區 永安區 湖內區 鳳山區 大寮區 林園區 鳥松區 大樹區 旗山區 美濃區"
+              " 六龜區 內門區 杉林區 甲仙區 桃源區 那瑪夏區 茂林區 茄萣區",
+    "屏東縣": "屏東市 潮州鎮 東港鎮 恆春鎮 萬丹鄉 長治鄉 麟洛鄉 九如鄉 里港鄉 鹽埔鄉 高樹鄉 萬巒鄉 內埔鄉 竹田鄉 新埤鄉"
+              " 枋寮鄉 新園鄉 崁頂鄉 林邊鄉 南州鄉 佳冬鄉 琉球鄉 車城鄉 滿州鄉 枋山鄉 三地門鄉 霧臺鄉 瑪家鄉 泰武鄉 來義鄉"
+              " 春日鄉 獅子鄉 牡丹鄉",
+    "宜蘭縣": "宜蘭市 羅東鎮 蘇澳鎮 頭城鎮 礁溪鄉 壯圍鄉 員山鄉 冬山鄉 五結鄉 三星鄉 大同鄉 南澳鄉",
+    "花蓮縣": "花蓮市 鳳林鎮 玉里鎮 新城鄉 吉安鄉 壽豐鄉 光復鄉 豐濱鄉 瑞穗鄉 富里鄉 秀林鄉 萬榮鄉 卓溪鄉",
+    "臺東縣": "臺東市 成功鎮 關山鎮 卑南鄉 大武鄉 太麻里鄉 東河鄉 長濱鄉 鹿野鄉 池上鄉 綠島鄉 延平鄉 海端鄉 達仁鄉 金峰鄉"
+              " 蘭嶼鄉",
+    "澎湖縣": "馬公市 湖西鄉 白沙鄉 西嶼鄉 望安鄉 七美鄉",
+    "金門縣": "金城鎮 金湖鎮 金沙鎮 金寧鄉 烈嶼鄉 烏坵鄉",
+    "連江縣": "南竿鄉 北竿鄉 莒光鄉 東引鄉",
+}
+
+# 升格前的縣 -> 目前的直轄市；轄下的鄉鎮市改為區 (原本就是區的原市區不在此列)
+_LEGACY_COUNTIES = {"臺北縣": "新北市", "桃園縣": "桃園市", "臺中縣": "臺中市", "臺南縣": "臺南市", "高雄縣": "高雄市"}
+_CITY_DISTRICTS = {"臺中市": "中區 東區 南區 西區 北區 北屯區 西屯區 南屯區",
+                   "臺南市": "中西區 東區 南區 北區 安平區 安南區",
+                   "高雄市": "新興區 前金區 苓雅區 鹽埕區 鼓山區 旗津區 前鎮區 三民區 楠梓區 小港區"}
+# 改名的鄉鎮 (舊名 -> 目前名稱)
+_RENAMED = {"高雄縣三民鄉": "高雄市那瑪夏區"}
+
+_FULL_WIDTH = {i: i - 0xFEE0 for i in range(0xFF01, 0xFF5F)}
+_FULL_WIDTH.update({0x3000: None, 0x20: None, 0x09: None})
+_POSTAL_RE = re.compile(r'^\d{3}(?:\d{2,3})?')
+_NUMBER_RE = re.compile(r'([一二三四五六七八九十]+)(段|巷|弄|號|樓)')
+
+
+def _variants():
+    """{寫法: 目前的「縣市+鄉鎮市區」}"""
+    names = {}
+    for county, areas in _AREAS.items():
+        for area in areas.split():
+            names[county + area] = county + area
+            if area[-1] in "市鎮鄉":
+                # 鄉鎮改制為縣轄市 (頭份、員林等) 前後的寫法
+                for suffix in "市鎮鄉":
+                    names.setdefault(county + area[:-1] + suffix, county + area)
+    for legacy, city in _LEGACY_COUNTIES.items():
+        city_districts = set(_CITY_DISTRICTS.get(city, "").split())
+        for area in _AREAS[city].split():
+            if area not in city_districts:
+                for suffix in "市鎮鄉":
+                    names.setdefault(legacy + area[:-1] + suffix, city + area)
+    names.update(_RENAMED)
+    return names
+
+
+class _Automaton:
+    """Aho-Corasick：goto 為每個狀態的 {字元: 狀態}，output 為以該狀態結尾的最長名稱"""
+
+    def __init__(self, names):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [None]
+        for name in names:
+            state = 0
+            for ch in name:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append(None)
+                state = nxt
+            self.output[state] = name
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                if self.output[nxt] is None:
+                    self.output[nxt] = self.output[self.fail[nxt]]
+
+    def search(self, text):
+        """第一個出現的名稱 (結束位置最早，同位置取最長)；回傳 (開始, 結束, 名稱) 或 None"""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            name = output[state]
+            if name is not None:
+                return i + 1 - len(name), i + 1, name
+        return None
+
+
+_lock = threading.Lock()
+_index = None
+
+
+def _get_index():
+    global _index
+    if _index is None:
+        with _lock:
+            if _index is None:
+                names = _variants()
+                _index = (_Automaton(names), names)
+    return _index
+
+
+def find_area(text):
+    """
+    text 中第一個「縣市+鄉鎮市區」：回傳 (開始, 結束, 目前的正式名稱)，找不到回傳 None。
+    text[開始:結束] 為原文寫法 (可能是舊名或「台」字)。
+    """
+    automaton, names = _get_index()
+    found = automaton.search(text.replace("台", "臺"))  # 長度不變，位置與原文相同
+    if found is None:
+        return None
+    start, end, name = found
+    return start, end, names[name]
+
+
+def normalize_address(address):
+    """
+    整理使用者輸入的地址：去除空白、全形英數轉半形；開頭 (郵遞區號之後) 的行政區換成目前的正式名稱。
+    其餘部分照原樣保留 (地圖連結與表單顯示用)。
+    """
+    text = (address or "").translate(_FULL_WIDTH)
+    postal = _POSTAL_RE.match(text)
+    head = postal.end() if postal else 0
+    found = find_area(text[head:])
+    if found is None or found[0] != 0:
+        return text
+    _, end, name = found
+    return text[:head] + name + text[head + end:]
+
+
+def address_key(address):
+    """
+    案件索引用的地址鍵：normalize_address 後去掉郵遞區號，「台」改「臺」，段/巷/弄/號/樓的國字數字改阿拉伯數字。
+    同一地址不同寫法 (台北市/臺北市、臺北縣板橋市/新北市板橋區、二段/2段) 得到相同的鍵。
+    """
+    text = normalize_address(address)
+    postal = _POSTAL_RE.match(text)
+    if postal:
+        text = text[postal.end():]
+    text = text.replace("台", "臺")
+    return _NUMBER_RE.sub(lambda m: chinese_to_arabic(m.group(1)) + m.group(2), text)
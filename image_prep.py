@@ -0,0 +1,109 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from session_store import artifact_store
+from survey_core import encode_map_image_cached
+
+# --- 冒泡位置圖背景處理 ---
+# 上傳後立即在背景執行緒轉正、剪裁、編碼 (encode_map_image_cached)，結果存入 session 暫存區，匯出時直接嵌入。
+# 每個 session 同時只有一個工作：重新上傳時取消排隊中的前一個工作，執行中的無法中斷，完成後結果直接丟棄。
+# 執行緒數固定為 WORKERS；排隊的工作超過 QUEUE_LIMIT 時不再排入，匯出時改為當場處理 (與原本相同)。
+
+WORKERS = int(os.environ.get("SURVEY_IMAGE_WORKERS") or 2)
+QUEUE_LIMIT = int(os.environ.get("SURVEY_IMAGE_QUEUE") or WORKERS * 8)
+
+_lock = threading.Lock()
+_executor = None
+_jobs = {}  # session_id -> 尚未完成的工作
+_queued = 0
+
+
+def image_digest(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class _Job:
+    __slots__ = ("session_id", "digest", "target_size", "future")
+
+    def __init__(self, session_id, digest, target_size):
+        self.session_id = session_id
+        self.digest = digest
+        self.target_size = target_size
+        self.future = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="survey-image")
+    return _executor
+
+
+def _finish(job, future):
+    global _queued
+    with _lock:
+        _queued -= 1
+        current = _jobs.get(job.session_id) is job
+        if current:
+            del _jobs[job.session_id]
+    if not current or future.cancelled() or future.exception() is not None:
+        return  # 已被新的上傳取代，或處理失敗 (匯出時當場處理會顯示錯誤)
+    data, fmt = future.result()
+    artifact_store.put(job.session_id, "map_image_prepared", data)
+    artifact_store.put(job.session_id, "map_image_prepared_meta",
+                       {"digest": job.digest, "target_size": job.target_size, "format": fmt})
+
+
+def submit(session_id, image_bytes, digest, target_size):
+    """排入背景處理 (digest 為 image_digest 結果) 並取消同一 session 前一個工作；排隊已滿時回傳 False"""
+    global _queued
+    discard(session_id)
+    job = _Job(session_id, digest, tuple(target_size))
+    with _lock:
+        if _queued >= QUEUE_LIMIT:
+            return False
+        _queued += 1
+        _jobs[session_id] = job
+        job.future = _get_executor().submit(encode_map_image_cached, io.BytesIO(image_bytes), target_size, digest)
+    job.future.add_done_callback(lambda future: _finish(job, future))
+    return True
+
+
+def pending(session_id):
+    with _lock:
+        return session_id in _jobs
+
+
+def discard(session_id):
+    """取消排隊中的工作並清除已完成的結果"""
+    with _lock:
+        job = _jobs.pop(session_id, None)
+    if job is not None:
+        job.future.cancel()
+    artifact_store.discard(session_id, "map_image_prepared")
+    artifact_store.discard(session_id, "map_image_prepared_meta")
+
+
+def prepared(session_id, digest, target_size, timeout=None):
+    """
+    取得原圖 SHA-256 為 digest、輸出尺寸為 target_size 的處理結果 (bytes, 格式)，沒有時回傳 None。
+    工作仍在進行時最多等待 timeout 秒 (None 為等到完成)。
+    """
+    target_size = tuple(target_size)
+    with _lock:
+        job = _jobs.get(session_id)
+    if job is not None:
+        if job.target_size != target_size or job.digest != digest:
+            return None
+        try:
+            return job.future.result(timeout)
+        except Exception:
+            return None
+    meta = artifact_store.get(session_id, "map_image_prepared_meta")
+    if not meta or meta["target_size"] != target_size or meta["digest"] != digest:
+        return None
+    data = artifact_store.get(session_id, "map_image_prepared")
+    return (data, meta["format"]) if data is not None else None
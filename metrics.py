@@ -0,0 +1,156 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# --- 階段計時 ---
+# 每個請求 (上傳謄本、匯出) 以 request() 包起來，其中各階段以 span() 計時；
+# 請求結束時輸出一行 JSON log，並累計到各階段的滾動視窗供管理頁顯示 p50/p95/p99。
+# 目前請求存在 thread-local (Streamlit 每個 session 的腳本在自己的執行緒)，
+# 因此模板編譯、謄本解析等底層函式也能直接加 span，不在請求中時不做任何事。
+
+ENABLED = os.environ.get("SURVEY_METRICS", "1") != "0"
+TRACE_MEMORY = os.environ.get("SURVEY_METRICS_TRACEMALLOC") == "1"
+WINDOW = int(os.environ.get("SURVEY_METRICS_WINDOW") or 500)
+
+logger = logging.getLogger("survey_app.metrics")
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+if ENABLED and TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+_local = threading.local()
+_windows_lock = threading.Lock()
+_windows = {}  # "種類/階段" -> deque[ms]
+
+
+class _NullContext:
+    """停用或不在請求中時共用的空 context，避免任何配置"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def span(self, name):
+        return self
+
+
+_NULL = _NullContext()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "start", "mem_start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        if TRACE_MEMORY:
+            # 多個 session 同時執行時峰值會互相疊加，僅供參考
+            self.mem_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record = {"ms": round((time.perf_counter() - self.start) * 1e3, 3)}
+        if TRACE_MEMORY:
+            record["peak_kb"] = round((tracemalloc.get_traced_memory()[1] - self.mem_start) / 1024, 1)
+        if exc_type is not None:
+            record["error"] = exc_type.__name__
+        self.trace.spans[self.name] = record
+        return False
+
+
+class Trace:
+    """一次請求的各階段紀錄"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.spans = {}
+        self.start = time.perf_counter()
+
+    def span(self, name):
+        return _Span(self, name)
+
+    def __enter__(self):
+        self.parent = getattr(_local, "trace", None)
+        _local.trace = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _local.trace = self.parent
+        # 沒有任何階段 (例如模板已在快取中) 的請求不記錄
+        if self.spans:
+            total_ms = round((time.perf_counter() - self.start) * 1e3, 3)
+            _record(self.kind, total_ms, self.spans)
+            logger.info(json.dumps({
+                "event": "request",
+                "kind": self.kind,
+                "ok": exc_type is None,
+                "total_ms": total_ms,
+                "spans": self.spans,
+                "ts": round(time.time(), 3),
+            }, ensure_ascii=False))
+        return False
+
+
+def request(kind):
+    """開始一個請求：with request("export") as trace: ..."""
+    if not ENABLED:
+        return _NULL
+    return Trace(kind)
+
+
+def span(name):
+    """目前請求中的一個階段；不在請求中 (例如批次匯出子程序) 時不做任何事"""
+    trace = getattr(_local, "trace", None) if ENABLED else None
+    if trace is None:
+        return _NULL
+    return trace.span(name)
+
+
+def _record(kind, total_ms, spans):
+    with _windows_lock:
+        for key, ms in [("total", total_ms)] + [(name, rec["ms"]) for name, rec in spans.items()]:
+            window = _windows.get(f"{kind}/{key}")
+            if window is None:
+                window = _windows[f"{kind}/{key}"] = deque(maxlen=WINDOW)
+            window.append(ms)
+
+
+def _percentile(sorted_values, pct):
+    # nearest-rank
+    return sorted_values[max(0, math.ceil(pct / 100 * len(sorted_values)) - 1)]
+
+
+def percentiles():
+    """各「種類/階段」最近 WINDOW 筆的 {筆數, p50, p95, p99} (ms)"""
+    with _windows_lock:
+        snapshot = {key: sorted(window) for key, window in _windows.items()}
+    return {
+        key: {
+            "count": len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+        }
+        for key, values in sorted(snapshot.items())
+    }
+
+
+def reset():
+    with _windows_lock:
+        _windows.clear()
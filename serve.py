@@ -0,0 +1,71 @@
+"""
+先預熱再啟動 Streamlit (同一個程序)，第一位使用者不必等模板編譯：
+
+    python serve.py [--server.port 8501 ...]
+
+參數原樣傳給 streamlit run app.py。
+"""
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+APP_FILE = os.path.join(ROOT, "app.py")
+TEMPLATE_FILE = os.path.join(ROOT, "template.xlsx")
+
+# 首次上傳謄本 / 圖片才需要的套件，啟動後在背景載入 (謄本依 SURVEY_PDF_BACKEND 選用的擷取後端)
+PDF_MODULE = "pypdfium2" if os.environ.get("SURVEY_PDF_BACKEND") == "pdfium" else "pdfplumber"
+PRELOAD_MODULES = (PDF_MODULE, "PIL.Image", "PIL.ImageOps")
+
+_preload_lock = threading.Lock()
+_preload_started = False
+
+
+def warm_up(template_file=TEMPLATE_FILE):
+    """編譯模板 (連同 openpyxl 載入) 並預先 import 謄本解析的 regex，回傳各步驟毫秒數"""
+    timings = {}
+    start = time.perf_counter()
+    from template_schema import get_template_schema
+    get_template_schema(template_file)
+    timings["template_ms"] = round((time.perf_counter() - start) * 1e3, 1)
+
+    start = time.perf_counter()
+    import transcript  # noqa: F401  模組載入時編譯欄位 regex
+    timings["transcript_ms"] = round((time.perf_counter() - start) * 1e3, 1)
+    return timings
+
+
+def _preload():
+    for name in PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+def start_background_preload():
+    """每個程序只執行一次：背景執行緒載入 PRELOAD_MODULES，不阻塞第一次繪製"""
+    global _preload_started
+    with _preload_lock:
+        if _preload_started or os.environ.get("SURVEY_PRELOAD") == "0":
+            return
+        _preload_started = True
+    threading.Thread(target=_preload, name="survey-preload", daemon=True).start()
+
+
+def main():
+    import metrics
+    timings = warm_up()
+    metrics.logger.info(json.dumps({"event": "warmup", **timings}))
+    start_background_preload()
+
+    from streamlit.web import cli
+    sys.argv = ["streamlit", "run", APP_FILE] + sys.argv[1:]
+    return cli.main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
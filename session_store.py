@@ -0,0 +1,193 @@
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# --- Session 暫存區 ---
+# 上傳的謄本 / 冒泡位置圖與解析結果不留在 st.session_state 與上傳緩衝 (整個 session 都佔記憶體)，改存這裡。
+# 小物件放記憶體，大型物件 (>= SPILL_BYTES) 直接寫到暫存資料夾；所有 session 共用上限：
+# 記憶體超過時把最久未用的搬到磁碟，磁碟超過時刪除最久未用的；閒置超過 IDLE_SECONDS 的 session 整批清除。
+# 被淘汰的物件 get() 回傳預設值，呼叫端需請使用者重新上傳。
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+MEMORY_BUDGET = int(_env_float("SURVEY_SESSION_MEMORY_MB", 64) * 1024 * 1024)
+DISK_BUDGET = int(_env_float("SURVEY_SESSION_DISK_MB", 1024) * 1024 * 1024)
+SPILL_BYTES = int(_env_float("SURVEY_SESSION_SPILL_KB", 256) * 1024)
+IDLE_SECONDS = _env_float("SURVEY_SESSION_IDLE_MINUTES", 60) * 60
+CLEANUP_INTERVAL = 60
+
+
+def process_rss_bytes():
+    """目前程序的常駐記憶體 (Linux)，無法取得時回傳 None"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class _Item:
+    __slots__ = ("data", "path", "size", "pickled")
+
+    def __init__(self, data, size, pickled):
+        self.data = data  # 在記憶體時為 bytes，搬到磁碟後為 None
+        self.path = None
+        self.size = size
+        self.pickled = pickled
+
+
+class ArtifactStore:
+    """以 (session_id, 名稱) 存放 bytes 或可 pickle 的物件，記憶體/磁碟用量有全域上限 (LRU)"""
+
+    def __init__(self, memory_budget=MEMORY_BUDGET, disk_budget=DISK_BUDGET, spill_bytes=SPILL_BYTES,
+                 idle_seconds=IDLE_SECONDS, directory=None):
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self.spill_bytes = spill_bytes
+        self.idle_seconds = idle_seconds
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.spills = 0
+        self.evictions = 0
+        self._directory = directory
+        self._items = OrderedDict()  # (session_id, 名稱) -> _Item，最久未用的在前
+        self._sessions = {}  # session_id -> 最後存取時間
+        self._lock = threading.Lock()
+        self._last_cleanup = time.monotonic()
+
+    def _spill_path(self):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="survey_session_")
+        os.makedirs(self._directory, exist_ok=True)
+        return os.path.join(self._directory, uuid.uuid4().hex)
+
+    def _to_disk(self, item):
+        path = self._spill_path()
+        with open(path, "wb") as f:
+            f.write(item.data)
+        self.memory_bytes -= item.size
+        self.disk_bytes += item.size
+        item.path = path
+        item.data = None
+        self.spills += 1
+
+    def _remove(self, key):
+        item = self._items.pop(key, None)
+        if item is None:
+            return
+        if item.path:
+            self.disk_bytes -= item.size
+            try:
+                os.remove(item.path)
+            except OSError:
+                pass
+        else:
+            self.memory_bytes -= item.size
+
+    def _enforce_budgets(self):
+        if self.memory_bytes > self.memory_budget:
+            for item in list(self._items.values()):
+                if self.memory_bytes <= self.memory_budget:
+                    break
+                if item.path is None:
+                    self._to_disk(item)
+        if self.disk_bytes > self.disk_budget:
+            for key, item in list(self._items.items()):
+                if self.disk_bytes <= self.disk_budget:
+                    break
+                if item.path:
+                    self._remove(key)
+                    self.evictions += 1
+
+    def _touch(self, session_id):
+        self._sessions[session_id] = time.monotonic()
+        if time.monotonic() - self._last_cleanup > CLEANUP_INTERVAL:
+            self._last_cleanup = time.monotonic()
+            self._drop_idle()
+
+    def _drop_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = {sid for sid, last in self._sessions.items() if last < cutoff}
+        if idle:
+            for key in [key for key in self._items if key[0] in idle]:
+                self._remove(key)
+            for sid in idle:
+                del self._sessions[sid]
+
+    def put(self, session_id, name, value):
+        pickled = not isinstance(value, bytes)
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) if pickled else value
+        item = _Item(data, len(data), pickled)
+        with self._lock:
+            self._remove((session_id, name))
+            self._items[(session_id, name)] = item
+            self.memory_bytes += item.size
+            if item.size >= self.spill_bytes:
+                self._to_disk(item)
+            self._enforce_budgets()
+            self._touch(session_id)
+
+    def get(self, session_id, name, default=None):
+        with self._lock:
+            item = self._items.get((session_id, name))
+            if item is None:
+                return default
+            self._items.move_to_end((session_id, name))
+            self._touch(session_id)
+            data, path = item.data, item.path
+        if data is None:
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+            except OSError:
+                return default  # 讀取時剛好被淘汰
+        return pickle.loads(data) if item.pickled else data
+
+    def contains(self, session_id, name):
+        """是否仍在暫存區 (不讀取內容)；與 get 一樣算一次存取"""
+        with self._lock:
+            if (session_id, name) not in self._items:
+                return False
+            self._items.move_to_end((session_id, name))
+            self._touch(session_id)
+            return True
+
+    def discard(self, session_id, name):
+        with self._lock:
+            self._remove((session_id, name))
+
+    def drop_session(self, session_id):
+        with self._lock:
+            for key in [key for key in self._items if key[0] == session_id]:
+                self._remove(key)
+            self._sessions.pop(session_id, None)
+
+    def cleanup_idle(self):
+        with self._lock:
+            self._last_cleanup = time.monotonic()
+            self._drop_idle()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "items": len(self._items),
+                "memory_bytes": self.memory_bytes,
+                "memory_budget": self.memory_budget,
+                "disk_bytes": self.disk_bytes,
+                "disk_budget": self.disk_budget,
+                "spills": self.spills,
+                "evictions": self.evictions,
+                "process_rss_bytes": process_rss_bytes(),
+            }
+
+
+artifact_store = ArtifactStore(directory=os.environ.get("SURVEY_SESSION_DIR") or None)
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+
+from gazetteer import address_key
+
+# --- 案件紀錄 ---
+# 每次匯出把輸入值 (以標籤為鍵，模板欄位座標變動也能沿用)、匯入的謄本資料與冒泡位置圖存進本機 SQLite，
+# 之後可依委託契約書編號 / 案名 / 地址搜尋，直接載回表單或重新匯出，不必重新上傳謄本。
+# 圖片依內容 SHA-256 只存一份；同一委託契約書編號的案件視為同一筆，再次匯出時更新。
+# 地址另存正規化的 address_key (gazetteer.address_key)，台/臺、舊縣名、國字數字等不同寫法都搜得到。
+
+DB_PATH = os.environ.get("SURVEY_DB_PATH") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "submissions.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    id INTEGER PRIMARY KEY,
+    contract_no TEXT NOT NULL DEFAULT '',
+    case_name TEXT NOT NULL DEFAULT '',
+    address TEXT NOT NULL DEFAULT '',
+    address_key TEXT NOT NULL DEFAULT '',
+    fields TEXT NOT NULL,
+    transcript TEXT,
+    image_hash TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_submissions_contract_no ON submissions (contract_no);
+CREATE INDEX IF NOT EXISTS idx_submissions_case_name ON submissions (case_name);
+CREATE INDEX IF NOT EXISTS idx_submissions_address ON submissions (address);
+CREATE INDEX IF NOT EXISTS idx_submissions_updated_at ON submissions (updated_at);
+CREATE TABLE IF NOT EXISTS images (
+    hash TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+"""
+
+_init_lock = threading.Lock()
+_initialized = set()  # 已建立資料表的路徑
+
+
+def connect(path=None):
+    """開啟資料庫 (第一次使用時建立資料表)；呼叫端負責關閉"""
+    path = path or DB_PATH
+    conn = sqlite3.connect(path, timeout=10)
+    conn.row_factory = sqlite3.Row
+    with _init_lock:
+        if path not in _initialized:
+            conn.execute("PRAGMA journal_mode=WAL")  # 多個 session 同時讀寫
+            conn.executescript(_SCHEMA)
+            _migrate(conn)
+            _initialized.add(path)
+    return conn
+
+
+def _migrate(conn):
+    """舊版資料庫補上 address_key 欄位並回填"""
+    columns = {row["name"] for row in conn.execute("PRAGMA table_info(submissions)")}
+    if "address_key" not in columns:
+        with conn:
+            conn.execute("ALTER TABLE submissions ADD COLUMN address_key TEXT NOT NULL DEFAULT ''")
+            rows = conn.execute("SELECT id, address FROM submissions WHERE address != ''").fetchall()
+            conn.executemany("UPDATE submissions SET address_key = ? WHERE id = ?",
+                             [(address_key(row["address"]), row["id"]) for row in rows])
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_submissions_address_key ON submissions (address_key)")
+
+
+def _find_label(labels, *keywords):
+    return next((lbl for lbl in labels if all(k in lbl for k in keywords)), None)
+
+
+def index_keys(fields):
+    """從 {標籤: 值} 取出索引欄位 (委託契約書編號, 案名, 地址)"""
+    keys = []
+    for keywords in (("委託", "編號"), ("案名",), ("地址",)):
+        label = _find_label(fields, *keywords)
+        keys.append(str(fields.get(label) or "").strip() if label else "")
+    return tuple(keys)
+
+
+def input_fields(schema, user_inputs):
+    """表單的 {座標: 輸入值} 轉成儲存用的 {標籤: 值} (不含圖片欄)"""
+    return {schema.coord_to_header[coord]: value for coord, value in user_inputs.items()
+            if coord in schema.coord_to_header and coord not in schema.image_coord_set}
+
+
+def save_submission(schema, user_inputs, transcript=None, image_bytes=None, submission_id=None, path=None,
+                    image_hash=None):
+    """
+    儲存一次匯出 (user_inputs 為 {座標: 輸入值})，回傳案件 id。
+    指定 submission_id 且該筆的委託契約書編號與這次相同 (同為空白亦可) 時更新該筆；否則同一委託契約書編號已有紀錄時更新，
+    其餘新增。沒有委託契約書編號又未指定 submission_id 的匯出一律新增，不會覆寫其他案件。
+    image_bytes 為 None 時沿用原紀錄的圖片；image_hash 為其 SHA-256 (已知時不必重算，已存過的圖片不再寫入)。
+    """
+    fields = input_fields(schema, user_inputs)
+    contract_no, case_name, address = index_keys(fields)
+    if not image_bytes:
+        image_hash = None
+    elif not image_hash:
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+    now = time.time()
+
+    with closing(connect(path)) as conn, conn:
+        if image_hash and conn.execute("SELECT 1 FROM images WHERE hash = ?", (image_hash,)).fetchone() is None:
+            conn.execute("INSERT OR IGNORE INTO images (hash, data) VALUES (?, ?)", (image_hash, image_bytes))
+        if submission_id is not None:
+            # 編號與原紀錄不同 (改成另一個編號、補上或清掉編號) 時，無法確認是同一件案件，視為另一件
+            row = conn.execute("SELECT contract_no FROM submissions WHERE id = ?", (submission_id,)).fetchone()
+            if row is None or row["contract_no"] != contract_no:
+                submission_id = None
+        if submission_id is None and contract_no:
+            row = conn.execute("SELECT id FROM submissions WHERE contract_no = ? ORDER BY updated_at DESC LIMIT 1",
+                               (contract_no,)).fetchone()
+            submission_id = row["id"] if row else None
+        values = (contract_no, case_name, address, address_key(address), json.dumps(fields, ensure_ascii=False),
+                  json.dumps(transcript, ensure_ascii=False) if transcript else None)
+        if submission_id is not None:
+            conn.execute(
+                "UPDATE submissions SET contract_no = ?, case_name = ?, address = ?, address_key = ?, fields = ?,"
+                " transcript = COALESCE(?, transcript), image_hash = COALESCE(?, image_hash), updated_at = ?"
+                " WHERE id = ?", values + (image_hash, now, submission_id))
+            return submission_id
+        cur = conn.execute(
+            "INSERT INTO submissions (contract_no, case_name, address, address_key, fields, transcript, image_hash,"
+            " created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", values + (image_hash, now, now))
+        return cur.lastrowid
+
+
+def search_submissions(query="", limit=20, path=None):
+    """
+    依委託契約書編號 / 案名 / 地址前綴搜尋 (走索引)，空字串列出最近的案件；依更新時間新到舊。
+    地址另以正規化後的前綴比對 address_key (輸入「台北市大安」也找得到「臺北市大安區」)。
+    """
+    query = (query or "").strip()
+    sql = "SELECT id, contract_no, case_name, address, updated_at FROM submissions"
+    params = ()
+    if query:
+        # 前綴以範圍比較表示，三個欄位都能用索引
+        upper = query + "\U0010ffff"
+        sql += (" WHERE (contract_no >= ? AND contract_no < ?) OR (case_name >= ? AND case_name < ?)"
+                " OR (address >= ? AND address < ?)")
+        params = (query, upper) * 3
+        key = address_key(query)
+        if key:
+            sql += " OR (address_key >= ? AND address_key < ?)"
+            params += (key, key + "\U0010ffff")
+    sql += " ORDER BY updated_at DESC LIMIT ?"
+    with closing(connect(path)) as conn:
+        return [dict(row) for row in conn.execute(sql, params + (limit,))]
+
+
+def load_submission(submission_id, path=None):
+    """回傳 {"id", "fields": {標籤: 值}, "transcript", "image_hash", ...}，找不到回傳 None"""
+    with closing(connect(path)) as conn:
+        row = conn.execute("SELECT * FROM submissions WHERE id = ?", (submission_id,)).fetchone()
+    if row is None:
+        return None
+    record = dict(row)
+    record["fields"] = json.loads(record["fields"])
+    record["transcript"] = json.loads(record["transcript"]) if record["transcript"] else None
+    return record
+
+
+def load_image(image_hash, path=None):
+    if not image_hash:
+        return None
+    with closing(connect(path)) as conn:
+        row = conn.execute("SELECT data FROM images WHERE hash = ?", (image_hash,)).fetchone()
+    return bytes(row["data"]) if row else None
+
+
+def submission_inputs(schema, fields):
+    """{標籤: 值} 轉回目前模板的 {座標: 輸入值}；模板已沒有的標籤略過"""
+    user_inputs = {item["coordinate"]: "" for item in schema.scanned_items}
+    for label, value in fields.items():
+        coord = schema.label_to_coord.get(label)
+        if coord and coord not in schema.image_coord_set:
+            user_inputs[coord] = value
+    return user_inputs
@@ -0,0 +1,276 @@
+import hashlib
+import io
+import os
+
+import metrics
+from tiered_cache import TieredCache
+from xlsx_export import ZipStreamWriter
+from cell_format import format_cells
+from derived_fields import derived_plan
+
+# --- 物調表共用邏輯 (Streamlit 介面與批次匯出共用，不依賴 streamlit) ---
+
+MAP_CROP_RATIO = (27, 16)
+# 冒泡位置圖輸出像素 = 儲存格像素 × 倍率 (高解析度螢幕/列印用)，不會放大原圖
+MAP_IMAGE_SCALE = float(os.environ.get("SURVEY_MAP_IMAGE_SCALE") or 2)
+MAP_JPEG_QUALITY = 85
+# 顏色數不超過此值 (截圖、示意圖) 改用 PNG，避免 JPEG 在文字與線條邊緣產生雜訊
+MAP_PNG_MAX_COLORS = 256
+
+# --- 輔助函式 ---
+def full_to_half(s):
+    if not s: return ""
+    return s.translate(str.maketrans('０１２３４５６７８９', '0123456789'))
+
+def chinese_to_arabic(cn_str):
+    if not cn_str: return ""
+    cn_map = {'一': 1, '二': 2, '三': 3, '四': 4, '五': 5, '六': 6, '七': 7, '八': 8, '九': 9, '十': 10, '0':0, '1':1, '2':2, '3':3, '4':4, '5':5, '6':6, '7':7, '8':8, '9':9}
+    clean_str = cn_str.replace('層', '').replace('樓', '').strip()
+    if clean_str.isdigit(): return str(int(clean_str))
+    try:
+        val = 0
+        if len(clean_str) == 1: val = cn_map.get(clean_str, 0)
+        elif len(clean_str) == 2:
+            if clean_str[0] == '十': val = 10 + cn_map.get(clean_str[1], 0)
+            elif clean_str[1] == '十': val = cn_map.get(clean_str[0], 0) * 10
+        elif len(clean_str) == 3:
+             val = cn_map.get(clean_str[0], 0) * 10 + cn_map.get(clean_str[2], 0)
+        return str(val) if val > 0 else cn_str
+    except: return cn_str
+
+def crop_image_to_ratio(image, target_ratio_w=27, target_ratio_h=16):
+    """將圖片置中剪裁為指定長寬比"""
+    original_w, original_h = image.size
+    target_aspect = target_ratio_w / target_ratio_h
+    current_aspect = original_w / original_h
+
+    if current_aspect > target_aspect:
+        new_w = int(original_h * target_aspect)
+        offset = (original_w - new_w) // 2
+        box = (offset, 0, offset + new_w, original_h)
+    else:
+        new_h = int(original_w / target_aspect)
+        offset = (original_h - new_h) // 2
+        box = (0, offset, original_w, offset + new_h)
+    
+    return image.crop(box)
+
+
+# --- 匯出流程 ---
+def apply_derived_fields(schema, user_inputs, memo=None):
+    """欄位輸入 0 時自動計算不含車位坪數、房屋單價、公設比 (直接修改 user_inputs)"""
+    return derived_plan(schema).apply(user_inputs, memo)
+
+def format_cell_values(schema, user_inputs):
+    """將輸入值轉為寫入儲存格的文字 (日期、格局、萬/元)，圖片欄位不在其中"""
+    return format_cells(schema.cell_formatters, schema.image_coord_set, user_inputs)
+
+def encode_map_image(image_file, target_size=None):
+    """
+    冒泡位置圖：依 EXIF 轉正、置中剪裁並縮到 target_size (像素) 以內，回傳 (bytes, 格式)。
+    照片輸出 JPEG；有透明度或顏色數少的圖輸出最佳化 PNG。
+    """
+    from PIL import Image, ImageOps  # 只有上傳冒泡位置圖時才需要
+
+    pil_img = Image.open(image_file)
+    if target_size and pil_img.format == "JPEG":
+        # JPEG 直接以 1/2、1/4、1/8 解碼，不必先展開整張原圖；方向未定，兩邊都取較大者
+        side = int(max(target_size)) + 1
+        pil_img.draft("RGB", (side, side))
+    pil_img = ImageOps.exif_transpose(pil_img)
+    cropped_img = crop_image_to_ratio(pil_img, *MAP_CROP_RATIO)
+
+    if target_size:
+        w, h = cropped_img.size
+        scale = min(target_size[0] / w, target_size[1] / h)
+        if scale < 1:
+            new_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+            cropped_img = cropped_img.resize(new_size, Image.LANCZOS, reducing_gap=3.0)
+
+    img_byte_arr = io.BytesIO()
+    has_alpha = cropped_img.mode in ("RGBA", "LA", "PA") or "transparency" in cropped_img.info
+    if has_alpha or cropped_img.getcolors(MAP_PNG_MAX_COLORS) is not None:
+        cropped_img.save(img_byte_arr, format='PNG', optimize=True)
+        return img_byte_arr.getvalue(), "png"
+    if cropped_img.mode != "RGB":
+        cropped_img = cropped_img.convert("RGB")
+    cropped_img.save(img_byte_arr, format='JPEG', quality=MAP_JPEG_QUALITY, optimize=True)
+    return img_byte_arr.getvalue(), "jpeg"
+
+def map_image_slot(schema):
+    """冒泡位置圖的 (座標, 輸出像素上限)；模板沒有此欄位時回傳 None"""
+    for item in schema.scanned_items:
+        if "冒泡" in item["label"]:
+            coord = item["coordinate"]
+            calc_w, calc_h = schema.image_cell_pixels[coord]
+            return coord, (calc_w * MAP_IMAGE_SCALE, calc_h * MAP_IMAGE_SCALE)
+    return None
+
+# --- 冒泡位置圖快取 (同一張截圖常用於同棟多戶，批次重新產生時尤其常見) ---
+class MapImageCache(TieredCache):
+    """
+    encode_map_image 結果的快取：鍵為 (原圖 SHA-256, 剪裁比例, 輸出像素上限)，值為 (bytes, 格式)。
+    記憶體依位元組數 LRU；設定 disk_dir 時另存一份 (多個程序/重啟後共用)。
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, disk_dir=None):
+        super().__init__(max_bytes, disk_dir)
+
+    @staticmethod
+    def key(digest, target_size):
+        w, h = target_size
+        return f"{digest}-{MAP_CROP_RATIO[0]}x{MAP_CROP_RATIO[1]}-{int(w)}x{int(h)}-q{MAP_JPEG_QUALITY}"
+
+    def _size(self, value):
+        return len(value[0])
+
+    def _dump(self, value):
+        return value[1].encode("ascii") + b"\n" + value[0]
+
+    def _load(self, raw):
+        fmt, _, data = raw.partition(b"\n")
+        return data, fmt.decode("ascii")
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(bytes=self.size, max_bytes=self.max_size)
+        return stats
+
+
+map_image_cache = MapImageCache(
+    max_bytes=int(float(os.environ.get("SURVEY_MAP_CACHE_MB") or 64) * 1024 * 1024),
+    disk_dir=os.environ.get("SURVEY_MAP_CACHE_DIR") or None,
+)
+
+
+def _read_image(image_file):
+    """路徑、BytesIO 或 Streamlit 上傳檔 → bytes"""
+    if isinstance(image_file, (str, os.PathLike)):
+        with open(image_file, "rb") as f:
+            return f.read()
+    if hasattr(image_file, "getvalue"):
+        return image_file.getvalue()
+    return image_file.read()
+
+def encode_map_image_cached(image_file, target_size, digest=None):
+    """
+    encode_map_image 加上快取；內容相同的圖片 (不論檔名) 同一輸出尺寸只處理一次。
+    digest 為原圖 SHA-256 (上傳時已算過就傳入，不再重算)。
+    """
+    data = _read_image(image_file)
+    key = MapImageCache.key(digest or hashlib.sha256(data).hexdigest(), target_size)
+    value = map_image_cache.get(key)
+    if value is None:
+        value = encode_map_image(io.BytesIO(data), target_size)
+        map_image_cache.put(key, value)
+    return value
+
+def build_map_images(schema, image_file, cell_values, encoded=None, digest=None):
+    """
+    產生要嵌入冒泡位置圖儲存格的圖片清單，並清空該儲存格的提示文字。
+    encoded 為事先以 encode_map_image 處理好的 (bytes, 格式) 時直接使用；digest 見 encode_map_image_cached。
+    """
+    slot = map_image_slot(schema)
+    if slot is None:
+        return []
+
+    target_map_coord, target_size = slot
+    cell_values[target_map_coord] = ""
+    calc_w, calc_h = schema.image_cell_pixels[target_map_coord]
+    data, fmt = encoded or encode_map_image_cached(image_file, target_size, digest)
+    return [{
+        "coord": target_map_coord,
+        "data": data,
+        "format": fmt,
+        "width": calc_w,
+        "height": calc_h
+    }]
+
+def prepare_case(schema, user_inputs, image_file=None, derived_memo=None, derive=True, encoded_image=None,
+                 image_digest=None):
+    """自動計算 → 格式化 → 冒泡位置圖，回傳 (cell_values, map_images, 警告清單)"""
+    with metrics.span("derived_fields"):
+        if derive:
+            apply_derived_fields(schema, user_inputs, derived_memo)
+        cell_values = format_cell_values(schema, user_inputs)
+
+    warnings = []
+    map_images = []
+    if image_file or encoded_image:
+        try:
+            with metrics.span("map_image"):
+                map_images = build_map_images(schema, image_file, cell_values, encoded_image, image_digest)
+        except Exception as e:
+            warnings.append(f"圖片處理異常: {e}")
+    return cell_values, map_images, warnings
+
+def export_workbook(schema, user_inputs, image_file=None, derived_memo=None, derive=True, encoded_image=None,
+                    render_memo=None, image_digest=None):
+    """
+    完整匯出流程：自動計算 → 格式化 → 冒泡位置圖 → xlsx，回傳 (檔名, bytes, 警告清單)。
+    derive=False 表示自動計算已事先完成 (例如批次模式一次算完)；encoded_image 見 build_map_images，
+    image_digest 為原圖 SHA-256 (已知時傳入)；
+    render_memo 為同一 session 保存的 dict 時，再次匯出只改寫變動的儲存格與圖片 (見 TemplatePackage.render)。
+    """
+    cell_values, map_images, warnings = prepare_case(schema, user_inputs, image_file, derived_memo, derive,
+                                                     encoded_image, image_digest)
+    filename = build_output_filename(schema, user_inputs)
+    with metrics.span("render"):
+        data = schema.package.render(cell_values, map_images, render_memo)
+    return filename, data, warnings
+
+# --- 多案件匯出 (逐案產生並寫出，記憶體不隨案件數增加) ---
+def unique_filename(filename, used):
+    stem, ext = os.path.splitext(filename)
+    candidate = filename
+    n = 2
+    while candidate in used:
+        candidate = f"{stem}({n}){ext}"
+        n += 1
+    used.add(candidate)
+    return candidate
+
+def write_bulk_zip(schema, cases, fileobj):
+    """
+    cases: 可迭代的 (user_inputs, image_file)，每案一個 xlsx 寫入 zip (fileobj 不需可 seek)。
+    回傳 [(檔名, 警告清單)]
+    """
+    writer = ZipStreamWriter(fileobj)
+    used = set()
+    report = []
+    for user_inputs, image_file in cases:
+        filename, data, warnings = export_workbook(schema, user_inputs, image_file)
+        filename = unique_filename(filename, used)
+        writer.add(filename, data, compress=False)  # xlsx 本身已壓縮
+        report.append((filename, warnings))
+    writer.close()
+    return report
+
+def write_bulk_workbook(schema, cases, fileobj):
+    """cases 同 write_bulk_zip，寫成一個活頁簿、每案一個物調表工作表；回傳 [(案件名稱, 警告清單)]"""
+    report = []
+
+    def sheets():
+        for user_inputs, image_file in cases:
+            cell_values, map_images, warnings = prepare_case(schema, user_inputs, image_file)
+            title = os.path.splitext(build_output_filename(schema, user_inputs))[0]
+            report.append((title, warnings))
+            yield title, cell_values, map_images
+
+    schema.package.write_sheets(fileobj, sheets())
+    return report
+
+def build_output_filename(schema, user_inputs):
+    """輸出檔名：委託契約書編號 + 案名"""
+    id_coord = None
+    name_coord = None
+    for item in schema.scanned_items:
+        if "委託" in item["label"] and "編號" in item["label"]:
+            id_coord = item["coordinate"]
+        if "案名" in item["label"]:
+            name_coord = item["coordinate"]
+    
+    file_id = user_inputs.get(id_coord, "無編號") if id_coord else "無編號"
+    file_name = user_inputs.get(name_coord, "無案名") if name_coord else "無案名"
+    safe_filename = f"{file_id}{file_name}.xlsx"
+    return "".join([c for c in safe_filename if c.isalpha() or c.isdigit() or c in " ._-()[\u4e00-\u9fa5]"])
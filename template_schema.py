@@ -0,0 +1,254 @@
+import hashlib
+import io
+import os
+import re
+import threading
+
+import metrics
+from cell_format import compile_cell_formatters
+from xlsx_export import TemplatePackage, coordinate_to_index
+
+# --- 模板編譯 ---
+# 模板內容不變時，掃描結果全程序共用；每次 Streamlit rerun 只需比對檔案狀態。
+# openpyxl 只在編譯時使用 (第一次載入模板時才 import)，匯出走 xlsx_export 不需要它。
+
+TARGET_SHEET_KEYWORD = "物調表"
+PLACEHOLDER_MARK = '"""'
+SELECT_PLACEHOLDER = "請選擇..."
+
+_STAR_LABEL_RE = re.compile(r'\*(.*?)\*(.*)')
+
+
+class TemplateSchema:
+    """模板編譯結果 (唯讀，跨 session 共用)"""
+
+    def __init__(self, content_hash, template_bytes, sheet_title, scanned_items, image_cell_pixels, geometry):
+        self.content_hash = content_hash
+        self.template_bytes = template_bytes
+        self.sheet_title = sheet_title
+        self.scanned_items = tuple(scanned_items)
+        self.label_to_coord = {item["label"]: item["coordinate"] for item in self.scanned_items}
+        self.coord_to_header = {item["coordinate"]: item["label"] for item in self.scanned_items}
+        self.image_coords = tuple(item["coordinate"] for item in self.scanned_items if item["type"] == "image_upload")
+        self.image_coord_set = frozenset(self.image_coords)
+        self.cell_formatters = compile_cell_formatters(self.coord_to_header, self.image_coord_set)
+        self.image_cell_pixels = image_cell_pixels
+        self.geometry = geometry
+        self.package = TemplatePackage(template_bytes, sheet_title)
+        self._form_layouts = {}  # (主要欄位順序, 其他欄位順序) -> 版面
+
+    def form_layout(self, main_order, other_order):
+        """
+        依指定順序排列模板欄位，回傳 (主要欄位, 其他欄位, 其餘欄位)。
+        結果存在 schema 上 (模板內容不變就不重算)；app.py 每次整頁重跑都是新的 __main__，快取不能放在那裡。
+        """
+        key = (tuple(main_order), tuple(other_order))
+        layout = self._form_layouts.get(key)
+        if layout is not None:
+            return layout
+
+        scanned_dict = {item["label"]: item for item in self.scanned_items}
+        main_fields = []
+        for label in main_order:
+            found_key = label if label in scanned_dict else None
+            if not found_key:
+                for k in scanned_dict.keys():
+                    if label in k or k in label:
+                        found_key = k
+                        break
+            if found_key:
+                main_fields.append((label, found_key, scanned_dict.pop(found_key)))
+
+        other_fields = [(label, scanned_dict.pop(label)) for label in other_order if label in scanned_dict]
+        rest_fields = list(scanned_dict.items())
+
+        layout = (tuple(main_fields), tuple(other_fields), tuple(rest_fields))
+        self._form_layouts[key] = layout
+        return layout
+
+    def resolve_label(self, name):
+        """欄位名稱對應座標：先完全比對標籤，再以互相包含比對，找不到回傳 None"""
+        if name in self.label_to_coord:
+            return self.label_to_coord[name]
+        for lbl, coord in self.label_to_coord.items():
+            if name in lbl or lbl in name:
+                return coord
+        return None
+
+
+def find_target_sheet(wb):
+    for sheetname in wb.sheetnames:
+        if TARGET_SHEET_KEYWORD in sheetname:
+            return wb[sheetname]
+    return wb.active
+
+
+# Excel 欄寬 (字元) / 列高 (點) 換算像素，未設定時的預設值
+COLUMN_WIDTH_PX = 7.7
+ROW_HEIGHT_PX = 1.34
+DEFAULT_COLUMN_WIDTH = 9
+DEFAULT_ROW_HEIGHT = 15
+
+
+class SheetGeometry:
+    """
+    工作表的儲存格幾何索引：座標 → 合併範圍，以及欄寬、列高的前綴和 (像素)。
+    編譯模板時建立一次，之後任何儲存格或範圍的尺寸查詢都是 O(1)。
+    """
+
+    def __init__(self, ws):
+        from openpyxl.utils import get_column_letter
+
+        self.merged = {}  # (col, row) -> (min_col, min_row, max_col, max_row)
+        max_col, max_row = ws.max_column, ws.max_row
+        for merged_range in ws.merged_cells.ranges:
+            bounds = (merged_range.min_col, merged_range.min_row, merged_range.max_col, merged_range.max_row)
+            for col in range(bounds[0], bounds[2] + 1):
+                for row in range(bounds[1], bounds[3] + 1):
+                    self.merged.setdefault((col, row), bounds)
+            max_col = max(max_col, bounds[2])
+            max_row = max(max_row, bounds[3])
+        for dim in ws.column_dimensions.values():
+            max_col = max(max_col, dim.max or 0)
+        for row_idx in ws.row_dimensions:
+            max_row = max(max_row, row_idx)
+
+        col_widths = []
+        for col_idx in range(1, max_col + 2):
+            cw = ws.column_dimensions[get_column_letter(col_idx)].width
+            if cw is None: cw = DEFAULT_COLUMN_WIDTH
+            col_widths.append(cw * COLUMN_WIDTH_PX)
+        # 最後一欄之後皆未設定，與 openpyxl 對未設定欄位回傳的寬度相同
+        self.default_col_px = col_widths.pop()
+        self.col_prefix = [0.0]
+        for width in col_widths:
+            self.col_prefix.append(self.col_prefix[-1] + width)
+
+        self.row_prefix = [0.0]
+        for row_idx in range(1, max_row + 1):
+            rh = ws.row_dimensions[row_idx].height
+            if rh is None: rh = DEFAULT_ROW_HEIGHT
+            self.row_prefix.append(self.row_prefix[-1] + rh * ROW_HEIGHT_PX)
+
+    @staticmethod
+    def _offset(prefix, idx, default_px):
+        # 超出已設定範圍的欄列以預設尺寸計
+        last = len(prefix) - 1
+        if idx <= last:
+            return prefix[idx]
+        return prefix[last] + (idx - last) * default_px
+
+    def cell_range(self, coord):
+        """儲存格所屬的範圍 (min_col, min_row, max_col, max_row)，未合併時為單格"""
+        col, row = coordinate_to_index(coord)
+        col, row = col + 1, row + 1
+        return self.merged.get((col, row), (col, row, col, row))
+
+    def range_pixels(self, min_col, min_row, max_col, max_row):
+        width = (self._offset(self.col_prefix, max_col, self.default_col_px)
+                 - self._offset(self.col_prefix, min_col - 1, self.default_col_px))
+        height = (self._offset(self.row_prefix, max_row, DEFAULT_ROW_HEIGHT * ROW_HEIGHT_PX)
+                  - self._offset(self.row_prefix, min_row - 1, DEFAULT_ROW_HEIGHT * ROW_HEIGHT_PX))
+        return width, height
+
+    def cell_pixels(self, coord):
+        """計算 Excel 儲存格 (含合併) 的像素大小"""
+        return self.range_pixels(*self.cell_range(coord))
+
+
+def scan_template_cell(coordinate, raw_txt):
+    """將模板中 \"\"\" 標記的儲存格解析為欄位定義"""
+    match_star = _STAR_LABEL_RE.search(raw_txt)
+    if match_star:
+        label_name = match_star.group(1).strip()
+        content_part = match_star.group(2).replace(PLACEHOLDER_MARK, '')
+    else:
+        label_name = raw_txt.replace(PLACEHOLDER_MARK, '').strip()
+        content_part = label_name
+
+    options = []
+    input_type = "text"
+
+    if "□" in content_part:
+        input_type = "select"
+        segments = content_part.split('□')
+        options = [s.strip() for s in segments if s.strip()]
+        options.insert(0, SELECT_PLACEHOLDER)
+
+    if "特色" in label_name or "說明" in label_name:
+        input_type = "textarea"
+    elif "冒泡" in label_name:
+        input_type = "image_upload"
+
+    return {
+        "label": label_name,
+        "coordinate": coordinate,
+        "type": input_type,
+        "options": options
+    }
+
+
+def compile_template(template_bytes, content_hash=None):
+    """讀取模板並掃描所有欄位，回傳 TemplateSchema"""
+    from openpyxl import load_workbook
+
+    if content_hash is None:
+        content_hash = hashlib.sha256(template_bytes).hexdigest()
+    wb = load_workbook(io.BytesIO(template_bytes))
+    ws = find_target_sheet(wb)
+
+    scanned_items = []
+    for row in ws.iter_rows():
+        for cell in row:
+            if cell.value and isinstance(cell.value, str) and PLACEHOLDER_MARK in cell.value:
+                scanned_items.append(scan_template_cell(cell.coordinate, cell.value))
+
+    # 冒泡位置圖等圖片欄位的尺寸在編譯時先算好，匯出時不需再開啟模板
+    geometry = SheetGeometry(ws)
+    image_cell_pixels = {item["coordinate"]: geometry.cell_pixels(item["coordinate"])
+                         for item in scanned_items if item["type"] == "image_upload"}
+
+    return TemplateSchema(content_hash, template_bytes, ws.title, scanned_items, image_cell_pixels, geometry)
+
+
+# --- 程序層級快取 ---
+_schema_lock = threading.Lock()
+_schemas_by_hash = {}
+_file_signatures = {}  # abspath -> ((mtime_ns, size), content_hash)
+
+
+def get_template_schema(path):
+    """取得模板編譯結果；檔案內容變更時自動重新編譯"""
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _schema_lock:
+        known = _file_signatures.get(abs_path)
+        if known and known[0] == signature:
+            return _schemas_by_hash[known[1]]
+
+    with open(abs_path, 'rb') as f:
+        template_bytes = f.read()
+    content_hash = hashlib.sha256(template_bytes).hexdigest()
+
+    with _schema_lock:
+        schema = _schemas_by_hash.get(content_hash)
+    if schema is None:
+        with metrics.span("template_compile"):
+            schema = compile_template(template_bytes, content_hash)
+
+    with _schema_lock:
+        _schemas_by_hash[content_hash] = schema
+        _file_signatures[abs_path] = (signature, content_hash)
+        # 只保留仍被某個模板檔案引用的編譯結果
+        live = {h for _, h in _file_signatures.values()}
+        for stale in [h for h in _schemas_by_hash if h not in live]:
+            del _schemas_by_hash[stale]
+    return schema
+
+
+def clear_template_cache():
+    with _schema_lock:
+        _schemas_by_hash.clear()
+        _file_signatures.clear()
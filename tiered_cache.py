@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+
+# --- 兩層快取 (記憶體 LRU + 可選磁碟層) ---
+# 謄本解析結果 (transcript.TranscriptCache) 與冒泡位置圖 (survey_core.MapImageCache) 共用此實作，
+# 子類別只決定大小政策 (筆數或位元組數、TTL) 與磁碟上的格式。
+
+
+class TieredCache:
+    """
+    記憶體 LRU：各項 _size() 合計超過 max_size 時淘汰最久未用的；單項超過 max_size 不放入記憶體。
+    設定 disk_dir 時另寫一份到磁碟 (多個程序/重啟後共用)，記憶體沒有時從磁碟讀回。
+    """
+
+    def __init__(self, max_size, disk_dir=None):
+        self.max_size = max_size
+        self.disk_dir = disk_dir
+        self.size = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> value
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # --- 子類別覆寫 ---
+    def _size(self, value):
+        return 1
+
+    def _fresh(self, value):
+        """False 時視為過期 (TTL)"""
+        return True
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key)
+
+    def _dump(self, value):
+        """值 → 磁碟檔內容 (bytes)"""
+        raise NotImplementedError
+
+    def _load(self, raw):
+        """磁碟檔內容 → 值；格式不符時拋出 ValueError / KeyError"""
+        raise NotImplementedError
+
+    # --- 共用 ---
+    def _store(self, key, value):
+        if key in self._entries:
+            self.size -= self._size(self._entries.pop(key))
+        size = self._size(value)
+        if size > self.max_size:
+            return
+        self._entries[key] = value
+        self.size += size
+        while self.size > self.max_size:
+            self.size -= self._size(self._entries.popitem(last=False)[1])
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                if self._fresh(value):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self.size -= self._size(self._entries.pop(key))
+
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    value = self._load(f.read())
+                if self._fresh(value):
+                    with self._lock:
+                        self.disk_hits += 1
+                        self._store(key, value)
+                    return value
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._store(key, value)
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    f.write(self._dump(value))
+                os.replace(tmp_path, path)  # 其他程序只會讀到完整的檔案
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
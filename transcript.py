@@ -0,0 +1,555 @@
+import hashlib
+import io
+import json
+import os
+import re
+import time
+from contextlib import contextmanager
+
+import metrics
+from gazetteer import find_area
+from survey_core import full_to_half, chinese_to_arabic
+from tiered_cache import TieredCache
+
+# 解析邏輯變更時調整，避免磁碟快取回傳舊版結果
+PARSER_VERSION = 7
+
+
+# --- 謄本解析 ---
+# 單次走訪行串流：各欄位的 regex 預先編譯，只在該行含有標籤時才比對；
+# 標籤與數值之間的空白可跨行 (與舊版在全文上 re.search/findall 的結果一致)。
+
+SQM_TO_PING = 0.3025
+ADDRESS_LOOKAHEAD_LINES = 4
+DESCRIPTION_MARK = "建物標示部"
+OWNERSHIP_MARK = "建物所有權部"
+
+_ADDRESS_PREFIX_RE = re.compile(r'(.+?[市縣].+?[區鄉鎮市])')  # 地名表查不到時使用
+
+
+def _address_prefix(line):
+    """行中的「縣市+鄉鎮市區」：以地名表比對 (舊名換成目前名稱)，查不到時沿用 regex；沒有時回傳空字串"""
+    if "市" not in line and "縣" not in line:
+        return ""
+    found = find_area(line.replace(" ", "").replace("\u3000", "") if " " in line or "\u3000" in line else line)
+    if found:
+        return found[2]
+    match = _ADDRESS_PREFIX_RE.search(line)
+    return match.group(1) if match else ""
+
+
+class _FieldPattern:
+    """單一欄位的串流比對器；partial 描述「還可能在下一行完成」的尾端"""
+    __slots__ = ("label", "regex", "partial", "first_only", "matches", "done", "carry")
+
+    def __init__(self, label, regex, partial, first_only):
+        self.label = label
+        self.regex = regex
+        self.partial = partial
+        self.first_only = first_only
+        self.matches = []
+        self.done = False
+        self.carry = ""
+
+    def feed(self, chunk):
+        if self.done or (not self.carry and self.label not in chunk):
+            return
+        text = self.carry + chunk if self.carry else chunk
+        pos = 0
+        if self.first_only:
+            m = self.regex.search(text)
+            if m:
+                self.matches.append(m)
+                self.done = True
+                self.carry = ""
+                return
+        else:
+            for m in self.regex.finditer(text):
+                self.matches.append(m)
+                pos = m.end()
+        # 未完成的尾端只可能從最後一個標籤開始 (rfind 由尾端找，不必整段跑 regex)
+        last = text.rfind(self.label, pos)
+        tail = self.partial.search(text, last) if last != -1 else None
+        self.carry = text[tail.start():] if tail else ""
+
+
+# (標籤, 欄位 regex, 未完成尾端 regex, 只取第一筆)
+_DATE_SPEC = ("建築完成日期", re.compile(r'建築完成日期\s*([民國\d]+年\d+月\d+日)'), re.compile(r'建築完成日期\s*$'), True)
+_MAIN_AREA_SPEC = ("層次面積", re.compile(r'層次面積\s*([\d\.]+)\s*平方公尺'), re.compile(r'層次面積\s*(?:[\d\.]+\s*)?$'), False)
+_ANNEX_AREA_SPEC = ("面積", re.compile(r'面積\s*([\d\.]+)\s*平方公尺'), re.compile(r'面積\s*(?:[\d\.]+\s*)?$'), False)
+_FLOORS_SPEC = ("層數", re.compile(r'層數\s*(\d+)層'), re.compile(r'層數\s*$'), True)
+_LAYER_SPEC = ("層次", re.compile(r'層次\s*([^\d\s]+)層'), re.compile(r'層次\s*$'), True)
+
+
+def _sum_ping(matches):
+    total_m2 = 0
+    for m in matches:
+        try:
+            total_m2 += float(m.group(1))
+        except ValueError:
+            pass
+    return str(round(total_m2 * SQM_TO_PING, 3))
+
+
+_ADDRESS_MARK_RE = re.compile("建物標示部|建物門牌")
+
+
+def _head_end(text):
+    """
+    仍在標示部之前 (head) 時，頁面中離開 head 之後的位置 (之後出現所有權部即表示標示部結束)；不會離開時回傳 -1。
+    與逐行處理相同：最早出現「建物標示部」的那一行本身不算，附屬建物用途 / 共有部分所在的行則算。
+    """
+    hits = [i for i in (text.find(DESCRIPTION_MARK), text.find("附屬建物用途"), text.find("共有部分")) if i != -1]
+    if not hits:
+        return -1
+    first = min(hits)
+    line_start = text.rfind("\n", 0, first) + 1
+    line_end = text.find("\n", first)
+    line = text[line_start:] if line_end == -1 else text[line_start:line_end]
+    if "附屬建物用途" in line or "共有部分" in line:
+        return line_start
+    return len(text) if line_end == -1 else line_end
+
+
+# 區段狀態：建物標示部 → 主建物/層次面積 → 附屬建物用途 → 共有部分
+SECTION_HEAD = "head"
+SECTION_MAIN = "main"
+SECTION_ANNEX = "annex"
+SECTION_SHARED = "shared"
+
+
+class TranscriptParser:
+    """逐行 (或逐頁) 餵入謄本文字，close() 後以 result() 取得 {欄位名稱: 值}"""
+
+    def __init__(self):
+        self.section = SECTION_HEAD
+        self.date = _FieldPattern(*_DATE_SPEC)
+        self.main_area = _FieldPattern(*_MAIN_AREA_SPEC)
+        self.annex_area = _FieldPattern(*_ANNEX_AREA_SPEC)
+        self.floors = _FieldPattern(*_FLOORS_SPEC)
+        self.layer = _FieldPattern(*_LAYER_SPEC)
+        self.address_prefix = ""
+        self.address_road = ""
+        self._prefix_windows = []  # 建物標示部之後仍在前瞻範圍內的剩餘行數
+        self._road_pending = False
+        self.description_done = False
+
+    @property
+    def complete(self):
+        """建物標示部已結束 (進入所有權部) 且沒有跨行待處理狀態，之後的頁面不影響結果"""
+        return self.description_done and self.section != SECTION_ANNEX and not self._pending()
+
+    def _pending(self):
+        """是否有跨行尚未完成的比對 (下一行不可略過)"""
+        return bool(self._prefix_windows or self._road_pending or self.date.carry or self.main_area.carry
+                    or self.annex_area.carry or self.floors.carry or self.layer.carry)
+
+    def feed_line(self, line):
+        self._process(line, line + "\n")
+
+    def feed_page(self, text):
+        """
+        餵入一整頁文字 (等同逐行 feed_line)。各欄位的 regex 直接對整頁比對 (跨頁由 carry 接續)；
+        逐行處理的只有地址 (含標籤的行與其後的前瞻行)。
+        """
+        chunk = text + "\n"
+        self._track_address_page(text)
+        in_head = self.section == SECTION_HEAD
+        self.date.feed(chunk)
+        self.main_area.feed(chunk)
+        self.floors.feed(chunk)
+        self.layer.feed(chunk)
+        if self.section != SECTION_SHARED:
+            self._track_annex(chunk)
+        if self.section == SECTION_HEAD and DESCRIPTION_MARK in text:
+            self.section = SECTION_MAIN
+        if not self.description_done and OWNERSHIP_MARK in text:
+            ownership_from = _head_end(text) if in_head else 0
+            if ownership_from != -1 and text.find(OWNERSHIP_MARK, ownership_from) != -1:
+                self.description_done = True
+
+    def _track_address_page(self, text):
+        # 沒有待處理的前瞻時直接跳到下一個含「建物標示部」或「建物門牌」的行
+        pos = 0
+        while True:
+            if not (self._prefix_windows or self._road_pending):
+                hit = _ADDRESS_MARK_RE.search(text, pos)
+                if hit is None:
+                    return
+                pos = text.rfind("\n", pos, hit.start()) + 1 or pos
+            end = text.find("\n", pos)
+            if end == -1:
+                self._track_address(text[pos:])
+                return
+            self._track_address(text[pos:end])
+            pos = end + 1
+
+    def close(self):
+        # 舊版全文以換行結尾，split 後最後會多一個空行 (只影響跨行待處理的比對)
+        if self._pending():
+            self._process("", "")
+
+    def _process(self, line, chunk):
+        self._track_address(line)
+        self.date.feed(chunk)
+        self.main_area.feed(chunk)
+        self.floors.feed(chunk)
+        self.layer.feed(chunk)
+        if self.section != SECTION_SHARED:
+            self._track_annex(chunk)
+        if self.section == SECTION_HEAD and "建物標示部" in line:
+            self.section = SECTION_MAIN
+        elif self.section != SECTION_HEAD and OWNERSHIP_MARK in line:
+            self.description_done = True
+
+    def _track_address(self, line):
+        if self._prefix_windows:
+            prefix = _address_prefix(line)
+            if prefix:
+                self.address_prefix = prefix
+                self._prefix_windows = []
+            else:
+                self._prefix_windows = [n - 1 for n in self._prefix_windows if n > 1]
+        if "建物標示部" in line:
+            self._prefix_windows.append(ADDRESS_LOOKAHEAD_LINES)
+
+        if self._road_pending:
+            self.address_road = line.strip()
+            self._road_pending = False
+        if "建物門牌" in line:
+            parts = line.strip().split("建物門牌")
+            if parts[1].strip():
+                self.address_road = parts[1].strip()
+            else:
+                self._road_pending = True
+
+    def _track_annex(self, chunk):
+        # 附屬建物面積只計算第一個「附屬建物用途」到第一個「共有部分」之間
+        end = chunk.find("共有部分")
+        if self.section != SECTION_ANNEX:
+            start = chunk.find("附屬建物用途")
+            if end != -1 and (start == -1 or end < start):
+                self.section = SECTION_SHARED
+                return
+            if start == -1:
+                return
+            self.section = SECTION_ANNEX
+            chunk = chunk[start:]
+            end = chunk.find("共有部分")
+        if end != -1:
+            self.annex_area.feed(chunk[:end])
+            self.annex_area.carry = ""
+            self.section = SECTION_SHARED
+        else:
+            self.annex_area.feed(chunk)
+
+    def result(self):
+        data = {}
+        if self.address_prefix or self.address_road:
+            full_addr = f"{self.address_prefix}{self.address_road}"
+            data["地址"] = full_to_half(full_addr).replace(" ", "")
+
+        if self.date.matches:
+            data["建築完成日"] = self.date.matches[0].group(1)
+        if self.main_area.matches:
+            data["主建物坪數"] = _sum_ping(self.main_area.matches)
+        if self.annex_area.matches:
+            data["附屬建坪數"] = _sum_ping(self.annex_area.matches)
+        if self.floors.matches:
+            data["地上層"] = str(int(self.floors.matches[0].group(1)))
+        if self.layer.matches:
+            layer_match = self.layer.matches[0]
+            if "面積" not in layer_match.group(0):
+                data["位於樓層"] = chinese_to_arabic(layer_match.group(1))
+        return data
+
+
+def parse_transcript_pages(page_texts):
+    """解析逐頁的謄本文字 (讀完全部頁面)"""
+    parser = TranscriptParser()
+    for text in page_texts:
+        parser.feed_page(text or "")
+    parser.close()
+    return parser.result()
+
+
+class TranscriptUnitsParser:
+    """
+    多戶謄本：每個建物標示部各自一筆結果。前一戶的標示部已結束 (進入所有權部) 後
+    再遇到「建物標示部」才視為下一戶，續頁重複的標題不會切出新的一戶。
+    """
+    complete = False  # 不知道後面還有沒有下一戶，必須讀完
+
+    def __init__(self):
+        self.parsers = [TranscriptParser()]
+
+    def feed_page(self, text):
+        seg_start = 0
+        pos = text.find(DESCRIPTION_MARK)
+        while pos != -1:
+            line_start = text.rfind("\n", seg_start, pos) + 1 or seg_start
+            if line_start > seg_start:
+                self.parsers[-1].feed_page(text[seg_start:line_start - 1])
+                seg_start = line_start
+            if self.parsers[-1].description_done:
+                self.parsers[-1].close()
+                self.parsers.append(TranscriptParser())
+            pos = text.find(DESCRIPTION_MARK, pos + len(DESCRIPTION_MARK))
+        self.parsers[-1].feed_page(text[seg_start:])
+
+    def close(self):
+        self.parsers[-1].close()
+
+    def result(self):
+        """[{欄位名稱: 值}, ...]，依謄本順序；沒有任何欄位的段落略過"""
+        return [data for data in (p.result() for p in self.parsers) if data]
+
+
+class FirstUnitParser(TranscriptUnitsParser):
+    """
+    只要第一戶：照多戶謄本切段，第一戶已完整或已出現下一戶的建物標示部 (可能在同一頁) 即停止。
+    同頁後面幾戶的面積、門牌不會併入第一戶。
+    """
+
+    @property
+    def complete(self):
+        return len(self.parsers) > 1 or self.parsers[0].complete
+
+    @property
+    def more_units(self):
+        """已確定還有下一戶"""
+        return len(self.parsers) > 1
+
+    def result(self):
+        """第一戶 (與 TranscriptUnitsParser.result() 的第一筆相同)，沒有任何欄位時為 {}"""
+        return next((data for data in (p.result() for p in self.parsers) if data), {})
+
+
+def parse_transcript_unit_pages(page_texts):
+    """解析逐頁的謄本文字，每戶一筆"""
+    parser = TranscriptUnitsParser()
+    for text in page_texts:
+        parser.feed_page(text or "")
+    parser.close()
+    return parser.result()
+
+
+# --- PDF 串流擷取 ---
+# 逐頁擷取文字並立即餵給解析器，擷取完即釋放該頁快取，記憶體只與單頁大小有關。
+# 建物標示部結束後即停止；超過頁數或時間上限時回傳已解析的部分並附上警告。
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+MAX_PAGES = _env_int("SURVEY_TRANSCRIPT_MAX_PAGES", 60)
+TIME_BUDGET_SECONDS = _env_int("SURVEY_TRANSCRIPT_TIME_BUDGET", 15)
+
+
+# --- PDF 文字擷取後端 ---
+# 後端為 context manager：with backend(pdf_file) as (總頁數, 逐頁文字)，文字以 \n 分行交給解析器。
+# pdfplumber (預設) 做完整版面分析；pdfium 直接讀 PDF 文字層，快數十倍。
+# 切換前先以 python -m benchmarks.bench_pdf_backends 在實際謄本上確認各欄位結果一致。
+# 檔案不是 PDF 或已損毀時，各後端把自己的例外換成 PDFReadError (解析器本身的錯誤不在此列)。
+
+class PDFReadError(ValueError):
+    """PDF 無法開啟或擷取文字 (不是 PDF 或檔案損毀)"""
+
+
+def _pdfplumber_errors():
+    from pdfminer.psparser import PSException
+    from pdfplumber.utils.exceptions import MalformedPDFException, PdfminerException
+
+    return PSException, MalformedPDFException, PdfminerException
+
+
+def iter_pdf_page_texts(pdf, errors=()):
+    for page in pdf.pages:
+        try:
+            try:
+                text = page.extract_text()
+            except errors as e:
+                raise PDFReadError(f"PDF 文字擷取失敗: {e}") from e
+            yield text
+        finally:
+            page.close()
+
+
+@contextmanager
+def _pdfplumber_backend(pdf_file):
+    import pdfplumber  # 大多數 session 不會上傳謄本，第一次解析時才載入
+
+    errors = _pdfplumber_errors()
+    try:
+        pdf = pdfplumber.open(pdf_file)
+    except errors as e:
+        raise PDFReadError(f"無法開啟 PDF: {e}") from e
+    with pdf:
+        try:
+            total = len(pdf.pages)
+        except errors as e:
+            raise PDFReadError(f"無法開啟 PDF: {e}") from e
+        yield total, iter_pdf_page_texts(pdf, errors)
+
+
+def _iter_pdfium_page_texts(pdf):
+    import pypdfium2
+
+    for index in range(len(pdf)):
+        try:
+            page = pdf[index]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range().replace("\r\n", "\n")
+        except pypdfium2.PdfiumError as e:
+            raise PDFReadError(f"PDF 文字擷取失敗: {e}") from e
+        try:
+            yield text
+        finally:
+            textpage.close()
+            page.close()
+
+
+@contextmanager
+def _pdfium_backend(pdf_file):
+    import pypdfium2
+
+    try:
+        pdf = pypdfium2.PdfDocument(pdf_file)
+    except pypdfium2.PdfiumError as e:
+        raise PDFReadError(f"無法開啟 PDF: {e}") from e
+    try:
+        yield len(pdf), _iter_pdfium_page_texts(pdf)
+    finally:
+        pdf.close()
+
+
+PDF_BACKENDS = {"pdfplumber": _pdfplumber_backend, "pdfium": _pdfium_backend}
+PDF_BACKEND = os.environ.get("SURVEY_PDF_BACKEND") or "pdfplumber"
+
+
+def get_pdf_backend(name=None):
+    name = name or PDF_BACKEND
+    if name not in PDF_BACKENDS:
+        raise ValueError(f"未知的 PDF 擷取後端: {name} (可用: {', '.join(PDF_BACKENDS)})")
+    return PDF_BACKENDS[name]
+
+
+def _feed_pdf(parser, pdf_file, max_pages, time_budget, backend=None):
+    max_pages = MAX_PAGES if max_pages is None else max_pages
+    time_budget = TIME_BUDGET_SECONDS if time_budget is None else time_budget
+    warnings = []
+    deadline = time.monotonic() + time_budget if time_budget else None
+    more_pages = False
+
+    with get_pdf_backend(backend)(pdf_file) as (total, page_texts):
+        try:
+            for page_no, text in enumerate(page_texts, 1):
+                parser.feed_page(text or "")
+                if parser.complete:
+                    more_pages = page_no < total
+                    break
+                if page_no == total:
+                    break
+                if max_pages and page_no >= max_pages:
+                    warnings.append(f"謄本共 {total} 頁，僅解析前 {page_no} 頁，資料可能不完整")
+                    break
+                if deadline and time.monotonic() > deadline:
+                    warnings.append(f"謄本解析超過 {time_budget} 秒，已停在第 {page_no}/{total} 頁，資料可能不完整")
+                    break
+        finally:
+            page_texts.close()  # 提前結束時先釋放目前頁面，再關閉文件
+    parser.close()
+    return parser.result(), warnings, more_pages
+
+
+def parse_transcript_pdf(pdf_file, max_pages=None, time_budget=None, backend=None):
+    """
+    解析建物謄本 PDF 的第一戶，回傳 ({欄位名稱: 值}, 警告清單)；讀檔失敗時拋出例外。
+    有警告時結果可能不完整。backend 為 PDF_BACKENDS 的名稱，預設 SURVEY_PDF_BACKEND 或 pdfplumber。
+    """
+    data, warnings, _ = _parse_first_unit(pdf_file, max_pages, time_budget, backend)
+    return data, warnings
+
+
+def _parse_first_unit(pdf_file, max_pages=None, time_budget=None, backend=None):
+    """(第一戶資料, 警告清單, 是否可能還有其他戶)：第一戶後面還有頁面或已看到下一戶時為 True"""
+    parser = FirstUnitParser()
+    data, warnings, more_pages = _feed_pdf(parser, pdf_file, max_pages, time_budget, backend)
+    return data, warnings, more_pages or parser.more_units
+
+
+def parse_transcript_units(pdf_file, max_pages=None, time_budget=None, backend=None):
+    """解析建物謄本 PDF 的所有建物標示部，回傳 ([{欄位名稱: 值}, ...], 警告清單)"""
+    units, warnings, _ = _feed_pdf(TranscriptUnitsParser(), pdf_file, max_pages, time_budget, backend)
+    return units, warnings
+
+
+# --- 謄本解析快取 ---
+def _copy_record(record):
+    return {"units": [dict(unit) for unit in record["units"]], "more": record["more"]}
+
+
+class TranscriptCache(TieredCache):
+    """以 PDF 內容 SHA-256 為鍵的解析結果快取：記憶體依筆數 LRU + TTL，可選磁碟層"""
+
+    def __init__(self, max_entries=256, ttl_seconds=7 * 24 * 3600, disk_dir=None):
+        super().__init__(max_entries, disk_dir)
+        self.ttl_seconds = ttl_seconds
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.v{PARSER_VERSION}.json")
+
+    def _fresh(self, value):
+        return self.ttl_seconds is None or time.time() - value[0] <= self.ttl_seconds
+
+    def _dump(self, value):
+        return json.dumps({"created": value[0], "data": value[1]}, ensure_ascii=False).encode("utf-8")
+
+    def _load(self, raw):
+        stored = json.loads(raw)
+        return stored["created"], stored["data"]
+
+    def get(self, key):
+        entry = super().get(key)  # (建立時間, 解析結果)
+        return None if entry is None else _copy_record(entry[1])
+
+    def put(self, key, data):
+        super().put(key, (time.time(), _copy_record(data)))
+
+
+transcript_cache = TranscriptCache(
+    max_entries=_env_int("SURVEY_TRANSCRIPT_CACHE_SIZE", 256),
+    ttl_seconds=_env_int("SURVEY_TRANSCRIPT_CACHE_TTL", 7 * 24 * 3600),
+    disk_dir=os.environ.get("SURVEY_TRANSCRIPT_CACHE_DIR") or None,
+)
+
+
+def transcript_digest(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def parse_transcript_cached(pdf_bytes, digest=None, all_units=False):
+    """
+    同一份謄本 (內容相同) 只解析一次，結果跨 session 共用；回傳 ([每戶資料], 警告清單, 是否可能還有其他戶)。
+    預設只解析第一戶，讀完第一戶即停 (多數謄本只有一戶)；all_units=True 時讀完全部頁面解析每一戶，
+    由使用者按「解析其他戶」或批次匯出時才用。受頁數/時間上限截斷的部分結果不寫入快取。
+    """
+    key = digest or transcript_digest(pdf_bytes)
+    if PDF_BACKEND != "pdfplumber":
+        key = f"{key}-{PDF_BACKEND}"  # 不同後端的結果分開快取
+    if all_units:
+        key += "-units"
+    record = transcript_cache.get(key)
+    if record is not None:
+        return record["units"], [], record["more"]
+    with metrics.span("transcript_parse_pdf"):
+        if all_units:
+            units, warnings = parse_transcript_units(io.BytesIO(pdf_bytes))
+            more = False
+        else:
+            data, warnings, more = _parse_first_unit(io.BytesIO(pdf_bytes))
+            units = [data] if data else []
+    if not warnings:
+        transcript_cache.put(key, {"units": units, "more": more})
+    return units, warnings, more
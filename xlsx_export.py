@@ -0,0 +1,562 @@
+import io
+import posixpath
+import re
+import struct
+import time
+import uuid
+import zipfile
+import zlib
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+# --- Zip 層級匯出引擎 ---
+# 模板的 zip 各部件原封不動保留在記憶體，匯出時只改寫工作表 XML 中的目標儲存格
+# (有冒泡位置圖時再加上 drawing/media)，其餘部件的壓縮資料逐位元組直接複製。
+# 輸出以 ZipStreamWriter 逐一寫出部件，多案件 (zip 包 / 多工作表活頁簿) 也只需保留中央目錄。
+
+NS_MAIN = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+NS_REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+NS_PKG_REL = "http://schemas.openxmlformats.org/package/2006/relationships"
+NS_XDR = "http://schemas.openxmlformats.org/drawingml/2006/spreadsheetDrawing"
+NS_A = "http://schemas.openxmlformats.org/drawingml/2006/main"
+
+REL_TYPE_DRAWING = NS_REL + "/drawing"
+REL_TYPE_IMAGE = NS_REL + "/image"
+CT_DRAWING = "application/vnd.openxmlformats-officedocument.drawing+xml"
+IMAGE_CONTENT_TYPES = {"png": "image/png", "jpeg": "image/jpeg"}
+
+EMU_PER_PIXEL = 9525
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_DOS_EPOCH = (0, 33)  # (time, date) = 1980-01-01 00:00
+_ZIP_MAX_OFFSET = 0xFFFFFFFF
+_ZIP_MAX_ENTRIES = 0xFFFF
+
+_CELL_RE = re.compile(r'<c\b([^>]*?)(?:/>|>.*?</c>)', re.S)
+_ATTR_R_RE = re.compile(r'\br="([A-Z]+[0-9]+)"')
+_ATTR_T_RE = re.compile(r'\st="[^"]*"')
+_ILLEGAL_XML_RE = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_SHEET_ELEMENT_RE = re.compile(r'<sheet\b[^>]*/>')
+_DEFINED_NAME_RE = re.compile(r'<definedName\b([^>]*)>(.*?)</definedName>', re.S)
+_LOCAL_SHEET_ID_RE = re.compile(r'\slocalSheetId="(\d+)"')
+_OVERRIDE_RE = re.compile(r'<Override\s+PartName="/([^"]+)"\s+ContentType="([^"]+)"\s*/>')
+_DEFAULT_RE = re.compile(r'<Default\s+Extension="([^"]+)"\s+ContentType="([^"]+)"\s*/>')
+_INVALID_SHEET_CHARS_RE = re.compile(r'[\[\]:*?/\\]')
+_SHEET_TAIL_TAGS = ("<legacyDrawing", "<legacyDrawingHF", "<drawingHF", "<picture", "<oleObjects",
+                    "<controls", "<webPublishItems", "<tableParts")
+
+
+class _Entry:
+    __slots__ = ("name", "flag_bits", "method", "dos_time", "dos_date", "crc", "compress_size",
+                 "file_size", "external_attr", "raw")
+
+    def __init__(self, name, flag_bits, method, dos_time, dos_date, crc, compress_size, file_size,
+                 external_attr, raw):
+        self.name = name
+        self.flag_bits = flag_bits
+        self.method = method
+        self.dos_time = dos_time
+        self.dos_date = dos_date
+        self.crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.external_attr = external_attr
+        self.raw = raw
+
+
+def _deflate_entry(name, payload, like=None):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    raw = compressor.compress(payload) + compressor.flush()
+    dos_time, dos_date = (like.dos_time, like.dos_date) if like else _DOS_EPOCH
+    flag_bits = 0 if name.isascii() else 0x800
+    return _Entry(name, flag_bits, zipfile.ZIP_DEFLATED, dos_time, dos_date, zlib.crc32(payload),
+                  len(raw), len(payload), like.external_attr if like else 0, raw)
+
+
+def _deflate_cached(name, payload, like, cache):
+    """cache ({部件名稱: (內容, _Entry)}) 中內容相同時沿用上次的壓縮結果"""
+    if cache is None:
+        return _deflate_entry(name, payload, like)
+    previous = cache.get(name)
+    if previous is not None and (previous[0] is payload or previous[0] == payload):
+        return previous[1]
+    entry = _deflate_entry(name, payload, like)
+    cache[name] = (payload, entry)
+    return entry
+
+
+def _same_images(previous, images):
+    keys = ("coord", "format", "width", "height")
+    return len(previous) == len(images) and all(
+        all(a[k] == b[k] for k in keys) and (a["data"] is b["data"] or a["data"] == b["data"])
+        for a, b in zip(previous, images))
+
+
+def _dos_now():
+    t = time.localtime()
+    return (t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2,
+            (t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday)
+
+
+def _renamed(entry, name):
+    return _Entry(name, 0 if name.isascii() else 0x800, entry.method, entry.dos_time, entry.dos_date, entry.crc,
+                  entry.compress_size, entry.file_size, entry.external_attr, entry.raw)
+
+
+def _read_entries(data):
+    """讀出 zip 內各部件的原始 (未解壓) 資料"""
+    view = memoryview(data)
+    entries = {}
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for info in zf.infolist():
+            header = _LOCAL_HEADER.unpack_from(data, info.header_offset)
+            start = info.header_offset + _LOCAL_HEADER.size + header[9] + header[10]
+            dos_date = (info.date_time[0] - 1980) << 9 | info.date_time[1] << 5 | info.date_time[2]
+            dos_time = info.date_time[3] << 11 | info.date_time[4] << 5 | info.date_time[5] // 2
+            entries[info.filename] = _Entry(
+                info.filename, info.flag_bits & ~0x08, info.compress_type, dos_time, dos_date,
+                info.CRC, info.compress_size, info.file_size, info.external_attr,
+                view[start:start + info.compress_size])
+    return entries
+
+
+class ZipStreamWriter:
+    """依序寫出 zip 部件 (不需 seek，可直接寫入檔案或網路)，記憶體只保留中央目錄"""
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.offset = 0
+        self.central = []
+
+    def write_entry(self, e):
+        name = e.name.encode('utf-8')
+        size = _LOCAL_HEADER.size + len(name) + e.compress_size
+        if self.offset + size > _ZIP_MAX_OFFSET or len(self.central) >= _ZIP_MAX_ENTRIES:
+            raise ValueError("超過 zip 格式上限 (4 GB 或 65535 個檔案)，請分批匯出")
+        self.fileobj.write(_LOCAL_HEADER.pack(0x04034b50, 20, e.flag_bits, e.method, e.dos_time, e.dos_date,
+                                              e.crc, e.compress_size, e.file_size, len(name), 0))
+        self.fileobj.write(name)
+        self.fileobj.write(e.raw)
+        self.central.append(_CENTRAL_HEADER.pack(0x02014b50, 20, 20, e.flag_bits, e.method, e.dos_time,
+                                                 e.dos_date, e.crc, e.compress_size, e.file_size, len(name),
+                                                 0, 0, 0, 0, e.external_attr, self.offset) + name)
+        self.offset += size
+
+    def add(self, name, data, compress=True):
+        """加入一個檔案；已壓縮的內容 (xlsx、圖片) 用 compress=False 直接存放"""
+        if compress:
+            entry = _deflate_entry(name, data)
+            entry.dos_time, entry.dos_date = _dos_now()
+        else:
+            dos_time, dos_date = _dos_now()
+            entry = _Entry(name, 0 if name.isascii() else 0x800, zipfile.ZIP_STORED, dos_time, dos_date,
+                           zlib.crc32(data), len(data), len(data), 0, data)
+        self.write_entry(entry)
+
+    def close(self):
+        central_size = 0
+        for record in self.central:
+            self.fileobj.write(record)
+            central_size += len(record)
+        count = len(self.central)
+        self.fileobj.write(_END_RECORD.pack(0x06054b50, 0, 0, count, count, central_size, self.offset, 0))
+        self.central = []
+
+
+def _write_zip(entries):
+    buffer = io.BytesIO()
+    writer = ZipStreamWriter(buffer)
+    for e in entries:
+        writer.write_entry(e)
+    writer.close()
+    return buffer.getvalue()
+
+
+def _resolve_target(base_part, target):
+    if target.startswith('/'):
+        return target.lstrip('/')
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base_part), target))
+
+
+def _rels_path(part):
+    return posixpath.join(posixpath.dirname(part), "_rels", posixpath.basename(part) + ".rels")
+
+
+def _relative_target(from_part, to_part):
+    return posixpath.relpath(to_part, posixpath.dirname(from_part))
+
+
+def _next_rel_id(rels_xml):
+    used = [int(n) for n in re.findall(r'Id="rId(\d+)"', rels_xml)]
+    return f"rId{max(used, default=0) + 1}"
+
+
+def _add_relationship(rels_xml, rel_id, rel_type, target):
+    rel = f'<Relationship Id="{rel_id}" Type="{rel_type}" Target="{escape(target)}"/>'
+    if rels_xml is None:
+        return ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                f'<Relationships xmlns="{NS_PKG_REL}">{rel}</Relationships>')
+    return rels_xml.replace("</Relationships>", rel + "</Relationships>", 1)
+
+
+def cell_xml(open_attrs, value):
+    """產生單一儲存格 XML (字串以 inlineStr 寫入，空值只保留格式)"""
+    if value is None or value == "":
+        return f"<c{open_attrs}/>"
+    text = escape(_ILLEGAL_XML_RE.sub('', str(value)))
+    return f'<c{open_attrs} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def picture_anchor_xml(col_idx, row_idx, width_px, height_px, shape_id, rel_id):
+    """單格錨定的圖片 (對應 openpyxl 的 ws.add_image(img, coord))，座標從 0 起算"""
+    cx = int(width_px * EMU_PER_PIXEL)
+    cy = int(height_px * EMU_PER_PIXEL)
+    return (f'<xdr:oneCellAnchor xmlns:xdr="{NS_XDR}" xmlns:a="{NS_A}" xmlns:r="{NS_REL}">'
+            f'<xdr:from><xdr:col>{col_idx}</xdr:col><xdr:colOff>0</xdr:colOff>'
+            f'<xdr:row>{row_idx}</xdr:row><xdr:rowOff>0</xdr:rowOff></xdr:from>'
+            f'<xdr:ext cx="{cx}" cy="{cy}"/>'
+            f'<xdr:pic><xdr:nvPicPr><xdr:cNvPr id="{shape_id}" name="Image {shape_id}"/>'
+            '<xdr:cNvPicPr><a:picLocks noChangeAspect="1"/></xdr:cNvPicPr></xdr:nvPicPr>'
+            f'<xdr:blipFill><a:blip r:embed="{rel_id}"/><a:stretch><a:fillRect/></a:stretch></xdr:blipFill>'
+            '<xdr:spPr><a:prstGeom prst="rect"><a:avLst/></a:prstGeom></xdr:spPr></xdr:pic>'
+            '<xdr:clientData/></xdr:oneCellAnchor>')
+
+
+def sheet_title(name, used):
+    """Excel 工作表名稱：去掉不允許的字元、最多 31 字，與 used (小寫) 重複時加 (2)、(3)..."""
+    base = _INVALID_SHEET_CHARS_RE.sub('', str(name)).strip("' ") or "工作表"
+    candidate = base[:31]
+    n = 2
+    while candidate.lower() in used:
+        suffix = f"({n})"
+        candidate = base[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def _quote_sheet_name(name):
+    return "'" + name.replace("'", "''") + "'"
+
+
+def coordinate_to_index(coord):
+    match = re.match(r'([A-Z]+)(\d+)$', coord)
+    col = 0
+    for ch in match.group(1):
+        col = col * 26 + (ord(ch) - 64)
+    return col - 1, int(match.group(2)) - 1
+
+
+class TemplatePackage:
+    """模板 xlsx 的記憶體內部件索引，可重複用來產生輸出檔"""
+
+    def __init__(self, template_bytes, sheet_title):
+        self.entries = _read_entries(template_bytes)
+        self.sheet_title = sheet_title
+        self.token = uuid.uuid4().hex  # render memo 用來辨識模板 (memo 需可 pickle，不能直接存 self)
+        self.sheet_part = self._find_sheet_part(sheet_title)
+        self.sheet_xml = self._text(self.sheet_part)
+
+        # 工作表中每個儲存格的位置：coord -> (start, end, 去掉 t 屬性的開頭屬性)
+        self.cell_spans = {}
+        for m in _CELL_RE.finditer(self.sheet_xml):
+            ref = _ATTR_R_RE.search(m.group(1))
+            if ref:
+                self.cell_spans[ref.group(1)] = (m.start(), m.end(), _ATTR_T_RE.sub('', m.group(1)))
+
+        self.sheet_rels_part = _rels_path(self.sheet_part)
+        self.drawing_part = None
+        sheet_rels = self._text(self.sheet_rels_part)
+        if sheet_rels:
+            for rel in ElementTree.fromstring(sheet_rels).iter(f"{{{NS_PKG_REL}}}Relationship"):
+                if rel.get("Type") == REL_TYPE_DRAWING:
+                    self.drawing_part = _resolve_target(self.sheet_part, rel.get("Target"))
+                    break
+
+    def _text(self, part):
+        entry = self.entries.get(part)
+        if entry is None:
+            return None
+        raw = bytes(entry.raw)
+        if entry.method == zipfile.ZIP_DEFLATED:
+            raw = zlib.decompress(raw, -15)
+        return raw.decode('utf-8')
+
+    def _find_sheet_part(self, sheet_title):
+        workbook = ElementTree.fromstring(self._text("xl/workbook.xml"))
+        rels = ElementTree.fromstring(self._text(_rels_path("xl/workbook.xml")))
+        targets = {rel.get("Id"): rel.get("Target") for rel in rels.iter(f"{{{NS_PKG_REL}}}Relationship")}
+        sheets = list(workbook.iter(f"{{{NS_MAIN}}}sheet"))
+        for sheet in sheets:
+            if sheet.get("name") == sheet_title:
+                return _resolve_target("xl/workbook.xml", targets[sheet.get(f"{{{NS_REL}}}id")])
+        raise KeyError(f"工作表不存在: {sheet_title}")
+
+    def _unused_part_name(self, pattern, taken):
+        n = 1
+        while pattern.format(n) in self.entries or pattern.format(n) in taken:
+            n += 1
+        return pattern.format(n)
+
+    def render(self, cell_values, images=(), memo=None):
+        """
+        cell_values: {coord: 字串值}，coord 必須是模板中已存在的儲存格
+        images: [{"coord", "data", "format" (png/jpeg), "width", "height"}]，寬高為像素
+        memo: 呼叫端保存的 dict (同一 session 再次匯出)；只改寫與上次不同的儲存格，
+              圖片未變時沿用上次的圖片部件，內容未變的部件沿用上次的壓縮結果。memo 可 pickle
+        回傳 xlsx 檔案內容 (bytes)
+        """
+        if memo is None:
+            replaced = self.render_parts(cell_values, images)
+            deflated = None
+        else:
+            replaced = self._render_parts_memo(cell_values, images, memo)
+            deflated = memo["deflated"]
+        output = []
+        for name, entry in self.entries.items():
+            if name in replaced:
+                output.append(_deflate_cached(name, replaced.pop(name), entry, deflated))
+            else:
+                output.append(entry)
+        for name, payload in replaced.items():
+            output.append(_deflate_cached(name, payload, None, deflated))
+        return _write_zip(output)
+
+    def render_parts(self, cell_values, images=()):
+        """改寫後的部件 {部件名稱: bytes} (工作表，有圖片時另含 drawing/media 等)，其餘部件與模板相同"""
+        pieces, _, replaced = self._sheet_pieces(cell_values, images)
+        replaced[self.sheet_part] = "".join(pieces).encode('utf-8')
+        return replaced
+
+    def _sheet_pieces(self, cell_values, images):
+        """(工作表 XML 片段, {coord: 該儲存格的片段索引}, 工作表以外改寫的部件)"""
+        edits = []
+        for coord, value in cell_values.items():
+            span = self.cell_spans.get(coord)
+            if span is None:
+                raise KeyError(f"模板中沒有儲存格 {coord}")
+            edits.append((span[0], span[1], cell_xml(span[2], value), coord))
+
+        replaced = {}
+        if images:
+            self._attach_images(images, edits, replaced)
+
+        edits.sort(key=lambda e: e[0])
+        pieces = []
+        index = {}
+        pos = 0
+        for start, end, text, coord in edits:
+            pieces.append(self.sheet_xml[pos:start])
+            if coord is not None:
+                index[coord] = len(pieces)
+            pieces.append(text)
+            pos = end
+        pieces.append(self.sheet_xml[pos:])
+        return pieces, index, replaced
+
+    def _render_parts_memo(self, cell_values, images, memo):
+        state = memo.get("state")
+        if (state is None or state["package"] != self.token or state["cells"].keys() != cell_values.keys()
+                or not _same_images(state["images"], images)):
+            pieces, index, replaced = self._sheet_pieces(cell_values, images)
+            state = memo["state"] = {"package": self.token, "cells": dict(cell_values), "images": [dict(i) for i in images],
+                                     "pieces": pieces, "index": index, "parts": replaced}
+            memo["deflated"] = {}
+        else:
+            cells, pieces = state["cells"], state["pieces"]
+            for coord, value in cell_values.items():
+                if cells[coord] != value:
+                    pieces[state["index"][coord]] = cell_xml(self.cell_spans[coord][2], value)
+                    cells[coord] = value
+        replaced = dict(state["parts"])
+        replaced[self.sheet_part] = "".join(state["pieces"]).encode('utf-8')
+        return replaced
+
+    def _sheet_owned_parts(self):
+        """只屬於目標工作表的部件 (工作表本身與其 rels 指向的 drawing、印表機設定等)，多工作表輸出時每案各複製一份"""
+        owned = [self.sheet_part]
+        sheet_rels = self._text(self.sheet_rels_part)
+        if sheet_rels:
+            for rel in ElementTree.fromstring(sheet_rels).iter(f"{{{NS_PKG_REL}}}Relationship"):
+                if rel.get("TargetMode") != "External":
+                    owned.append(_resolve_target(self.sheet_part, rel.get("Target")))
+        return owned
+
+    def write_sheets(self, fileobj, sheets):
+        """
+        多個案件寫成一個活頁簿 (直接寫入 fileobj)：每案一份目標工作表複本，依序放在原工作表的位置。
+        sheets: 可迭代的 (工作表名稱, cell_values, images)，逐案產生並寫出，記憶體不隨案件數增加。
+        圖片 (模板的 logo) 各工作表共用同一份；回傳寫入的工作表數。
+        """
+        writer = ZipStreamWriter(fileobj)
+        owned = self._sheet_owned_parts()
+        owned_set = set(owned)
+        template_types = self._text("[Content_Types].xml")
+        overrides = []
+        defaults = dict(_DEFAULT_RE.findall(template_types))
+        titles = []
+        used = set()
+
+        for k, (title, cell_values, images) in enumerate(sheets, 1):
+            replaced = self.render_parts(cell_values, images)
+            case_types = replaced.pop("[Content_Types].xml", b"").decode('utf-8')
+            if case_types:
+                defaults.update(_DEFAULT_RE.findall(case_types))
+            content_types = dict(_OVERRIDE_RE.findall(case_types or template_types))
+
+            # 部件改名為 <目錄>/case{k}_<原檔名>；新增的 media 等部件也一樣，避免與其他案件重複
+            parts = owned + [name for name in replaced if name not in self.entries and not name.endswith(".rels")]
+            renames = {name: posixpath.join(posixpath.dirname(name), f"case{k}_{posixpath.basename(name)}")
+                       for name in parts}
+            for name in parts:
+                self._write_renamed(writer, name, renames, replaced)
+                if name in content_types:
+                    overrides.append((renames[name], content_types[name]))
+                rels = _rels_path(name)
+                if rels in replaced or rels in self.entries:
+                    self._write_renamed(writer, rels, renames, replaced, source=name)
+            titles.append((sheet_title(title, used), renames[self.sheet_part]))
+
+        if not titles:
+            raise ValueError("沒有可匯出的案件")
+
+        # docProps/app.xml 的工作表清單只供顯示 (Excel 不檢查)，沿用模板
+        skip = owned_set | {_rels_path(part) for part in owned}
+        skip |= {"xl/workbook.xml", _rels_path("xl/workbook.xml"), "[Content_Types].xml"}
+        for name, entry in self.entries.items():
+            if name not in skip:
+                writer.write_entry(entry)
+
+        workbook_xml, workbook_rels = self._multi_sheet_workbook(titles)
+        writer.write_entry(_deflate_entry("xl/workbook.xml", workbook_xml.encode('utf-8'),
+                                          like=self.entries["xl/workbook.xml"]))
+        writer.write_entry(_deflate_entry(_rels_path("xl/workbook.xml"), workbook_rels.encode('utf-8'),
+                                          like=self.entries[_rels_path("xl/workbook.xml")]))
+        types = ['<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                 '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">']
+        types += [f'<Default Extension="{ext}" ContentType="{ct}"/>' for ext, ct in defaults.items()]
+        types += [f'<Override PartName="/{name}" ContentType="{ct}"/>'
+                  for name, ct in _OVERRIDE_RE.findall(template_types) if name not in owned_set]
+        types += [f'<Override PartName="/{name}" ContentType="{ct}"/>' for name, ct in overrides]
+        types.append('</Types>')
+        writer.write_entry(_deflate_entry("[Content_Types].xml", "".join(types).encode('utf-8'),
+                                          like=self.entries["[Content_Types].xml"]))
+        writer.close()
+        return len(titles)
+
+    def _write_renamed(self, writer, name, renames, replaced, source=None):
+        """寫出一個改名後的部件；rels 檔 (source 為其來源部件) 的目標一併改成新名稱"""
+        new_name = _rels_path(renames[source]) if source else renames[name]
+        if source is None and name not in replaced:
+            writer.write_entry(_renamed(self.entries[name], new_name))
+            return
+        payload = replaced[name] if name in replaced else self._text(name).encode('utf-8')
+        if source:
+            text = payload.decode('utf-8')
+            for old, new in renames.items():
+                text = text.replace(f'Target="{escape(_relative_target(source, old))}"',
+                                    f'Target="{escape(_relative_target(renames[source], new))}"')
+            payload = text.encode('utf-8')
+        elif name == self.sheet_part:
+            # 複本不保留「已選取」狀態 (否則開檔時所有工作表成為群組) 與 revision uid
+            text = payload.decode('utf-8').replace(' tabSelected="1"', '', 1)
+            payload = re.sub(r'\sxr:uid="[^"]*"', '', text, count=1).encode('utf-8')
+        writer.write_entry(_deflate_entry(new_name, payload, like=self.entries.get(name)))
+
+    def _multi_sheet_workbook(self, titles):
+        """workbook.xml 與其 rels：目標工作表換成各案件工作表，工作表層級的定義名稱 (列印範圍等) 各複製一份"""
+        workbook = self._text("xl/workbook.xml")
+        rels = self._text(_rels_path("xl/workbook.xml"))
+        sheet_elements = _SHEET_ELEMENT_RE.findall(workbook)
+        target_index = next(i for i, el in enumerate(sheet_elements)
+                            if f'name="{escape(self.sheet_title, {chr(34): "&quot;"})}"' in el)
+        target_rel_id = re.search(r'\br:id="([^"]+)"', sheet_elements[target_index]).group(1)
+        next_sheet_id = max(int(re.search(r'\bsheetId="(\d+)"', el).group(1)) for el in sheet_elements) + 1
+
+        rels = re.sub(rf'<Relationship\b[^>]*\bId="{target_rel_id}"[^>]*/>', '', rels)
+        new_elements = []
+        for i, (title, part) in enumerate(titles):
+            rel_id = _next_rel_id(rels)
+            rels = _add_relationship(rels, rel_id, NS_REL + "/worksheet", _relative_target("xl/workbook.xml", part))
+            new_elements.append(f'<sheet name="{escape(title, {chr(34): "&quot;"})}" sheetId="{next_sheet_id + i}"'
+                                f' r:id="{rel_id}"/>')
+        target_element = sheet_elements[target_index]
+        workbook = workbook.replace(target_element, "".join(new_elements), 1)
+
+        old_refs = (_quote_sheet_name(self.sheet_title) + "!", self.sheet_title + "!")
+
+        def expand(m):
+            local = _LOCAL_SHEET_ID_RE.search(m.group(1))
+            if local is None or int(local.group(1)) < target_index:
+                return m.group(0)
+            index = int(local.group(1))
+            if index > target_index:
+                attrs = _LOCAL_SHEET_ID_RE.sub(f' localSheetId="{index + len(titles) - 1}"', m.group(1))
+                return f'<definedName{attrs}>{m.group(2)}</definedName>'
+            copies = []
+            for i, (title, _) in enumerate(titles):
+                formula = m.group(2)
+                for ref in old_refs:
+                    formula = formula.replace(escape(ref), escape(_quote_sheet_name(title) + "!"))
+                attrs = _LOCAL_SHEET_ID_RE.sub(f' localSheetId="{target_index + i}"', m.group(1))
+                copies.append(f'<definedName{attrs}>{formula}</definedName>')
+            return "".join(copies)
+
+        workbook = _DEFINED_NAME_RE.sub(expand, workbook)
+        # 原工作表的位置已改變，開檔時停在第一個工作表
+        workbook = re.sub(r'\sactiveTab="\d+"', '', workbook)
+        return workbook, rels
+
+    def _attach_images(self, images, sheet_edits, replaced):
+        content_types = self._text("[Content_Types].xml")
+
+        drawing_part = self.drawing_part
+        if drawing_part:
+            drawing_xml = self._text(drawing_part)
+            drawing_rels = self._text(_rels_path(drawing_part))
+        else:
+            drawing_part = self._unused_part_name("xl/drawings/drawing{}.xml", replaced)
+            drawing_xml = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                           f'<xdr:wsDr xmlns:xdr="{NS_XDR}" xmlns:a="{NS_A}"></xdr:wsDr>')
+            drawing_rels = None
+            content_types = content_types.replace(
+                "</Types>", f'<Override PartName="/{drawing_part}" ContentType="{CT_DRAWING}"/></Types>', 1)
+
+            sheet_rels = self._text(self.sheet_rels_part)
+            rel_id = _next_rel_id(sheet_rels or "")
+            replaced[self.sheet_rels_part] = _add_relationship(
+                sheet_rels, rel_id, REL_TYPE_DRAWING, _relative_target(self.sheet_part, drawing_part)).encode('utf-8')
+            candidates = [self.sheet_xml.find(tag) for tag in _SHEET_TAIL_TAGS]
+            candidates.append(self.sheet_xml.rfind("<extLst"))
+            candidates = [p for p in candidates if p != -1]
+            insert_at = min(candidates) if candidates else self.sheet_xml.rfind("</worksheet>")
+            sheet_edits.append((insert_at, insert_at, f'<drawing xmlns:r="{NS_REL}" r:id="{rel_id}"/>', None))
+
+        shape_ids = [int(n) for n in re.findall(r'<(?:\w+:)?cNvPr\b[^>]*?\bid="(\d+)"', drawing_xml)]
+        next_shape_id = max(shape_ids, default=0) + 1
+        anchors = []
+        for image in images:
+            ext = image["format"]
+            if ext not in IMAGE_CONTENT_TYPES:
+                raise ValueError(f"不支援的圖片格式: {ext}")
+            media_part = self._unused_part_name("xl/media/image{}." + ext, replaced)
+            replaced[media_part] = image["data"]
+            if not re.search(rf'<Default\s+Extension="{ext}"', content_types, re.I):
+                content_types = content_types.replace(
+                    "</Types>", f'<Default Extension="{ext}" ContentType="{IMAGE_CONTENT_TYPES[ext]}"/></Types>', 1)
+
+            rel_id = _next_rel_id(drawing_rels or "")
+            drawing_rels = _add_relationship(drawing_rels, rel_id, REL_TYPE_IMAGE,
+                                             _relative_target(drawing_part, media_part))
+            col_idx, row_idx = coordinate_to_index(image["coord"])
+            anchors.append(picture_anchor_xml(col_idx, row_idx, image["width"], image["height"],
+                                              next_shape_id, rel_id))
+            next_shape_id += 1
+
+        root_close = re.search(r'</(?:\w+:)?wsDr>\s*$', drawing_xml)
+        drawing_xml = drawing_xml[:root_close.start()] + "".join(anchors) + drawing_xml[root_close.start():]
+        replaced[drawing_part] = drawing_xml.encode('utf-8')
+        replaced[_rels_path(drawing_part)] = drawing_rels.encode('utf-8')
+        replaced["[Content_Types].xml"] = content_types.encode('utf-8')